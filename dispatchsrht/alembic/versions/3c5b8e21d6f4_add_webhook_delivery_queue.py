@@ -0,0 +1,39 @@
+"""Add webhook delivery queue
+
+Revision ID: 3c5b8e21d6f4
+Revises: 101d96a6baaf
+Create Date: 2026-10-18 16:04:12.381204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c5b8e21d6f4'
+down_revision = '101d96a6baaf'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('webhook_delivery',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('created', sa.DateTime, nullable=False),
+        sa.Column('updated', sa.DateTime, nullable=False),
+        sa.Column('endpoint', sa.Unicode(256), nullable=False),
+        sa.Column('path', sa.Unicode(1024), nullable=False),
+        sa.Column('view_args', sa.Unicode, nullable=False),
+        sa.Column('headers', sa.Unicode, nullable=False),
+        sa.Column('body', sa.Unicode, nullable=False),
+        sa.Column('status', sa.String, nullable=False),
+        sa.Column('attempts', sa.Integer, nullable=False),
+        sa.Column('run_after', sa.DateTime, nullable=False),
+        sa.Column('claimed', sa.DateTime),
+        sa.Column('response_code', sa.Integer),
+        sa.Column('response', sa.Unicode))
+    op.create_index('ix_webhook_delivery_status_run_after',
+        'webhook_delivery', ['status', 'run_after'])
+
+
+def downgrade():
+    op.drop_index('ix_webhook_delivery_status_run_after')
+    op.drop_table('webhook_delivery')
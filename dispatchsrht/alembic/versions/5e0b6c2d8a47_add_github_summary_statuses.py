@@ -0,0 +1,35 @@
+"""Add GitHub summary statuses
+
+Revision ID: 5e0b6c2d8a47
+Revises: e7a90d3f5c18
+Create Date: 2026-10-18 18:12:55.730462
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e0b6c2d8a47'
+down_revision = 'e7a90d3f5c18'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.alter_column('github_job', 'pr', nullable=True)
+    op.add_column('github_job', sa.Column('status', sa.Unicode(32),
+        nullable=False, server_default='running'))
+    op.create_index('ix_github_job_task_id_sha', 'github_job',
+        ['task_id', 'sha'])
+    op.add_column('github_commit_to_build', sa.Column('status_mode',
+        sa.Unicode(16), nullable=False, server_default='jobs'))
+    op.add_column('github_pr_to_build', sa.Column('status_mode',
+        sa.Unicode(16), nullable=False, server_default='jobs'))
+
+
+def downgrade():
+    op.drop_column('github_pr_to_build', 'status_mode')
+    op.drop_column('github_commit_to_build', 'status_mode')
+    op.drop_index('ix_github_job_task_id_sha')
+    op.drop_column('github_job', 'status')
+    op.execute("DELETE FROM github_job WHERE pr IS NULL")
+    op.alter_column('github_job', 'pr', nullable=False)
@@ -0,0 +1,30 @@
+"""Add task name and dashboard indexes
+
+Revision ID: 6b1e93d07f2c
+Revises: d2f6c4a19e70
+Create Date: 2026-10-18 20:11:05.648392
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b1e93d07f2c'
+down_revision = 'd2f6c4a19e70'
+
+from alembic import op
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("""
+        CREATE INDEX ix_task_name_trgm ON task
+        USING gin (name gin_trgm_ops)
+    """)
+    op.execute("""
+        CREATE INDEX ix_task_user_id_updated ON task
+        (user_id, updated DESC, id DESC)
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_task_user_id_updated')
+    op.drop_index('ix_task_name_trgm')
@@ -0,0 +1,32 @@
+"""Add push coalescing
+
+Revision ID: 8f2e4a7c91b3
+Revises: 3c5b8e21d6f4
+Create Date: 2026-10-18 16:31:47.902115
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8f2e4a7c91b3'
+down_revision = '3c5b8e21d6f4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('webhook_delivery', sa.Column('coalesce_key',
+        sa.Unicode(1024)))
+    op.create_index('ix_webhook_delivery_coalesce_key',
+        'webhook_delivery', ['coalesce_key'])
+    op.add_column('github_commit_to_build', sa.Column('debounce',
+        sa.Integer, nullable=False, server_default='0'))
+    op.add_column('gitlab_commit_to_build', sa.Column('debounce',
+        sa.Integer, nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('gitlab_commit_to_build', 'debounce')
+    op.drop_column('github_commit_to_build', 'debounce')
+    op.drop_index('ix_webhook_delivery_coalesce_key')
+    op.drop_column('webhook_delivery', 'coalesce_key')
@@ -0,0 +1,27 @@
+"""Track every GitHub manifest
+
+Revision ID: a6c2e9f14b37
+Revises: f3a8e5b26c91
+Create Date: 2026-10-18 22:14:37.502816
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a6c2e9f14b37'
+down_revision = 'f3a8e5b26c91'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.alter_column('github_job', 'job_id', nullable=True)
+    op.add_column('github_job', sa.Column('callback_id', sa.Unicode(32)))
+    op.create_index('ix_github_job_callback_id', 'github_job', ['callback_id'])
+
+
+def downgrade():
+    op.execute("DELETE FROM github_job WHERE job_id IS NULL")
+    op.drop_index('ix_github_job_callback_id', 'github_job')
+    op.drop_column('github_job', 'callback_id')
+    op.alter_column('github_job', 'job_id', nullable=False)
@@ -0,0 +1,42 @@
+"""Add build_callback
+
+Revision ID: a83d0f6e2b15
+Revises: 5e0b6c2d8a47
+Create Date: 2026-10-18 19:02:11.317480
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a83d0f6e2b15'
+down_revision = '5e0b6c2d8a47'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('build_callback',
+        sa.Column('id', sa.Unicode(32), primary_key=True),
+        sa.Column('created', sa.DateTime, nullable=False),
+        sa.Column('updated', sa.DateTime, nullable=False),
+        sa.Column('task_id', sa.Integer,
+            sa.ForeignKey("task.id", ondelete="CASCADE"), nullable=False),
+        sa.Column('user_id', sa.Integer,
+            sa.ForeignKey("user.id", ondelete="CASCADE"), nullable=False),
+        sa.Column('upstream', sa.Unicode),
+        sa.Column('repo', sa.Unicode, nullable=False),
+        sa.Column('sha', sa.Unicode(40), nullable=False),
+        sa.Column('context', sa.Unicode, nullable=False),
+        sa.Column('pr', sa.Integer),
+        sa.Column('automerge', sa.Boolean, nullable=False),
+        sa.Column('status_mode', sa.Unicode(16)))
+    op.create_index('ix_build_callback_task_id_sha', 'build_callback',
+        ['task_id', 'sha'])
+    op.create_index('ix_build_callback_created', 'build_callback',
+        ['created'])
+
+
+def downgrade():
+    op.drop_index('ix_build_callback_created')
+    op.drop_index('ix_build_callback_task_id_sha')
+    op.drop_table('build_callback')
@@ -0,0 +1,25 @@
+"""Add build_outbox.callback_id
+
+Revision ID: b8d31f6c0e52
+Revises: a6c2e9f14b37
+Create Date: 2026-10-18 22:41:05.176093
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b8d31f6c0e52'
+down_revision = 'a6c2e9f14b37'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('build_outbox', sa.Column('callback_id', sa.Unicode(32)))
+    op.create_index('ix_build_outbox_callback_id', 'build_outbox',
+        ['callback_id'])
+
+
+def downgrade():
+    op.drop_index('ix_build_outbox_callback_id', 'build_outbox')
+    op.drop_column('build_outbox', 'callback_id')
@@ -0,0 +1,33 @@
+"""Add github_job
+
+Revision ID: c41d7be05a92
+Revises: 8f2e4a7c91b3
+Create Date: 2026-10-18 16:52:09.113840
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7be05a92'
+down_revision = '8f2e4a7c91b3'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('github_job',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('created', sa.DateTime, nullable=False),
+        sa.Column('updated', sa.DateTime, nullable=False),
+        sa.Column('task_id', sa.Integer,
+            sa.ForeignKey("task.id", ondelete="CASCADE"), nullable=False),
+        sa.Column('pr', sa.Integer, nullable=False),
+        sa.Column('sha', sa.Unicode(40), nullable=False),
+        sa.Column('job_id', sa.Integer, nullable=False),
+        sa.Column('name', sa.Unicode(1024)))
+    op.create_index('ix_github_job_task_id_pr', 'github_job', ['task_id', 'pr'])
+    op.create_index('ix_github_job_job_id', 'github_job', ['job_id'])
+
+
+def downgrade():
+    op.drop_table('github_job')
@@ -0,0 +1,23 @@
+"""Drop unused build_callback index
+
+Revision ID: c5f19a7d3e20
+Revises: b8d31f6c0e52
+Create Date: 2026-10-19 10:12:47.503118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c5f19a7d3e20'
+down_revision = 'b8d31f6c0e52'
+
+from alembic import op
+
+
+def upgrade():
+    # Callbacks are only ever looked up by ID
+    op.drop_index('ix_build_callback_task_id_sha')
+
+
+def downgrade():
+    op.create_index('ix_build_callback_task_id_sha', 'build_callback',
+        ['task_id', 'sha'])
@@ -0,0 +1,37 @@
+"""Deduplicate GitHub and GitLab authorizations
+
+Revision ID: d2f6c4a19e70
+Revises: a83d0f6e2b15
+Create Date: 2026-10-18 19:48:37.204116
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd2f6c4a19e70'
+down_revision = 'a83d0f6e2b15'
+
+from alembic import op
+
+
+def upgrade():
+    # Keep only the most recent authorization of each user
+    op.execute("""
+        DELETE FROM github_authorization a
+        USING github_authorization b
+        WHERE a.user_id = b.user_id AND a.id < b.id
+    """)
+    op.execute("""
+        DELETE FROM gitlab_authorization a
+        USING gitlab_authorization b
+        WHERE a.user_id = b.user_id AND a.upstream = b.upstream
+            AND a.id < b.id
+    """)
+    op.create_index('ix_github_authorization_user_id',
+        'github_authorization', ['user_id'], unique=True)
+    op.create_index('ix_gitlab_authorization_user_id_upstream',
+        'gitlab_authorization', ['user_id', 'upstream'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_gitlab_authorization_user_id_upstream')
+    op.drop_index('ix_github_authorization_user_id')
@@ -0,0 +1,32 @@
+"""Add build_outbox
+
+Revision ID: e7a90d3f5c18
+Revises: c41d7be05a92
+Create Date: 2026-10-18 17:40:26.551093
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e7a90d3f5c18'
+down_revision = 'c41d7be05a92'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('build_outbox',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('created', sa.DateTime, nullable=False),
+        sa.Column('updated', sa.DateTime, nullable=False),
+        sa.Column('user_id', sa.Integer,
+            sa.ForeignKey("user.id", ondelete="CASCADE"), nullable=False),
+        sa.Column('manifest', sa.Unicode, nullable=False),
+        sa.Column('tags', sa.Unicode, nullable=False),
+        sa.Column('note', sa.Unicode),
+        sa.Column('secrets', sa.Boolean, nullable=False),
+        sa.Column('attempts', sa.Integer, nullable=False))
+
+
+def downgrade():
+    op.drop_table('build_outbox')
@@ -0,0 +1,33 @@
+"""Add github_org_hook
+
+Revision ID: f3a8e5b26c91
+Revises: 6b1e93d07f2c
+Create Date: 2026-10-18 21:03:52.918274
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8e5b26c91'
+down_revision = '6b1e93d07f2c'
+
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils as sau
+
+
+def upgrade():
+    op.create_table('github_org_hook',
+        sa.Column('id', sau.UUIDType, primary_key=True),
+        sa.Column('created', sa.DateTime, nullable=False),
+        sa.Column('updated', sa.DateTime, nullable=False),
+        sa.Column('user_id', sa.Integer,
+            sa.ForeignKey("user.id", ondelete="CASCADE"), nullable=False),
+        sa.Column('org', sa.Unicode(1024), nullable=False),
+        sa.Column('github_webhook_id', sa.Integer, nullable=False))
+    op.create_index('ix_github_org_hook_user_id_org', 'github_org_hook',
+        ['user_id', 'org'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_github_org_hook_user_id_org')
+    op.drop_table('github_org_hook')
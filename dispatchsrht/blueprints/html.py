@@ -1,14 +1,17 @@
+from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, abort
 from flask import session
 from srht.config import cfg
 from srht.database import db
-from srht.flask import paginate_query
 from srht.oauth import current_user, loginrequired
 from dispatchsrht.types import Task
 import requests
+import sqlalchemy as sa
 
 html = Blueprint('html', __name__)
 
+_tasks_per_page = 10
+
 @html.route("/")
 def index():
     if not current_user:
@@ -17,10 +20,50 @@ def index():
     search = request.args.get("search")
     if search:
         tasks = tasks.filter(Task.name.ilike("%" + search + "%"))
-    tasks = tasks.order_by(Task.updated.desc())
-    tasks, pagination = paginate_query(tasks)
-    return render_template("dashboard.html",
-            tasks=tasks, search=search, **pagination)
+    # Pages are keyed on the first or last task of the adjacent page, rather
+    # than offset, so that every page costs the same
+    after = request.args.get("after")
+    before = request.args.get("before")
+    try:
+        if after:
+            tasks = tasks.filter(
+                    sa.tuple_(Task.updated, Task.id) < parse_cursor(after))
+        elif before:
+            tasks = tasks.filter(
+                    sa.tuple_(Task.updated, Task.id) > parse_cursor(before))
+    except ValueError:
+        abort(400)
+    # Previous pages are fetched oldest first, then put back in order
+    backwards = bool(before and not after)
+    if backwards:
+        tasks = tasks.order_by(Task.updated, Task.id)
+    else:
+        tasks = tasks.order_by(Task.updated.desc(), Task.id.desc())
+    tasks = tasks.limit(_tasks_per_page + 1).all()
+    more = len(tasks) > _tasks_per_page
+    tasks = tasks[:_tasks_per_page]
+    if backwards:
+        tasks.reverse()
+    next_page, prev_page = None, None
+    if tasks:
+        if more or backwards:
+            next_page = task_cursor(tasks[-1])
+        if (more and backwards) or after:
+            prev_page = task_cursor(tasks[0])
+    return render_template("dashboard.html", tasks=tasks, search=search,
+            next_page=next_page, prev_page=prev_page)
+
+def task_cursor(task):
+    """Returns the dashboard page cursor for a task."""
+    return f"{task.updated.isoformat()}_{task.id}"
+
+def parse_cursor(cursor):
+    """
+    Parses a dashboard page cursor into an (updated, id) tuple. Raises
+    ValueError if it is malformed.
+    """
+    updated, task_id = cursor.split("_")
+    return datetime.fromisoformat(updated), int(task_id)
 
 @html.route("/configure")
 @loginrequired
@@ -1,29 +1,58 @@
-import base64
 import json
 import re
+import random
 import requests
-import yaml
-from cryptography.fernet import Fernet
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from dispatchsrht import keyring
+from dispatchsrht.circuit import CircuitBreaker
+from dispatchsrht.manifests import dump_manifest
+from dispatchsrht.types import BuildCallback, OutboxBuild
 from flask import url_for
+from requests.adapters import HTTPAdapter
+from secrets import token_urlsafe
 from srht.api import get_authorization
-from srht.config import cfg
-from typing import Any, Callable, Dict, Iterable, Tuple
+from srht.config import cfg, cfgi
+from srht.database import db
+from urllib3.exceptions import NewConnectionError
+from typing import Any, Callable, Dict, Iterable, List, Tuple
 
 _root = cfg("dispatch.sr.ht", "origin")
 _builds_sr_ht = cfg("builds.sr.ht", "origin", default=None)
-_secret_key = cfg("sr.ht", "service-key",
-        default=cfg("sr.ht", "secret-key", default=None))
-_kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=_secret_key.encode(),
-        iterations=100000,
-        backend=default_backend())
-_key = base64.urlsafe_b64encode(_kdf.derive(_secret_key.encode()))
-_fernet = Fernet(_key)
+
+_submit_concurrency = cfgi("dispatch.sr.ht", "builds-concurrency", default=4)
+_timeout = (3.05, cfgi("dispatch.sr.ht", "builds-timeout", default=10))
+_retries = cfgi("dispatch.sr.ht", "builds-retries", default=2)
+_backoff = 0.5
+_callback_retention = timedelta(days=7)
+# Shared by every submission so that connections to builds.sr.ht are reused
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_maxsize=_submit_concurrency))
+_session.mount("https://", HTTPAdapter(pool_maxsize=_submit_concurrency))
+
+class BuildsUnavailable(Exception):
+    """Raised when builds.sr.ht is down and a request was not sent."""
+    pass
+
+def _flush_in_background():
+    def flush():
+        try:
+            flush_outbox()
+        except Exception:
+            db.session.rollback()
+        finally:
+            db.session.remove()
+    threading.Thread(target=flush, daemon=True).start()
+
+# Called with the callback ID, and the job ID or error text, of each build
+# submitted from the outbox
+_outbox_handlers = []
+
+_breaker = CircuitBreaker(threshold=5, reset_after=30,
+        on_close=_flush_in_background)
 
 if _builds_sr_ht:
     from buildsrht.manifest import Manifest
@@ -34,13 +63,147 @@ def first_line(text):
         return text
     return text[:text.index("\n") + 1]
 
-def encrypt_notify_url(route, payload):
-    encpayload = _fernet.encrypt(
-            json.dumps(payload).encode()).decode()
-    return _root + url_for(route, payload=encpayload)
-
 def decrypt_notify_payload(payload):
-    return json.loads(_fernet.decrypt(payload.encode()).decode())
+    """Decrypts the payload of a notify URL from before build callbacks."""
+    return json.loads(keyring.decrypt(payload.encode()).decode())
+
+def register_callback(route, **fields):
+    """
+    Records the completion callback of a build and returns its ID and its
+    URL, which only carries the ID. The callback is committed with the build.
+    """
+    callback = BuildCallback(**fields)
+    callback.id = token_urlsafe(16)
+    db.session.add(callback)
+    return callback.id, _root + url_for(route, callback_id=callback.id)
+
+def revoke_callback(callback_id):
+    """Revokes the completion callback of a build."""
+    BuildCallback.query.filter(
+            BuildCallback.id == callback_id,
+        ).delete(synchronize_session=False)
+
+def unqueue_build(callback_id) -> bool:
+    """
+    Removes a build from the outbox before it is submitted. Returns False if
+    it is no longer there.
+    """
+    return OutboxBuild.query.filter(
+            OutboxBuild.callback_id == callback_id,
+        ).delete(synchronize_session=False) > 0
+
+def prune_callbacks():
+    """Deletes completion callbacks old enough that no build is running."""
+    BuildCallback.query.filter(
+            BuildCallback.created < datetime.utcnow() - _callback_retention,
+        ).delete(synchronize_session=False)
+    db.session.commit()
+
+def _unsent(ex):
+    """True if a request failed before anything was sent to builds.sr.ht."""
+    if isinstance(ex, requests.ConnectTimeout):
+        return True
+    reason = getattr(ex.args[0], "reason", None) if ex.args else None
+    return isinstance(reason, NewConnectionError)
+
+def _request(method, path, idempotent=False, **kwargs):
+    """
+    Makes a request to builds.sr.ht with a deadline. Failures which are safe
+    to retry are retried with jittered backoff: for idempotent requests any
+    connection error or gateway error, and otherwise only those where the
+    request was never received. Raises BuildsUnavailable if the circuit
+    breaker is open, or if builds.sr.ht could not be reached at all.
+    """
+    retry_statuses = [502, 503, 504] if idempotent else [503]
+    for attempt in range(_retries + 1):
+        if not _breaker.allow():
+            raise BuildsUnavailable()
+        try:
+            resp = _session.request(method, _builds_sr_ht + path,
+                    timeout=_timeout, **kwargs)
+        except requests.RequestException as ex:
+            _breaker.failure()
+            unsent = _unsent(ex)
+            if not unsent and not idempotent:
+                raise
+            if attempt == _retries:
+                if unsent:
+                    raise BuildsUnavailable() from ex
+                raise
+        else:
+            if resp.status_code < 500:
+                _breaker.success()
+                return resp
+            _breaker.failure()
+            if resp.status_code not in retry_statuses or attempt == _retries:
+                return resp
+        time.sleep(random.uniform(0, _backoff * 2 ** attempt))
+
+def on_outbox_result(handler):
+    """
+    Registers a handler for builds which were held in the outbox. Once a held
+    build has been submitted or rejected by builds.sr.ht, each handler is
+    called with its callback ID, the job ID if it was submitted, and the
+    error text from builds.sr.ht if it was rejected.
+    """
+    _outbox_handlers.append(handler)
+    return handler
+
+def _outbox(user, job, callback_id=None):
+    build = OutboxBuild()
+    build.callback_id = callback_id
+    build.user_id = user.id
+    build.manifest = job["manifest"]
+    build.tags = json.dumps(job["tags"])
+    build.note = job["note"]
+    build.secrets = job["secrets"]
+    build.attempts = 0
+    db.session.add(build)
+
+def flush_outbox():
+    """
+    Submits the builds which were held while builds.sr.ht was down. Stops at
+    the first failure. Safe to run concurrently from several processes.
+    Builds which builds.sr.ht rejects are reported to the on_outbox_result
+    handlers with the error text.
+    """
+    while True:
+        build = (OutboxBuild.query
+                .order_by(OutboxBuild.id)
+                .with_for_update(skip_locked=True)
+                .first())
+        if not build:
+            db.session.commit()
+            return
+        try:
+            resp = _request("POST", "/api/jobs", json={
+                "manifest": build.manifest,
+                "tags": json.loads(build.tags),
+                "note": build.note,
+                "secrets": build.secrets,
+            }, headers=get_authorization(build.user))
+        except (BuildsUnavailable, requests.RequestException):
+            db.session.rollback()
+            return
+        if resp.status_code < 500:
+            # Either submitted, or rejected in a way which won't change
+            callback_id = build.callback_id
+            if resp.status_code == 200:
+                job_id, error = resp.json()["id"], None
+            else:
+                job_id, error = None, resp.text
+            db.session.delete(build)
+            db.session.commit()
+            for handler in _outbox_handlers:
+                try:
+                    handler(callback_id, job_id, error)
+                except Exception:
+                    db.session.rollback()
+                    traceback.print_exc()
+            continue
+        build.attempts += 1
+        db.session.commit()
+        return
 
 def submit_build(build_tag,
         manifests: Iterable[Tuple[str, Manifest]],
@@ -48,10 +211,21 @@ def submit_build(build_tag,
         note: str=None,
         secrets: bool=False,
         preparing: Callable[[str], Any]=None,
-        submitted: Callable[[str, str], str]=None) -> str:
+        submitted: Callable[[str, str], str]=None,
+        held: Callable[[str], Any]=None,
+        callbacks: Dict[str, str]=None) -> Tuple[List[Tuple[str, str]],
+                List[str]]:
     """
-    Submits a build, or builds, to builds.sr.ht. Returns a user-friendly
-    summary of the builds submitted.
+    Submits a build, or builds, to builds.sr.ht. Returns a list of (name, job
+    URL) tuples for the manifests which were submitted or held, in the same
+    order as the manifests, and a list of the errors for those which were
+    not. A failed manifest does not stop the others from being submitted.
+    The caller must commit the session, which holds any held manifests.
+
+    Up to builds-concurrency manifests are submitted at once. The callbacks
+    are always run on the calling thread, in the order of the manifests.
+    Manifests which cannot be submitted because builds.sr.ht is down are held
+    in the outbox, and submitted once it is back up.
 
     @build_tag:      Build tags for this set of manifests, usually a repo name
     @manifests:      List of build manifests to submit and their names
@@ -61,28 +235,79 @@ def submit_build(build_tag,
     @preparing:      A callable called when each manifest is being prepared
                      Called with the manifest name.
     @submitted:      A callable called when each manifest has been submitted.
-                     Called with the manifest name and the job URL. Should
+                     Called with the manifest name and the job ID. Should
                      return a brief statement for the summary string.
+    @held:           A callable called when a manifest is held in the outbox.
+                     Called with the manifest name.
+    @callbacks:      The completion callback ID of each manifest, by name.
+                     Passed to the on_outbox_result handlers once a held
+                     manifest is submitted.
+    """
+    build_tag = [re.sub(r"[^a-z0-9_.-]", "", bt.lower()) for bt in build_tag]
+    headers = get_authorization(user)
+
+    jobs = []
+    with ThreadPoolExecutor(max_workers=_submit_concurrency) as executor:
+        for name, manifest in manifests:
+            if preparing:
+                preparing(name)
+            tag = re.sub(r"[^a-z0-9_.-]", "", name.lower()) if name else None
+            job = {
+                "manifest": dump_manifest(manifest),
+                "tags": build_tag + ([tag] if tag else []),
+                "note": note,
+                "secrets": secrets,
+            }
+            jobs.append((name, tag, job, executor.submit(_request,
+                "POST", "/api/jobs", json=job, headers=headers)))
+
+        errors = []
+        build_urls = []
+        for name, tag, job, future in jobs:
+            try:
+                resp = future.result()
+            except BuildsUnavailable:
+                _outbox(user, job, (callbacks or {}).get(name))
+                build_urls.append((tag,
+                    "queued until builds.sr.ht is available"))
+                if held:
+                    held(name)
+                continue
+            except requests.RequestException as ex:
+                errors.append((f"{name}: " if name else "") +
+                        f"Unable to reach builds.sr.ht: {ex}")
+                continue
+            if resp.status_code != 200:
+                errors.append((f"{name}: " if name else "") + resp.text)
+                continue
+            build_id = resp.json()["id"]
+            build_url = "{}/~{}/job/{}".format(
+                    _builds_sr_ht, user.username, build_id)
+            build_urls.append((tag, build_url))
+            if submitted:
+                submitted(name, build_id)
+    return build_urls, errors
+
+def describe_builds(build_urls, errors) -> str:
+    """Describes the result of submit_build, for a webhook response."""
+    text = ""
+    if build_urls:
+        text = "Submitted:\n\n" + "\n".join(
+                f"{name}: {url}" for name, url in build_urls)
+    if errors:
+        if text:
+            text += "\n\n"
+        text += "Not submitted:\n\n" + "\n".join(errors)
+    return text
+
+def cancel_build(user, build_id) -> bool:
+    """
+    Cancels a build on builds.sr.ht. Returns True if builds.sr.ht accepted the
+    request.
     """
-    build_urls = []
-    for name, manifest in manifests:
-        if preparing:
-            preparing(name)
-        build_tag = [re.sub(r"[^a-z0-9_.-]", "", bt.lower()) for bt in build_tag]
-        if name:
-            name = re.sub(r"[^a-z0-9_.-]", "", name.lower())
-        resp = requests.post(_builds_sr_ht + "/api/jobs", json={
-            "manifest": yaml.dump(manifest.to_dict(), default_flow_style=False),
-            "tags": build_tag + ([name] if name else []),
-            "note": note,
-            "secrets": secrets,
-        }, headers=get_authorization(user))
-        if resp.status_code != 200:
-            return resp.text
-        build_id = resp.json()["id"]
-        build_url = "{}/~{}/job/{}".format(
-                _builds_sr_ht, user.username, build_id)
-        build_urls.append((name, build_url))
-        if submitted:
-            submitted(name, build_id)
-    return build_urls
+    try:
+        resp = _request("POST", f"/api/jobs/{build_id}/cancel",
+                idempotent=True, headers=get_authorization(user))
+    except (BuildsUnavailable, requests.RequestException):
+        return False
+    return resp.status_code == 200
@@ -0,0 +1,147 @@
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dispatchsrht.routing import routing_cache
+from dispatchsrht.types import Task
+from flask import abort, jsonify, render_template, request, url_for
+from functools import wraps
+from srht.config import cfg, cfgi
+from srht.database import db
+from srht.oauth import current_user
+from uuid import uuid4
+
+_root = cfg("dispatch.sr.ht", "origin")
+_concurrency = cfgi("dispatch.sr.ht", "bulk-configure-concurrency", default=8)
+
+def json_only(f):
+    """
+    Rejects requests without a JSON body. Bulk configure views which are
+    exempt from CSRF protection for scripts must use this: browsers do not
+    send a cross-origin application/json request without a CORS preflight,
+    which this service never allows, so such a request can only come from
+    the user's own client.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not request.is_json:
+            abort(415)
+        return f(*args, **kwargs)
+    return wrapper
+
+def requested_repos():
+    """
+    Returns the repositories named by a bulk configure request, either as a
+    JSON body of the form {"repos": [...]} sent to a .../bulk.json view, or
+    as repeated "repo" form fields from the bulk configure page.
+    """
+    if request.is_json:
+        return [str(repo) for repo in
+                (request.get_json(silent=True) or dict()).get("repos") or []]
+    return request.form.getlist("repo")
+
+def configure_many(taskdef, record_cls, repos, setup, create_hook,
+        delete_hook, hook_field):
+    """
+    Configures a task for each of several repositories. The tasks and their
+    records are committed first, then the remote hooks are created
+    concurrently with no transaction open, and their IDs are committed in a
+    second transaction. Tasks whose hook could not be created are not kept.
+    If the second transaction fails, the hooks which were created are
+    deleted again.
+
+    @repos:       A list of (name, repo) tuples
+    @setup:       Called with each new record and its repo, to fill it in.
+    @create_hook: Called on a worker thread with each repo and the URL of
+                  its webhook, returns the ID of the remote hook. It must not
+                  use the database session.
+    @delete_hook: Called with a repo and the ID returned by create_hook.
+    @hook_field:  The record's column for the ID of the remote hook.
+
+    Returns a list of (name, task ID, error) tuples.
+    """
+    if not repos:
+        return []
+    tasks = list()
+    for name, _ in repos:
+        task = Task()
+        task.name = "{}::{}".format(name, taskdef)
+        task.user_id = current_user.id
+        task._taskdef = taskdef
+        tasks.append(task)
+    db.session.add_all(tasks)
+    db.session.flush()
+    records = list()
+    for task, (_, repo) in zip(tasks, repos):
+        record = record_cls()
+        record.id = uuid4()
+        record.user_id = current_user.id
+        record.task_id = task.id
+        setattr(record, hook_field, -1)
+        setup(record, repo)
+        records.append(record)
+    db.session.add_all(records)
+    work = [(repo, _root + url_for(f"{taskdef}._webhook", record_id=record.id))
+            for (_, repo), record in zip(repos, records)]
+    ids = [(task.id, record.id) for task, record in zip(tasks, records)]
+    db.session.commit()
+
+    def run(args):
+        repo, url = args
+        try:
+            return create_hook(repo, url), None
+        except Exception as ex:
+            return None, str(ex) or type(ex).__name__
+    with ThreadPoolExecutor(
+            max_workers=min(len(work), _concurrency)) as executor:
+        hooks = list(executor.map(run, work))
+
+    results = list()
+    try:
+        for (name, _), (task_id, record_id), (hook_id, error) in zip(
+                repos, ids, hooks):
+            if error:
+                record_cls.query.filter(record_cls.id == record_id).delete(
+                        synchronize_session=False)
+                Task.query.filter(Task.id == task_id).delete(
+                        synchronize_session=False)
+                results.append((name, None, error))
+            else:
+                record_cls.query.filter(record_cls.id == record_id).update(
+                        {hook_field: hook_id}, synchronize_session=False)
+                results.append((name, task_id, None))
+        # The updates bypass the ORM, which would otherwise do this
+        routing_cache.invalidate()
+        db.session.commit()
+    except:
+        db.session.rollback()
+        for (_, repo), (hook_id, error) in zip(repos, hooks):
+            if error:
+                continue
+            try:
+                delete_hook(repo, hook_id)
+            except Exception:
+                traceback.print_exc()
+        # Don't leave tasks behind which have no hook
+        try:
+            task_ids = [task_id for task_id, _ in ids]
+            record_cls.query.filter(record_cls.task_id.in_(task_ids)).delete(
+                    synchronize_session=False)
+            Task.query.filter(Task.id.in_(task_ids)).delete(
+                    synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            traceback.print_exc()
+        raise
+    return results
+
+def bulk_response(results):
+    """Renders the per-repository results of a bulk configure request."""
+    if request.is_json:
+        return jsonify({
+            "results": [{
+                "repo": name,
+                "task_id": task_id,
+                "error": error,
+            } for name, task_id, error in results],
+        })
+    return render_template("bulk-results.html", results=results)
@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+from redis import Redis
+from srht.config import cfg
+
+redis = Redis.from_url(cfg("sr.ht", "redis-host", "redis://"))
+
+class LRUCache:
+    """
+    A thread-safe mapping which holds at most size entries, evicting the least
+    recently used. If max_bytes is given, entries are also evicted until the
+    sizes of those left, as measured by sizeof, add up to no more than it.
+    """
+    def __init__(self, size, max_bytes=None, sizeof=len):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._sizes = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            while len(self._entries) > self.size or (
+                    self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        if key in self._entries:
+            del self._entries[key]
+            self.bytes -= self._sizes.pop(key)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._entries.get(key, default)
+            self._remove(key)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,54 @@
+import threading
+import time
+
+class CircuitBreaker:
+    """
+    Tracks the health of a remote service. After threshold consecutive
+    failures the circuit opens, and calls should fail fast without being
+    attempted. Once reset_after seconds have passed, a single trial call is
+    allowed through: if it succeeds the circuit closes again, otherwise it
+    stays open for another reset_after seconds.
+
+    on_close is called, with no arguments, whenever the circuit closes after
+    having been open.
+    """
+    def __init__(self, threshold=5, reset_after=30, on_close=None):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.on_close = on_close
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened is not None
+
+    def allow(self):
+        """Returns True if a call may be attempted."""
+        with self._lock:
+            if self._opened is None:
+                return True
+            if self._trial:
+                return False
+            if time.monotonic() - self._opened < self.reset_after:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            was_open = self._opened is not None
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+        if was_open and self.on_close:
+            self.on_close()
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                self._opened = time.monotonic()
+            self._trial = False
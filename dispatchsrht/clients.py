@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
+from srht.config import cfgi
+
+class ClientPool:
+    """
+    A bounded pool of forge API clients keyed by upstream and token, so that
+    each client's keep-alive connections are reused across requests. Clients
+    which have not been used for idle seconds are dropped, as are the least
+    recently used clients once there are more than size of them.
+
+    PyGithub clients keep per-request state on their connection and are not
+    safe to share between threads, so each thread gets its own clients.
+    """
+    def __init__(self, size=256, idle=600):
+        self.size = size
+        self.idle = idle
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._clients:
+            key, (_, used) = next(iter(self._clients.items()))
+            if now - used < self.idle:
+                break
+            del self._clients[key]
+
+    def get(self, upstream, token, factory):
+        """
+        Returns the pooled client for upstream and token, calling factory to
+        create it if there is none.
+        """
+        key = (upstream, token, threading.get_ident())
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            client, _ = self._clients.pop(key, (None, None))
+        if client is None:
+            client = factory()
+        with self._lock:
+            self._clients[key] = (client, now)
+            while len(self._clients) > self.size:
+                self._clients.popitem(last=False)
+        return client
+
+    def evict(self, token):
+        """Drops every client using token, e.g. once it has been revoked."""
+        with self._lock:
+            for key in [key for key in self._clients if key[1] == token]:
+                del self._clients[key]
+
+client_pool = ClientPool(
+        cfgi("dispatch.sr.ht", "client-pool-size", default=256),
+        cfgi("dispatch.sr.ht", "client-pool-idle", default=600))
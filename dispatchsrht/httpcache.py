@@ -0,0 +1,119 @@
+import base64
+import hashlib
+import json
+import requests
+from dispatchsrht.cache import LRUCache, redis
+from prometheus_client import Counter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from srht.config import cfgb, cfgi
+
+_cache_size = cfgi("dispatch.sr.ht", "http-cache-size", default=4096)
+_cache_bytes = cfgi("dispatch.sr.ht", "http-cache-bytes",
+        default=64 * 1024 * 1024)
+_cache_redis = cfgb("dispatch.sr.ht", "http-cache-redis", default=False)
+_redis_ttl = 24 * 60 * 60
+# Larger responses are not worth keeping around
+_max_size = 1024 * 1024
+# Headers of a 304 response which are newer than those of the cached response
+_fresh_headers = ["date", "etag", "last-modified", "cache-control"]
+
+_requests = Counter("dispatchsrht_http_cache_requests",
+        "Forge API reads by HTTP cache result", ["host", "result"])
+_saved = Counter("dispatchsrht_http_cache_ratelimit_saved",
+        "Forge API reads answered with 304, which do not count against "
+        "the GitHub rate limit", ["host"])
+
+def _entry_size(entry):
+    return len(entry["content"]) + sum(len(name) + len(value)
+            for name, value in entry["headers"].items())
+
+class ResponseStore:
+    """
+    Stores cacheable responses by token and URL, in process and optionally in
+    redis. The responses kept in process take up at most max_bytes.
+    """
+    def __init__(self, size, max_bytes=None, shared=False):
+        self.local = LRUCache(size, max_bytes=max_bytes, sizeof=_entry_size)
+        self.shared = shared
+
+    def _key(self, key):
+        return f"dispatch.sr.ht.http.{key}"
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is None and self.shared:
+            entry = redis.get(self._key(key))
+            if entry is not None:
+                entry = json.loads(entry.decode())
+                self.local.set(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        self.local.set(key, entry)
+        if self.shared:
+            redis.set(self._key(key), json.dumps(entry), ex=_redis_ttl)
+
+response_store = ResponseStore(_cache_size, max_bytes=_cache_bytes,
+        shared=_cache_redis)
+
+def _cache_key(request):
+    token = (request.headers.get("Authorization")
+            or request.headers.get("PRIVATE-TOKEN") or "")
+    vary = "\0".join([token, request.headers.get("Accept", ""), request.url])
+    return hashlib.sha256(vary.encode()).hexdigest()
+
+def _from_cache(request, entry, fresh):
+    resp = requests.Response()
+    resp.status_code = entry["status"]
+    resp.reason = entry["reason"]
+    resp.headers = CaseInsensitiveDict(entry["headers"])
+    for name, value in fresh.headers.items():
+        if name.lower() in _fresh_headers or name.lower().startswith("x-"):
+            resp.headers[name] = value
+    resp._content = base64.b64decode(entry["content"])
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp.url = request.url
+    resp.request = request
+    resp.elapsed = fresh.elapsed
+    resp.connection = fresh.connection
+    return resp
+
+class ConditionalSession(requests.Session):
+    """
+    A requests session which revalidates GET requests with the ETag or
+    Last-Modified of the last response to the same token and URL, serving
+    the cached body when the server answers 304 Not Modified.
+    """
+    def send(self, request, **kwargs):
+        if request.method != "GET" or kwargs.get("stream"):
+            return super().send(request, **kwargs)
+        host = request.url.split("/")[2] if "//" in request.url else ""
+        key = _cache_key(request)
+        entry = response_store.get(key)
+        if entry:
+            if entry.get("etag"):
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+        resp = super().send(request, **kwargs)
+        if resp.status_code == 304 and entry:
+            _requests.labels(host=host, result="hit").inc()
+            _saved.labels(host=host).inc()
+            return _from_cache(request, entry, resp)
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if (resp.status_code != 200 or not (etag or last_modified)
+                or len(resp.content) > _max_size):
+            _requests.labels(host=host, result="uncacheable").inc()
+            return resp
+        _requests.labels(host=host, result="miss").inc()
+        response_store.set(key, {
+            "status": resp.status_code,
+            "reason": resp.reason,
+            "headers": dict(resp.headers),
+            "content": base64.b64encode(resp.content).decode(),
+            "etag": etag,
+            "last_modified": last_modified,
+        })
+        return resp
@@ -0,0 +1,67 @@
+import json
+from dispatchsrht.cache import redis
+from dispatchsrht.queue import is_dequeued
+from flask import make_response, request
+from functools import wraps
+from srht.config import cfgi
+
+# GitHub allows deliveries to be redelivered for three days
+_ttl = cfgi("dispatch.sr.ht", "delivery-ttl", default=3 * 24 * 60 * 60)
+# Upper bound on how long a delivery may be "in progress" before a
+# redelivery is allowed to try again
+_pending_ttl = 10 * 60
+
+def delivery_id():
+    return (request.headers.get("X-GitHub-Delivery")
+            or request.headers.get("X-Gitlab-Event-UUID"))
+
+def _key(record_id, delivery):
+    return f"dispatch.sr.ht.delivery.{record_id}.{delivery}"
+
+def _record(key, resp):
+    if resp.status_code >= 500:
+        # Let the forge retry server errors
+        redis.delete(key)
+        return
+    redis.set(key, json.dumps({
+        "status": resp.status_code,
+        "response": resp.get_data(as_text=True),
+    }), ex=_ttl)
+
+def _replay(key):
+    outcome = redis.get(key)
+    if not outcome:
+        return "Delivery was already received", 202
+    outcome = json.loads(outcome.decode())
+    if outcome.get("pending"):
+        return "Delivery is already being processed", 202
+    return outcome["response"], outcome["status"]
+
+def idempotent(f):
+    """
+    Decorates a webhook view so that redeliveries of the same delivery ID
+    replay the outcome of the first delivery rather than being processed
+    again.
+    """
+    @wraps(f)
+    def wrapper(record_id):
+        delivery = delivery_id()
+        if not delivery:
+            return f(record_id)
+        key = _key(record_id, delivery)
+        if is_dequeued():
+            # Duplicates were weeded out when the delivery was queued
+            resp = make_response(f(record_id))
+            _record(key, resp)
+            return resp
+        if not redis.set(key, json.dumps({"pending": True}),
+                nx=True, ex=_pending_ttl):
+            return _replay(key)
+        try:
+            resp = make_response(f(record_id))
+        except:
+            redis.delete(key)
+            raise
+        _record(key, resp)
+        return resp
+    return wrapper
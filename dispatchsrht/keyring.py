@@ -0,0 +1,39 @@
+import base64
+from cryptography.fernet import Fernet, MultiFernet
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from functools import lru_cache
+from srht.config import cfg
+
+_secret_key = cfg("sr.ht", "service-key",
+        default=cfg("sr.ht", "secret-key", default=None))
+# Keys which were used before the current one, newest first
+_old_keys = cfg("dispatch.sr.ht", "old-service-keys", default="").split()
+
+@lru_cache(maxsize=None)
+def derive_key(secret):
+    """Derives a Fernet key from a secret. This is slow, on purpose."""
+    kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=secret.encode(),
+            iterations=100000,
+            backend=default_backend())
+    return base64.urlsafe_b64encode(kdf.derive(secret.encode()))
+
+@lru_cache(maxsize=1)
+def key_ring():
+    """
+    Returns a MultiFernet which encrypts with the current service key and
+    decrypts with it or any of the old ones. Keys are only derived the first
+    time this is called, rather than when every process starts.
+    """
+    return MultiFernet([Fernet(derive_key(secret))
+        for secret in [_secret_key] + _old_keys])
+
+def encrypt(data):
+    return key_ring().encrypt(data)
+
+def decrypt(token):
+    return key_ring().decrypt(token)
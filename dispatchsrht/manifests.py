@@ -0,0 +1,94 @@
+import copy
+import hashlib
+import yaml
+from dispatchsrht.cache import LRUCache, redis
+from prometheus_client import Counter
+from srht.config import cfg, cfgb, cfgi
+
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+_builds_sr_ht = cfg("builds.sr.ht", "origin", default=None)
+
+_cache_size = cfgi("dispatch.sr.ht", "manifest-cache-size", default=1024)
+_cache_redis = cfgb("dispatch.sr.ht", "manifest-cache-redis", default=False)
+# Blobs are immutable, so this only bounds how long unused ones are kept
+_redis_ttl = 7 * 24 * 60 * 60
+
+if _builds_sr_ht:
+    from buildsrht.manifest import Manifest
+
+_hits = Counter("dispatchsrht_manifest_cache_hits",
+        "Build manifests served from the manifest cache", ["tier"])
+_misses = Counter("dispatchsrht_manifest_cache_misses",
+        "Build manifests which had to be downloaded from the forge")
+
+class ManifestCache:
+    """
+    Caches the text of build manifests by their git blob ID, in process and
+    optionally in redis.
+    """
+    def __init__(self, size, shared=False):
+        self.local = LRUCache(size)
+        self.shared = shared
+
+    def _key(self, oid):
+        return f"dispatch.sr.ht.manifest.{oid}"
+
+    def get(self, oid):
+        text = self.local.get(oid)
+        if text is not None:
+            _hits.labels(tier="local").inc()
+            return text
+        if self.shared:
+            text = redis.get(self._key(oid))
+            if text is not None:
+                text = text.decode()
+                self.local.set(oid, text)
+                _hits.labels(tier="redis").inc()
+                return text
+        _misses.inc()
+        return None
+
+    def set(self, oid, text):
+        self.local.set(oid, text)
+        if self.shared:
+            redis.set(self._key(oid), text.encode(), ex=_redis_ttl)
+
+    def fetch(self, blobs, download):
+        """
+        Returns the text of each of the given (name, oid) blobs, as a list of
+        (name, text) tuples. download is called with the list of oids which
+        are not cached, and must return a dict of oid to text.
+        """
+        texts = {oid: self.get(oid) for _, oid in blobs}
+        missing = [oid for oid, text in texts.items() if text is None]
+        if missing:
+            for oid, text in download(missing).items():
+                self.set(oid, text)
+                texts[oid] = text
+        return [(name, texts[oid]) for name, oid in blobs
+                if texts.get(oid) is not None]
+
+manifest_cache = ManifestCache(_cache_size, shared=_cache_redis)
+
+# Validated manifests by the SHA-256 of their text
+_templates = LRUCache(_cache_size)
+
+def parse_manifest(text):
+    """
+    Parses and validates a build manifest. Returns a copy of a cached
+    template, which the caller is free to modify.
+    """
+    key = hashlib.sha256(text.encode()).hexdigest()
+    template = _templates.get(key)
+    if template is None:
+        template = Manifest(yaml.load(text, Loader=SafeLoader))
+        _templates.set(key, template)
+    return copy.deepcopy(template)
+
+def dump_manifest(manifest):
+    return yaml.dump(manifest.to_dict(),
+            Dumper=SafeDumper, default_flow_style=False)
@@ -0,0 +1,257 @@
+import json
+import signal
+import sqlalchemy as sa
+import threading
+import traceback
+from datetime import datetime, timedelta
+from dispatchsrht.builds import flush_outbox, prune_callbacks
+from dispatchsrht.routing import routing_cache
+from dispatchsrht.types import Delivery, DeliveryStatus
+from flask import request, url_for
+from functools import wraps
+from srht.config import cfgb
+from srht.database import db
+from uuid import UUID
+
+queue_enabled = cfgb("dispatch.sr.ht", "webhook-queue", default=False)
+_poll_interval = 1
+_max_attempts = 5
+# A worker which has held a delivery for this long is presumed dead
+_stale_after = timedelta(minutes=10)
+_retention = timedelta(days=7)
+# Called by maintain, after the outbox is flushed
+_maintenance = []
+
+def is_dequeued():
+    """True if the current request is a delivery being replayed by a worker."""
+    return request.environ.get("dispatchsrht.dequeued", False)
+
+def enqueue(endpoint, view_args, delay=0, coalesce_key=None):
+    """
+    Stores the current request in the delivery queue, to be replayed against
+    the given endpoint by dispatchsrht-worker.
+    """
+    delivery = Delivery()
+    delivery.endpoint = endpoint
+    delivery.path = url_for(endpoint, **view_args)
+    delivery.view_args = json.dumps(view_args)
+    delivery.headers = json.dumps({k: v for k, v in request.headers.items()
+        if k.lower().startswith("x-") or k.lower() == "content-type"})
+    delivery.body = request.get_data(as_text=True)
+    delivery.status = DeliveryStatus.pending
+    delivery.attempts = 0
+    delivery.run_after = datetime.utcnow() + timedelta(seconds=delay)
+    delivery.coalesce_key = coalesce_key
+    db.session.add(delivery)
+    db.session.commit()
+    return delivery
+
+def supersede(coalesce_key):
+    """
+    Marks every delivery still waiting under coalesce_key as superseded and
+    returns them. The caller must commit.
+    """
+    superseded = (Delivery.query
+        .filter(Delivery.coalesce_key == coalesce_key)
+        .filter(Delivery.status == DeliveryStatus.pending)
+        .with_for_update()
+        .all())
+    for delivery in superseded:
+        delivery.status = DeliveryStatus.superseded
+    return superseded
+
+def coalesce_pushes(hook, payload):
+    """
+    Coalescing rule for push hooks: pushes to the same task and ref within
+    the hook's debounce window are collapsed into the newest one.
+    """
+    if not hook.debounce or not payload.get("ref"):
+        return None
+    return "{}:{}".format(hook.task_id, payload["ref"]), hook.debounce
+
+def validate_debounce(valid, default):
+    """
+    Reads the debounce field of a task's settings form. Returns the number of
+    seconds, clamped to ten minutes, or default if the field was not sent.
+    Returns None, and records an error, if it is not a number.
+    """
+    debounce = valid.optional("debounce")
+    if debounce is None:
+        return default
+    try:
+        debounce = int(debounce or 0)
+    except ValueError:
+        valid.error("Expected a number of seconds", field="debounce")
+        return None
+    return max(0, min(debounce, 600))
+
+def queueable(endpoint, record_cls, coalesce=None, superseded=None):
+    """
+    Decorates a webhook view. If the webhook queue is enabled, the delivery is
+    checked against record_cls and stored for a worker to handle, rather than
+    being handled in the web request.
+
+    @coalesce:   Called with the hook and payload. May return a (key, delay)
+                 tuple to hold the delivery for delay seconds, superseding any
+                 delivery still held under the same key.
+    @superseded: Called with the hook, its authorization and the payload of
+                 each superseded delivery. It must not wait on the forge.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(record_id):
+            if not queue_enabled or is_dequeued():
+                return f(record_id)
+            try:
+                record_id = UUID(record_id)
+            except ValueError:
+                return "Invalid hook ID", 400
+            hook, auth = routing_cache.resolve(record_cls, record_id)
+            if not hook:
+                return "Unknown hook " + str(record_id), 404
+            payload = request.get_json(silent=True)
+            if payload is None:
+                return "Expected a JSON payload", 400
+            held = coalesce(hook, payload) if coalesce else None
+            if not held:
+                enqueue(endpoint, {"record_id": str(record_id)})
+                return "Delivery queued", 202
+            key, delay = held
+            old = supersede(key)
+            enqueue(endpoint, {"record_id": str(record_id)},
+                    delay=delay, coalesce_key=key)
+            if superseded:
+                for delivery in old:
+                    superseded(hook, auth, json.loads(delivery.body))
+            return "Delivery queued for {} seconds".format(delay), 202
+        return wrapper
+    return decorator
+
+def claim():
+    """
+    Claims the next runnable delivery. Concurrent workers skip rows which are
+    already locked, so any number of workers on any number of nodes may poll
+    the same queue.
+    """
+    now = datetime.utcnow()
+    delivery = (Delivery.query
+        .filter(sa.or_(
+            sa.and_(Delivery.status == DeliveryStatus.pending,
+                Delivery.run_after <= now),
+            sa.and_(Delivery.status == DeliveryStatus.running,
+                Delivery.claimed < now - _stale_after)))
+        .order_by(Delivery.run_after)
+        .with_for_update(skip_locked=True)
+        .first())
+    if delivery:
+        delivery.status = DeliveryStatus.running
+        delivery.claimed = now
+        delivery.attempts += 1
+    db.session.commit()
+    return delivery
+
+def process(app, delivery):
+    """Replays a claimed delivery against its webhook view."""
+    view_args = json.loads(delivery.view_args)
+    headers = json.loads(delivery.headers)
+    try:
+        with app.test_request_context(delivery.path, method="POST",
+                data=delivery.body.encode(), headers=headers,
+                environ_overrides={"dispatchsrht.dequeued": True}):
+            view = app.view_functions[delivery.endpoint]
+            resp = app.make_response(view(**view_args))
+            code, text = resp.status_code, resp.get_data(as_text=True)
+    except Exception:
+        db.session.rollback()
+        code, text = 500, traceback.format_exc()
+    delivery.response_code = code
+    delivery.response = text
+    if code < 500:
+        delivery.status = DeliveryStatus.complete
+    elif delivery.attempts >= _max_attempts:
+        delivery.status = DeliveryStatus.failed
+    else:
+        delivery.status = DeliveryStatus.pending
+        delivery.run_after = datetime.utcnow() + timedelta(
+                seconds=30 * 2 ** delivery.attempts)
+    db.session.commit()
+
+def prune():
+    """Deletes finished deliveries older than the retention period."""
+    Delivery.query.filter(
+        Delivery.status.in_([DeliveryStatus.complete,
+            DeliveryStatus.failed, DeliveryStatus.superseded]),
+        Delivery.updated < datetime.utcnow() - _retention,
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+def on_maintain(task):
+    """
+    Registers a function for maintain to call, e.g. to prune the records of
+    a task type. It must commit its own changes.
+    """
+    _maintenance.append(task)
+    return task
+
+def maintain():
+    """
+    Flushes the builds.sr.ht outbox, and prunes old deliveries and build
+    callbacks, then runs the functions registered with on_maintain. Run by
+    dispatchsrht-periodic, and by the workers if there are any.
+    """
+    try:
+        flush_outbox()
+        prune()
+        prune_callbacks()
+        for task in _maintenance:
+            task()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.remove()
+
+def work(app, stop):
+    while not stop.is_set():
+        try:
+            delivery = claim()
+            if delivery:
+                process(app, delivery)
+            else:
+                stop.wait(_poll_interval)
+        except Exception:
+            traceback.print_exc()
+            db.session.rollback()
+            stop.wait(_poll_interval)
+        finally:
+            db.session.remove()
+
+def run_workers(app, count):
+    """
+    Runs count worker threads until SIGINT or SIGTERM. The main thread
+    flushes the builds.sr.ht outbox more often than dispatchsrht-periodic,
+    and prunes old deliveries and build callbacks.
+    """
+    stop = threading.Event()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(sig, lambda *args: stop.set())
+    threads = [threading.Thread(target=work, args=(app, stop), daemon=True)
+            for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    ticks = 0
+    while not stop.is_set():
+        try:
+            flush_outbox()
+            if ticks % 120 == 0:
+                prune()
+                prune_callbacks()
+        except Exception:
+            traceback.print_exc()
+            db.session.rollback()
+        finally:
+            db.session.remove()
+        ticks += 1
+        stop.wait(30)
+    for thread in threads:
+        thread.join()
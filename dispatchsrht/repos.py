@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+import traceback
+from dispatchsrht.cache import redis
+from srht.config import cfgi
+
+_ttl = cfgi("dispatch.sr.ht", "repo-index-ttl", default=300)
+# Stale lists are still shown while they are refreshed, for up to this long
+_expire = 7 * 24 * 60 * 60
+
+class RepoIndex:
+    """
+    Lists of each user's repositories, for the repository pickers. Lists are
+    fetched in a background thread and cached in redis, so rendering the
+    picker never waits on the forge. A list older than ttl seconds is still
+    used, and refreshed in the background.
+    """
+    def __init__(self, name, fetch, ttl=_ttl):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f"dispatch.sr.ht.repos.{self.name}.{key}"
+
+    def get(self, key, *args, refresh=False):
+        """
+        Returns the list of repositories cached for key, or None if it has
+        not been fetched yet. If there is no list, it is older than ttl or
+        refresh is set, it is fetched in the background with fetch(*args).
+        """
+        cached = redis.get(self._key(key))
+        cached = json.loads(cached.decode()) if cached else None
+        if refresh or not cached or cached["fetched"] + self.ttl < time.time():
+            self._refresh(key, args)
+        return cached["repos"] if cached else None
+
+    def _refresh(self, key, args):
+        lock = self._key(key) + ".lock"
+        if not redis.set(lock, 1, nx=True, ex=120):
+            return # Already being fetched
+        def run():
+            try:
+                repos = self.fetch(*args)
+                redis.set(self._key(key), json.dumps({
+                    "fetched": time.time(),
+                    "repos": repos,
+                }), ex=_expire)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                redis.delete(lock)
+        threading.Thread(target=run, daemon=True).start()
+
+def search_repos(repos, search, page, per_page=25, key="full_name"):
+    """
+    Filters a list of repositories by a case-insensitive search of key, and
+    returns one page of the results and the total number of pages.
+    """
+    if search:
+        search = search.lower()
+        repos = [r for r in repos if search in r[key].lower()]
+    total_pages = max(1, (len(repos) + per_page - 1) // per_page)
+    page = max(1, min(page, total_pages))
+    return repos[(page - 1) * per_page:page * per_page], page, total_pages
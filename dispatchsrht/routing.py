@@ -0,0 +1,160 @@
+import os
+import select
+import sqlalchemy as sa
+import threading
+import time
+import traceback
+from dispatchsrht.cache import LRUCache
+from dispatchsrht.types import Task
+from srht.config import cfgi
+from srht.database import db
+
+_ttl = cfgi("dispatch.sr.ht", "routing-cache-ttl", default=60)
+_negative_ttl = 10
+_channel = "dispatchsrht_routing"
+
+def _detached(obj):
+    """
+    Returns a detached copy of obj's columns, so that it can be cached
+    without taking obj, which the session may have handed out already, out
+    of the session.
+    """
+    mapper = sa.inspect(obj).mapper
+    copy = mapper.class_manager.new_instance()
+    for attr in mapper.column_attrs:
+        setattr(copy, attr.key, getattr(obj, attr.key))
+    sa.orm.make_transient_to_detached(copy)
+    return copy
+
+class RoutingCache:
+    """
+    Resolves the ID of a webhook record to the record and the authorization
+    its webhooks are handled with, in a single query, and caches the result
+    for ttl seconds. IDs which do not exist are cached too, for a shorter
+    time, so deliveries for deleted hooks are turned away cheaply.
+
+    Writes to records and authorizations NOTIFY every node, which drop the
+    affected entries. The TTL bounds staleness if a notification is missed.
+    """
+    def __init__(self, size=4096, ttl=60):
+        self.ttl = ttl
+        self._cache = LRUCache(size)
+        self._routes = dict()
+        self._auth_classes = set()
+        self._subscribers = list()
+        self._pid = None
+        self._lock = threading.Lock()
+        # Records are deleted with their task by the database, not the ORM
+        sa.event.listen(Task, "after_delete", self._changed)
+
+    def register(self, record_cls, auth_cls, *columns):
+        """
+        Registers a record class, whose authorization is the row of auth_cls
+        which matches it on each of the given columns.
+        """
+        self._routes[record_cls] = (auth_cls, columns)
+        sa.event.listen(record_cls, "after_insert", self._record_changed)
+        sa.event.listen(record_cls, "after_update", self._record_changed)
+        sa.event.listen(record_cls, "after_delete", self._record_changed)
+        if auth_cls not in self._auth_classes:
+            self._auth_classes.add(auth_cls)
+            sa.event.listen(auth_cls, "after_insert", self._changed)
+            sa.event.listen(auth_cls, "after_update", self._changed)
+            sa.event.listen(auth_cls, "after_delete", self._changed)
+
+    def subscribe(self, callback):
+        """
+        Calls callback with the key of every entry dropped, on any node, or
+        "*" when every entry is dropped.
+        """
+        self._subscribers.append(callback)
+
+    def _drop(self, key):
+        if key == "*":
+            self._cache.clear()
+        else:
+            self._cache.pop(key)
+        for callback in self._subscribers:
+            callback(key)
+
+    def resolve(self, record_cls, record_id):
+        """
+        Returns (record, authorization) for a record ID, attached to the
+        current session, or (None, None) if there is no such record. The
+        authorization is None if the record's user has not authorized us.
+        """
+        self.listen()
+        key = f"{record_cls.__tablename__}:{record_id}"
+        entry = self._cache.get(key)
+        if not entry or entry[0] < time.monotonic():
+            auth_cls, columns = self._routes[record_cls]
+            row = (db.session.query(record_cls, auth_cls)
+                    .outerjoin(auth_cls, sa.and_(*[
+                        getattr(auth_cls, c) == getattr(record_cls, c)
+                        for c in columns]))
+                    .filter(record_cls.id == record_id)
+                    .first())
+            if row:
+                entry = (time.monotonic() + self.ttl, tuple(
+                    None if obj is None else _detached(obj) for obj in row))
+            else:
+                entry = (time.monotonic() + _negative_ttl, (None, None))
+            self._cache.set(key, entry)
+        # Give the caller the session's own objects if it has them, which
+        # may have changes merging would overwrite, or else copies, without
+        # querying again
+        return tuple(None if obj is None else
+                db.session.identity_map.get(sa.inspect(obj).identity_key)
+                or db.session.merge(obj, load=False) for obj in entry[1])
+
+    def invalidate(self):
+        """
+        Drops every entry, and on every other node once the current
+        transaction commits. For writes which bypass the ORM.
+        """
+        self._drop("*")
+        db.session.execute(sa.text("SELECT pg_notify(:channel, '*')"),
+                {"channel": _channel})
+
+    def _record_changed(self, mapper, connection, target):
+        key = f"{target.__tablename__}:{target.id}"
+        self._drop(key)
+        connection.execute(sa.text("SELECT pg_notify(:channel, :key)"),
+                {"channel": _channel, "key": key})
+
+    def _changed(self, mapper, connection, target):
+        self._drop("*")
+        connection.execute(sa.text("SELECT pg_notify(:channel, '*')"),
+                {"channel": _channel})
+
+    def listen(self):
+        """Starts listening for changes on other nodes, if not already."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Not started yet, or we were forked by the web server
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                proxy = db.engine.raw_connection()
+                proxy.detach()
+                conn = proxy.connection
+                conn.set_session(autocommit=True)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {_channel}")
+                # Anything could have changed while we were not listening
+                self._drop("*")
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._drop(conn.notifies.pop(0).payload)
+            except Exception:
+                traceback.print_exc()
+                time.sleep(5)
+
+routing_cache = RoutingCache(ttl=_ttl)
@@ -0,0 +1,180 @@
+import atexit
+import hashlib
+import json
+import os
+import requests
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from cryptography.fernet import InvalidToken
+from dispatchsrht import keyring
+from dispatchsrht.cache import redis
+from email.utils import parsedate_to_datetime
+from redis.exceptions import RedisError
+
+_queue = "dispatch.sr.ht.statuses"
+# Statuses which could not be sent are dropped after this many attempts
+_max_attempts = 5
+
+class StatusReporter:
+    """
+    Posts commit statuses to the forges from a background thread, so that
+    webhook handlers do not wait on them.
+
+    Statuses are queued in redis by their URL and context. They are not lost
+    when the process which queued them exits, and any process may post them.
+    Queueing a status replaces any status still waiting for the same commit
+    and context, so intermediate states which have already been superseded
+    are never posted. Each status is posted while holding a lock on its
+    commit and context, so an older status never lands after a newer one.
+    Queued statuses are posted grouped by token, over a shared keep-alive
+    session. Statuses which the forge could not take for now, because it
+    failed or was rate limited, are tried again later.
+    """
+    def __init__(self, timeout=10, poll=5):
+        self.timeout = timeout
+        self.poll = poll
+        self._wake = threading.Event()
+        self._session = requests.Session()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def report(self, url, token, status, context_field="context"):
+        """
+        Queues a status to be POSTed as JSON to url, with token as the value
+        of the Authorization header.
+        """
+        key = json.dumps([url, status.get(context_field)])
+        redis.hset(_queue, key, json.dumps({
+            # Only a digest of the token is kept in the clear, for grouping
+            "group": hashlib.sha256(token.encode()).hexdigest(),
+            "token": keyring.encrypt(token.encode()).decode(),
+            "status": status,
+            "attempts": 0,
+        }))
+        self._wake.set()
+        with self._lock:
+            if self._pid != os.getpid():
+                # Not started yet, or we were forked by the web server
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, daemon=True).start()
+
+    def _lock_key(self, key):
+        return "{}.lock.{}".format(_queue,
+                hashlib.sha256(key.encode()).hexdigest())
+
+    def _take(self):
+        """
+        Returns the keys of the queued statuses which are due to be posted,
+        grouped by token.
+        """
+        by_token = OrderedDict()
+        now = time.time()
+        for key, entry in redis.hgetall(_queue).items():
+            entry = json.loads(entry.decode())
+            if entry.get("not_before", 0) > now:
+                continue
+            by_token.setdefault(entry["group"], []).append(key.decode())
+        return by_token
+
+    def _retry(self, key, entry, delay=0):
+        entry["attempts"] += 1
+        if entry["attempts"] >= _max_attempts:
+            print(f"Dropping commit status for {json.loads(key)[0]} after "
+                f"{entry['attempts']} attempts")
+            return
+        entry["not_before"] = time.time() + delay
+        # Unless a newer status has been queued since
+        redis.hsetnx(_queue, key, json.dumps(entry))
+
+    def _post(self, key):
+        lock = self._lock_key(key)
+        if not redis.set(lock, 1, nx=True, ex=self.timeout * 6):
+            # Another process is posting a status for the same commit and
+            # context, this one is left for the next pass
+            return
+        try:
+            pipe = redis.pipeline()
+            pipe.hget(_queue, key)
+            pipe.hdel(_queue, key)
+            entry, _ = pipe.execute()
+            if not entry:
+                return
+            entry = json.loads(entry.decode())
+            url, _ = json.loads(key)
+            try:
+                token = keyring.decrypt(entry["token"].encode()).decode()
+            except InvalidToken:
+                return # Queued with a service key we no longer have
+            try:
+                resp = self._session.post(url, json=entry["status"],
+                        timeout=self.timeout, headers={"Authorization": token})
+            except requests.RequestException:
+                traceback.print_exc()
+                self._retry(key, entry)
+                return
+            if resp.status_code >= 500 or _rate_limited(resp):
+                self._retry(key, entry, _retry_after(resp))
+            elif resp.status_code >= 400:
+                # e.g. the token was revoked, trying again will not help
+                print(f"Commit status for {url} was rejected: "
+                    f"{resp.status_code} {resp.text}")
+        finally:
+            redis.delete(lock)
+
+    def _drain(self):
+        for keys in self._take().values():
+            for key in keys:
+                self._post(key)
+
+    def _run(self):
+        while True:
+            # Statuses queued by other processes, or left for a later pass,
+            # are picked up every poll seconds
+            self._wake.wait(self.poll)
+            self._wake.clear()
+            try:
+                self._drain()
+            except Exception:
+                traceback.print_exc()
+
+    def flush(self):
+        """Posts every queued status from the calling thread."""
+        self._drain()
+
+    def _flush_at_exit(self):
+        if self._pid != os.getpid():
+            return # Nothing was queued by this process
+        try:
+            self.flush()
+        except RedisError as ex:
+            # Whatever is still queued is left to other processes
+            print(f"Unable to post queued commit statuses: {ex}")
+
+def _rate_limited(resp):
+    return resp.status_code == 429 or (resp.status_code == 403 and (
+        "Retry-After" in resp.headers
+        or resp.headers.get("X-RateLimit-Remaining") == "0"))
+
+def _retry_after(resp):
+    """Returns how many seconds the forge asked us to wait, if it did."""
+    value = resp.headers.get("Retry-After")
+    if value:
+        if value.isdigit():
+            return int(value)
+        try:
+            return max(0, parsedate_to_datetime(value).timestamp()
+                    - time.time())
+        except (TypeError, ValueError):
+            return 0
+    reset = resp.headers.get("X-RateLimit-Reset")
+    if resp.headers.get("X-RateLimit-Remaining") == "0" and reset:
+        try:
+            return max(0, int(reset) - time.time())
+        except ValueError:
+            return 0
+    return 0
+
+status_reporter = StatusReporter()
+atexit.register(status_reporter._flush_at_exit)
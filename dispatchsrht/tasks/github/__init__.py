@@ -1,2 +1,3 @@
 import dispatchsrht.tasks.github.github_commit_to_build
 import dispatchsrht.tasks.github.github_pr_to_build
+import dispatchsrht.tasks.github.org
@@ -0,0 +1,172 @@
+import requests
+from dispatchsrht.clients import client_pool
+from dispatchsrht.httpcache import ConditionalSession
+from dispatchsrht.manifests import manifest_cache
+from github import Github
+from github.Requester import HTTPRequestsConnectionClass
+from github.Requester import HTTPSRequestsConnectionClass, Requester
+from requests.adapters import HTTPAdapter
+
+_api_url = "https://api.github.com"
+_graphql_url = "https://api.github.com/graphql"
+# Connect and read timeouts for requests made outside of PyGithub
+_timeout = (3.05, 10)
+# Shared by every thread, so that connections to GitHub are reused
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_maxsize=16))
+
+_manifests_query = """
+query($owner: String!, $name: String!, $sha: GitObjectID!,
+        $single: String!, $dir: String!) {
+    repository(owner: $owner, name: $name) {
+        commit: object(oid: $sha) {
+            ... on Commit {
+                oid
+                message
+                url
+                author { name email }
+            }
+        }
+        single: object(expression: $single) {
+            ... on Blob { oid }
+        }
+        dir: object(expression: $dir) {
+            ... on Tree {
+                entries {
+                    name
+                    object { ... on Blob { oid } }
+                }
+            }
+        }
+    }
+}
+"""
+
+class CachingHTTPSConnection(HTTPSRequestsConnectionClass):
+    """
+    The PyGithub connection class, with its session replaced by one which
+    makes conditional requests.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        session = ConditionalSession()
+        session.adapters = self.session.adapters
+        self.session = session
+
+Requester.injectConnectionClasses(
+        HTTPRequestsConnectionClass, CachingHTTPSConnection)
+
+def github_client(token):
+    """Returns a pooled PyGithub client for token."""
+    return client_pool.get("github.com", token, lambda: Github(token))
+
+class GraphQLError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def graphql(token, query, variables):
+    resp = _session.post(_graphql_url, json={
+        "query": query,
+        "variables": variables,
+    }, headers={"Authorization": f"bearer {token}"}, timeout=_timeout)
+    if resp.status_code != 200:
+        raise GraphQLError(resp.status_code, resp.text)
+    data = resp.json()
+    if data.get("errors"):
+        raise GraphQLError(resp.status_code,
+                "; ".join(e.get("message", "") for e in data["errors"]))
+    return data["data"]
+
+def fetch_manifests(token, full_name, sha):
+    """
+    Fetches a commit and its build manifests. The commit and the blob IDs of
+    its manifests are fetched with a single GraphQL query, and the text of
+    only those blobs which are not in the manifest cache with a second.
+    Returns the commit (with oid, message, url and author, which may be
+    None) and a list of (filename, text) tuples, which is empty if the commit
+    has no manifests. Returns (None, []) if the commit does not exist.
+    """
+    owner, name = full_name.split("/", 1)
+    data = graphql(token, _manifests_query, {
+        "owner": owner,
+        "name": name,
+        "sha": sha,
+        "single": f"{sha}:.build.yml",
+        "dir": f"{sha}:.builds",
+    })
+    repo = data.get("repository") or dict()
+    commit = repo.get("commit")
+    single = repo.get("single")
+    if single and single.get("oid"):
+        blobs = [(".build.yml", single["oid"])]
+    else:
+        entries = (repo.get("dir") or dict()).get("entries") or []
+        blobs = [(e["name"], e["object"]["oid"]) for e in entries
+                if e.get("object") and e["object"].get("oid")]
+    return commit, manifest_cache.fetch(blobs,
+            lambda oids: fetch_blobs(token, owner, name, oids))
+
+def fetch_blobs(token, owner, name, oids):
+    """
+    Fetches the text of several blobs. Returns a dict of oid to text. GraphQL
+    leaves out the text of large blobs, which are fetched from the REST API
+    instead.
+    """
+    params = ", ".join(f"$o{i}: GitObjectID!" for i in range(len(oids)))
+    objects = "\n".join(
+            f"b{i}: object(oid: $o{i}) "
+            f"{{ ... on Blob {{ text isTruncated isBinary }} }}"
+            for i in range(len(oids)))
+    query = f"""
+    query($owner: String!, $name: String!, {params}) {{
+        repository(owner: $owner, name: $name) {{
+            {objects}
+        }}
+    }}
+    """
+    variables = {"owner": owner, "name": name}
+    variables.update({f"o{i}": oid for i, oid in enumerate(oids)})
+    repo = graphql(token, query, variables).get("repository") or dict()
+    blobs = dict()
+    for i, oid in enumerate(oids):
+        blob = repo.get(f"b{i}")
+        if not blob or blob.get("isBinary"):
+            continue
+        if blob.get("text") is not None and not blob.get("isTruncated"):
+            blobs[oid] = blob["text"]
+            continue
+        text = fetch_blob(token, owner, name, oid)
+        if text is not None:
+            blobs[oid] = text
+    return blobs
+
+def fetch_blob(token, owner, name, oid):
+    """
+    Fetches the text of a blob from the REST API. Returns None if it does not
+    exist or is not text.
+    """
+    resp = _session.get(f"{_api_url}/repos/{owner}/{name}/git/blobs/{oid}",
+            headers={
+                "Authorization": f"token {token}",
+                "Accept": "application/vnd.github.raw",
+            }, timeout=_timeout)
+    if resp.status_code != 200:
+        return None
+    try:
+        return resp.content.decode()
+    except UnicodeDecodeError:
+        return None
+
+def list_admin_repos(token):
+    """
+    Lists the repositories which the token's user administers, other than
+    forks, most recently updated first.
+    """
+    github = github_client(token)
+    return [{
+        "full_name": repo.full_name,
+        "html_url": repo.html_url,
+        "private": repo.private,
+    } for repo in github.get_user().get_repos(sort="updated")
+        if repo.permissions.admin and not repo.fork]
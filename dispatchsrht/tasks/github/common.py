@@ -1,15 +1,30 @@
-import base64
 import html
 import json
 import requests
 import sqlalchemy as sa
-import yaml
+import sqlalchemy_utils as sau
+from datetime import datetime, timedelta
 from dispatchsrht.app import app
-from dispatchsrht.builds import decrypt_notify_payload, submit_build
-from dispatchsrht.builds import first_line, encrypt_notify_url
-from flask import redirect, request, url_for
+from dispatchsrht.bulk import bulk_response, configure_many, requested_repos
+from dispatchsrht.builds import cancel_build, decrypt_notify_payload
+from dispatchsrht.builds import register_callback, revoke_callback
+from dispatchsrht.builds import unqueue_build
+from dispatchsrht.builds import describe_builds, first_line, on_outbox_result
+from dispatchsrht.builds import submit_build
+from dispatchsrht.clients import client_pool
+from dispatchsrht.manifests import parse_manifest
+from dispatchsrht.queue import on_maintain
+from dispatchsrht.repos import RepoIndex, search_repos
+from dispatchsrht.routing import routing_cache
+from dispatchsrht.status import status_reporter
+from dispatchsrht.tasks.github.api import GraphQLError, fetch_manifests
+from dispatchsrht.tasks.github.api import github_client
+from dispatchsrht.tasks.github.api import list_admin_repos
+from dispatchsrht.types import BuildCallback, User
+from flask import redirect, render_template, request, url_for
 from functools import wraps
-from github import Github, GithubException
+from github import GithubException
+from sqlalchemy.dialects.postgresql import insert
 from srht.config import cfg
 from srht.database import Base, db
 from srht.flask import csrf_bypass
@@ -21,26 +36,82 @@ _github_client_id = cfg("dispatch.sr.ht::github",
 _github_client_secret = cfg("dispatch.sr.ht::github",
         "oauth-client-secret", default=None)
 _builds_sr_ht = cfg("builds.sr.ht", "origin", default=None)
+# Jobs which have not reported back by now never will
+_job_retention = timedelta(days=7)
 
 if _builds_sr_ht:
-    from buildsrht.manifest import Manifest, Trigger
+    from buildsrht.manifest import Trigger
 
 class GitHubAuthorization(Base):
     __tablename__ = "github_authorization"
     id = sa.Column(sa.Integer, primary_key=True)
     created = sa.Column(sa.DateTime, nullable=False)
     updated = sa.Column(sa.DateTime, nullable=False)
-    user_id = sa.Column(sa.Integer, sa.ForeignKey("user.id"))
+    user_id = sa.Column(sa.Integer, sa.ForeignKey("user.id"),
+            index=True, unique=True)
     user = sa.orm.relationship("User")
     scopes = sa.Column(sa.Unicode(512), nullable=False)
     oauth_token = sa.Column(sa.Unicode(512), nullable=False)
 
+class GitHubJob(Base):
+    """
+    A build manifest submitted for a GitHub commit. Every manifest has one,
+    whether or not it became a builds.sr.ht job.
+    """
+    __tablename__ = "github_job"
+    __table_args__ = (
+        # Stale jobs of a pull request
+        sa.Index("ix_github_job_task_id_pr", "task_id", "pr"),
+        # The jobs of a commit
+        sa.Index("ix_github_job_task_id_sha", "task_id", "sha"),
+    )
+    id = sa.Column(sa.Integer, primary_key=True)
+    created = sa.Column(sa.DateTime, nullable=False)
+    updated = sa.Column(sa.DateTime, nullable=False)
+    task_id = sa.Column(sa.Integer,
+            sa.ForeignKey("task.id", ondelete="CASCADE"), nullable=False)
+    pr = sa.Column(sa.Integer)
+    sha = sa.Column(sa.Unicode(40), nullable=False)
+    # None until the manifest has been submitted to builds.sr.ht
+    job_id = sa.Column(sa.Integer, index=True)
+    name = sa.Column(sa.Unicode(1024))
+    callback_id = sa.Column(sa.Unicode(32), index=True)
+    # "queued" while held in the outbox, "running", "superseded", "error" if
+    # it could not be submitted, or the final status reported by builds.sr.ht
+    status = sa.Column(sa.Unicode(32), nullable=False, default="running")
+
+class GitHubOrgHook(Base):
+    """
+    A webhook on a GitHub organization, which delivers the events of all of
+    its repositories. Tasks for those repositories which were configured
+    while it existed have no repository webhook of their own.
+    """
+    __tablename__ = "github_org_hook"
+    __table_args__ = (
+        sa.Index("ix_github_org_hook_user_id_org",
+            "user_id", "org", unique=True),
+    )
+    id = sa.Column(sau.UUIDType, primary_key=True)
+    created = sa.Column(sa.DateTime, nullable=False)
+    updated = sa.Column(sa.DateTime, nullable=False)
+    user_id = sa.Column(sa.Integer,
+            sa.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    user = sa.orm.relationship("User")
+    org = sa.Column(sa.Unicode(1024), nullable=False)
+    github_webhook_id = sa.Column(sa.Integer, nullable=False)
+
+def org_hooked(user_id):
+    """Returns the organizations which the user has an org webhook on."""
+    return {hook.org.lower() for hook in GitHubOrgHook.query.filter(
+        GitHubOrgHook.user_id == user_id)}
+
 def github_redirect(return_to):
     gh_authorize_url = "https://github.com/login/oauth/authorize"
     # TODO: Do we want to generalize the scopes?
     parameters = {
         "client_id": _github_client_id,
-        "scope": "repo:status write:repo_hook user:email repo_deployment read:org",
+        "scope": ("repo:status write:repo_hook user:email repo_deployment read:org "
+            "admin:org_hook"),
         "state": return_to,
     }
     return redirect("{}?{}".format(gh_authorize_url, urlencode(parameters)))
@@ -54,9 +125,12 @@ def githubloginrequired(f):
         if not auth:
             return github_redirect(request.path)
         try:
-            github = Github(auth.oauth_token)
+            github = github_client(auth.oauth_token)
             return f(github, *args, **kwargs)
         except GithubException:
+            # Don't commit whatever the view had left in the session
+            db.session.rollback()
+            client_pool.evict(auth.oauth_token)
             db.session.delete(auth)
             db.session.commit()
             return github_redirect(request.path)
@@ -82,108 +156,353 @@ def github_callback():
     json = resp.json()
     access_token = json.get("access_token")
     scopes = json.get("scope")
-    auth = GitHubAuthorization()
-    auth.user_id = current_user.id
-    auth.scopes = scopes
-    auth.oauth_token = access_token
-    db.session.add(auth)
-    db.session.commit()
+    save_authorization(current_user.id, scopes, access_token)
     return redirect(state)
 
+def save_authorization(user_id, scopes, oauth_token):
+    """Stores a user's token, replacing the one they authorized before."""
+    old = GitHubAuthorization.query.filter(
+            GitHubAuthorization.user_id == user_id).one_or_none()
+    if old and old.oauth_token != oauth_token:
+        client_pool.evict(old.oauth_token)
+    now = datetime.utcnow()
+    db.session.execute(insert(GitHubAuthorization.__table__)
+        .values(created=now, updated=now, user_id=user_id,
+            scopes=scopes, oauth_token=oauth_token)
+        .on_conflict_do_update(index_elements=["user_id"], set_={
+            "updated": now,
+            "scopes": scopes,
+            "oauth_token": oauth_token,
+        }))
+    routing_cache.invalidate()
+    db.session.commit()
+
+github_repos = RepoIndex("github", list_admin_repos)
+
+def select_repo(existing):
+    """
+    Renders the picker of the current user's GitHub repositories, excluding
+    those in existing.
+    """
+    auth = GitHubAuthorization.query.filter(
+            GitHubAuthorization.user_id == current_user.id).one()
+    repos = github_repos.get(current_user.id, auth.oauth_token,
+            refresh="refresh" in request.args)
+    search = request.args.get("search")
+    try:
+        page = int(request.args.get("page", 1))
+    except ValueError:
+        page = 1
+    total_pages = 1
+    if repos is not None:
+        repos, page, total_pages = search_repos(repos, search, page)
+    return render_template("github/select-repo.html", repos=repos,
+            existing=set(existing), search=search,
+            page=page, total_pages=total_pages)
+
+def select_repos(existing):
+    """
+    Renders the picker for configuring several of the current user's GitHub
+    repositories at once, excluding those in existing.
+    """
+    auth = GitHubAuthorization.query.filter(
+            GitHubAuthorization.user_id == current_user.id).one()
+    repos = github_repos.get(current_user.id, auth.oauth_token)
+    if repos is not None:
+        existing = set(existing)
+        repos = [(r["full_name"], r["full_name"]) for r in repos
+                if r["full_name"] not in existing]
+    return render_template("bulk-configure.html",
+            repos=repos, forge="github")
+
+def configure_repos(taskdef, record_cls, events, setup=None):
+    """
+    Configures a task for each GitHub repository named in the request, with
+    a webhook for events, and returns the results per repository.
+    """
+    auth = GitHubAuthorization.query.filter(
+            GitHubAuthorization.user_id == current_user.id).one()
+    token = auth.oauth_token
+    orgs = org_hooked(current_user.id)
+    index = {r["full_name"]: r
+            for r in github_repos.get(current_user.id, token) or []}
+    existing = {r.repo for r in record_cls.query.filter(
+        record_cls.user_id == current_user.id)}
+    results, repos = list(), list()
+    for name in dict.fromkeys(requested_repos()):
+        if name in existing:
+            results.append((name, None, "Already configured"))
+        elif name not in index:
+            results.append((name, None,
+                "Not a repository you administer, or not fetched yet"))
+        else:
+            repos.append((name, index[name]))
+
+    def setup_record(record, repo):
+        record.repo = repo["full_name"]
+        if setup:
+            setup(record, repo)
+
+    def create_hook(repo, url):
+        if repo["full_name"].split("/")[0].lower() in orgs:
+            return -1 # The org webhook delivers its events
+        repo = github_client(token).get_repo(repo["full_name"], lazy=True)
+        return repo.create_hook("web", {
+            "url": url,
+            "content_type": "json",
+        }, events, active=True).id
+
+    def delete_hook(repo, hook_id):
+        if hook_id == -1:
+            return
+        repo = github_client(token).get_repo(repo["full_name"], lazy=True)
+        repo.get_hook(hook_id).delete()
+
+    results += configure_many(taskdef, record_cls, repos,
+            setup_record, create_hook, delete_hook, "github_webhook_id")
+    return bulk_response(results)
+
 context = lambda name: urlparse(_builds_sr_ht).netloc + (f": {name}" if name else "")
 
 
-def source_url(repo, base, git_commit, source):
-    if not source.endswith("/" + base.name):
+def source_url(repo, base, sha, source):
+    if not source.endswith("/" + base["name"]):
         return source
-    if base.name != repo.name:
-        return base.name + "::" + repo.clone_url + "#" + git_commit.sha
-    if repo.private:
-        return repo.ssh_url + "#" + git_commit.sha
-    return repo.clone_url + "#" + git_commit.sha
+    if base["name"] != repo["name"]:
+        return base["name"] + "::" + repo["clone_url"] + "#" + sha
+    if repo["private"]:
+        return repo["ssh_url"] + "#" + sha
+    return repo["clone_url"] + "#" + sha
 
-def update_preparing(base_commit):
+def status_url(full_name, sha):
+    return f"https://api.github.com/repos/{full_name}/statuses/{sha}"
+
+def update_preparing(token, full_name, sha):
     def go(name):
-        try:
-            base_commit.create_status("pending", _builds_sr_ht,
-                    "preparing builds.sr.ht job", context=context(name))
-        except GithubException:
-            pass
+        status_reporter.report(status_url(full_name, sha), f"token {token}", {
+            "state": "pending",
+            "target_url": _builds_sr_ht,
+            "description": "preparing builds.sr.ht job",
+            "context": context(name),
+        })
     return go
 
-def update_submitted(base_commit, username):
+def update_submitted(token, full_name, sha, username):
     def go(name, build_id):
-        try:
-            build_url = "{}/~{}/job/{}".format(
-                    _builds_sr_ht, username, build_id)
-            base_commit.create_status("pending", build_url,
-                    "builds.sr.ht job is running", context=context(name))
-        except GithubException:
-            pass
+        build_url = "{}/~{}/job/{}".format(
+                _builds_sr_ht, username, build_id)
+        status_reporter.report(status_url(full_name, sha), f"token {token}", {
+            "state": "pending",
+            "target_url": build_url,
+            "description": "builds.sr.ht job is running",
+            "context": context(name),
+        })
     return go
 
-def submit_github_build(tag, hook, repo, commit, base=None,
+class JobTracker:
+    """
+    Records a GitHubJob for each manifest submitted for a commit: running
+    once it is submitted, queued while it is held in the outbox, and error
+    if it could not be submitted at all. Summaries and automerge then
+    account for every manifest, not only those which became jobs.
+    """
+    def __init__(self, task_id, pr, sha, callbacks, submitted=None):
+        self.task_id = task_id
+        self.pr = pr
+        self.sha = sha
+        self.callbacks = callbacks
+        self._submitted = submitted
+        self._tracked = set()
+
+    def _track(self, name, status, job_id=None):
+        job = GitHubJob()
+        job.task_id = self.task_id
+        job.pr = self.pr
+        job.sha = self.sha
+        job.job_id = job_id
+        job.name = name
+        job.callback_id = self.callbacks.get(name)
+        job.status = status
+        db.session.add(job)
+        self._tracked.add(name)
+
+    def submitted(self, name, build_id):
+        self._track(name, "running", build_id)
+        if self._submitted:
+            return self._submitted(name, build_id)
+
+    def held(self, name):
+        self._track(name, "queued")
+
+    def failed(self):
+        """
+        Records every manifest which was neither submitted nor held, and
+        returns their names.
+        """
+        failed = [name for name in self.callbacks if name not in self._tracked]
+        for name in failed:
+            self._track(name, "error")
+        return failed
+
+def summarize(statuses):
+    """
+    Rolls up the statuses of the manifests submitted for a commit into a
+    single (state, description) commit status.
+    """
+    statuses = [s for s in statuses if s != "superseded"]
+    if not statuses:
+        return "error", "No builds.sr.ht jobs were submitted"
+    done = [s for s in statuses if s not in ["queued", "running"]]
+    failed = [s for s in done if s != "success"]
+    if len(done) < len(statuses):
+        description = f"{len(done)} of {len(statuses)} builds.sr.ht jobs complete"
+        if failed:
+            description += f", {len(failed)} failed"
+        return "pending", description
+    if failed:
+        return "failure", f"{len(failed)} of {len(statuses)} builds.sr.ht jobs failed"
+    return "success", f"{len(statuses)} builds.sr.ht jobs completed successfully"
+
+def _lock_jobs(task_id, sha):
+    """
+    Locks the jobs of a commit until the end of the transaction, and reloads
+    them. Callbacks for the same commit take turns, so that only the last of
+    them sees every job finished.
+    """
+    db.session.flush()
+    GitHubJob.query.filter(
+            GitHubJob.task_id == task_id,
+            GitHubJob.sha == sha).populate_existing().with_for_update().all()
+
+@on_maintain
+def prune_jobs():
+    """Forgets about jobs which never reported back."""
+    GitHubJob.query.filter(
+            GitHubJob.created < datetime.utcnow() - _job_retention,
+        ).delete(synchronize_session=False)
+    db.session.commit()
+
+def summarize_jobs(task_id, sha):
+    """Summarizes the manifests submitted for a commit, see summarize."""
+    # The session does not autoflush, and the caller has usually just
+    # changed one of them
+    db.session.flush()
+    return summarize([status for status, in db.session.query(GitHubJob.status)
+        .filter(GitHubJob.task_id == task_id, GitHubJob.sha == sha)])
+
+def update_summary(token, full_name, sha, username, summary):
+    state, description = summary
+    status_reporter.report(status_url(full_name, sha), f"token {token}", {
+        "state": state,
+        "target_url": f"{_builds_sr_ht}/~{username}",
+        "description": description,
+        "context": context(None),
+    })
+
+def cancel_stale_jobs(hook, auth, full_name, pr, sha):
+    """
+    Cancels the jobs still queued or running for earlier heads of a pull
+    request, and marks them as superseded on their commits. Jobs which
+    builds.sr.ht did not cancel are left running, and report as usual.
+    """
+    jobs = GitHubJob.query.filter(
+            GitHubJob.task_id == hook.task_id,
+            GitHubJob.pr == pr,
+            GitHubJob.sha != sha,
+            GitHubJob.status.in_(["queued", "running"])).all()
+    superseded = []
+    for job in jobs:
+        if job.status == "queued":
+            if not job.callback_id or not unqueue_build(job.callback_id):
+                continue
+            build_url = _builds_sr_ht
+        else:
+            if not cancel_build(hook.user, job.job_id):
+                continue
+            build_url = "{}/~{}/job/{}".format(
+                    _builds_sr_ht, auth.user.username, job.job_id)
+        if job.callback_id:
+            revoke_callback(job.callback_id)
+        job.status = "superseded"
+        superseded.append((job.sha, job.name, build_url))
+    db.session.commit()
+    for job_sha, name, build_url in superseded:
+        status_reporter.report(status_url(full_name, job_sha),
+                f"token {auth.oauth_token}", {
+                    "state": "error",
+                    "target_url": build_url,
+                    "description": "superseded by a newer push",
+                    "context": context(name),
+                })
+
+def push_superseded(hook, auth, payload):
+    """Marks a push which was coalesced into a newer one as superseded."""
+    commit = payload.get("head_commit")
+    repo = payload.get("repository")
+    if not auth or not commit or not repo:
+        return
+    status_reporter.report(status_url(repo["full_name"], commit["id"]),
+            f"token {auth.oauth_token}", {
+                "state": "error",
+                "target_url": _builds_sr_ht,
+                "description": "superseded by a newer push",
+                "context": context(None),
+            })
+
+def submit_github_build(tag, auth, hook, repo, commit, base=None,
         secrets=False, env=dict(), extras=dict()):
+    """
+    Submits builds for a commit described by a webhook payload. repo and base
+    are the repository objects from the payload, so the only request made to
+    GitHub before submission is a single GraphQL query for the commit and its
+    manifests.
+    """
     if base == None:
         base = repo
 
-    auth = GitHubAuthorization.query.filter(
-        GitHubAuthorization.user_id == hook.user_id).first()
     if not auth:
         return "You have not authorized us to access your GitHub account", 401
-    github = Github(auth.oauth_token)
-
+    per_job = hook.status_mode != "summary"
+    summary = hook.status_mode != "jobs"
+    sha = commit.get("sha") or commit.get("id")
     try:
-        repo = github.get_repo(repo["full_name"])
-        base = github.get_repo(base["full_name"])
-        sha = commit.get("sha") or commit.get("id")
-        commit = repo.get_commit(sha)
-    except GithubException:
+        git_commit, files = fetch_manifests(
+                auth.oauth_token, repo["full_name"], sha)
+    except GraphQLError:
         return ("We can't access your GitHub account. "
             "Did you revoke our access?"), 401
-    base_commit = base.get_commit(sha)
-    git_commit = commit.commit
+    if not git_commit:
+        return "Unable to fetch commit information", 400
 
-    try:
-        files = [repo.get_contents(".build.yml", ref=git_commit.sha)]
-    except GithubException:
-        try:
-            files = repo.get_dir_contents(
-                    ".builds", ref=git_commit.sha) or []
-            files = [repo.get_contents(
-                f.path, ref=git_commit.sha) for f in files]
-        except GithubException:
-            files = []
     if not files:
         return "There are no build manifest in this repository"
 
     manifests = list()
-    for f in files:
-        name = f.name
-        manifest = base64.b64decode(f.content)
+    callbacks = dict()
+    for name, manifest in files:
         try:
-            manifest = Manifest(yaml.safe_load(manifest))
+            manifest = parse_manifest(manifest)
         except Exception as ex:
             return f"There are errors in {name}:\n{str(ex)}", 400
 
         if manifest.sources:
-            manifest.sources = [source_url(repo, base, git_commit, s)
+            manifest.sources = [source_url(repo, base, sha, s)
                     for s in manifest.sources]
         if not manifest.environment:
             manifest.environment = env
         else:
             manifest.environment.update(env)
 
-        notify_payload = {
-            "full_name": base.full_name,
-            "oauth_token": auth.oauth_token,
-            "username": auth.user.username,
-            "sha": commit.sha,
-            "context": context(name),
-        }
-        if extras:
-            notify_payload.update(extras)
-        notify_url = encrypt_notify_url("github_complete_build", notify_payload)
+        callbacks[name], notify_url = register_callback(
+                "github_complete_callback",
+                task_id=hook.task_id,
+                user_id=hook.user_id,
+                repo=base["full_name"],
+                sha=sha,
+                context=context(name),
+                pr=extras.get("pr"),
+                automerge=bool(extras.get("automerge")),
+                status_mode=hook.status_mode)
 
         manifest.triggers.append(Trigger({
             "action": "webhook",
@@ -193,44 +512,183 @@ def submit_github_build(tag, hook, repo, commit, base=None,
 
         manifests.append((name, manifest))
 
-    note = "{}\n\n[{}]({}) &mdash; [{}](mailto:{})".format(
-            html.escape(first_line(git_commit.message)),
-            str(git_commit.sha)[:7], commit.html_url,
-            git_commit.author.name,
-            git_commit.author.email)
+    note = "{}\n\n[{}]({})".format(
+            html.escape(first_line(git_commit["message"])),
+            sha[:7], git_commit["url"])
+    # GitHub leaves out authors it cannot attribute
+    author = git_commit.get("author") or dict()
+    if author.get("name") and author.get("email"):
+        note += " &mdash; [{}](mailto:{})".format(
+                author["name"], author["email"])
 
-    urls = submit_build([repo.name, tag], manifests,
+    if per_job:
+        preparing = update_preparing(auth.oauth_token, base["full_name"], sha)
+        submitted = update_submitted(auth.oauth_token,
+                base["full_name"], sha, auth.user.username)
+    else:
+        preparing, submitted = None, None
+    tracker = JobTracker(hook.task_id, extras.get("pr"), sha,
+            callbacks, submitted)
+    urls, errors = submit_build([repo["name"], tag], manifests,
             hook.user, note=note, secrets=secrets,
-            preparing=update_preparing(base_commit),
-            submitted=update_submitted(base_commit, auth.user.username))
-    if isinstance(urls, str):
-        return urls
-    return "Submitted:\n\n" + "\n".join([f"{n}: {u}" for n, u in urls])
+            preparing=preparing,
+            submitted=tracker.submitted,
+            held=tracker.held,
+            callbacks=callbacks)
+    failed = tracker.failed()
+    if summary:
+        # Queued before the commit, as in complete_build
+        _lock_jobs(hook.task_id, sha)
+        update_summary(auth.oauth_token, base["full_name"], sha,
+                auth.user.username, summarize_jobs(hook.task_id, sha))
+    db.session.commit()
+    if per_job:
+        for name in failed:
+            status_reporter.report(status_url(base["full_name"], sha),
+                    f"token {auth.oauth_token}", {
+                        "state": "error",
+                        "target_url": _builds_sr_ht,
+                        "description": "builds.sr.ht job could not be submitted",
+                        "context": context(name),
+                    })
+    return describe_builds(urls, errors)
+
+def _callback(callback_id):
+    """Returns a GitHub build callback with its user's token and username."""
+    return (db.session.query(BuildCallback,
+                GitHubAuthorization.oauth_token, User.username)
+            .join(GitHubAuthorization,
+                GitHubAuthorization.user_id == BuildCallback.user_id)
+            .join(User, User.id == BuildCallback.user_id)
+            .filter(BuildCallback.id == callback_id)
+            .filter(BuildCallback.upstream == None)
+            .first())
+
+@on_outbox_result
+def github_outbox_result(callback_id, job_id, error):
+    """Reports a build which was held in the outbox once it is sent."""
+    row = _callback(callback_id) if callback_id else None
+    if not row:
+        return
+    callback, oauth_token, username = row
+    job = GitHubJob.query.filter(
+            GitHubJob.callback_id == callback_id).one_or_none()
+    if job:
+        _lock_jobs(job.task_id, job.sha)
+        if job.status != "queued":
+            # Superseded or completed while it was held
+            db.session.commit()
+            return
+        job.job_id = job_id
+        job.status = "running" if job_id else "error"
+        summary = summarize_jobs(job.task_id, job.sha)
+    # Queued before the commit, as in complete_build
+    if callback.status_mode != "summary":
+        if job_id:
+            status = {
+                "state": "pending",
+                "target_url": "{}/~{}/job/{}".format(
+                    _builds_sr_ht, username, job_id),
+                "description": "builds.sr.ht job is running",
+            }
+        else:
+            status = {
+                "state": "error",
+                "target_url": _builds_sr_ht,
+                "description": "builds.sr.ht rejected the job",
+            }
+        status["context"] = callback.context
+        status_reporter.report(status_url(callback.repo, callback.sha),
+                f"token {oauth_token}", status)
+    if callback.status_mode != "jobs" and job:
+        update_summary(oauth_token, callback.repo, callback.sha,
+                username, summary)
+    db.session.commit()
+
+@csrf_bypass
+@app.route("/github/complete/<callback_id>", methods=["POST"])
+def github_complete_callback(callback_id):
+    row = _callback(callback_id)
+    if not row:
+        return "Unknown or revoked callback", 404
+    callback, oauth_token, username = row
+    return complete_build({
+        "full_name": callback.repo,
+        "oauth_token": oauth_token,
+        "username": username,
+        "sha": callback.sha,
+        "context": callback.context,
+        "task_id": callback.task_id,
+        "status_mode": callback.status_mode,
+        "pr": callback.pr,
+        "automerge": callback.automerge,
+        "callback_id": callback.id,
+    })
 
 @csrf_bypass
 @app.route("/github/complete_build/<payload>", methods=["POST"])
 def github_complete_build(payload):
-    payload = decrypt_notify_payload(payload)
-    github = Github(payload["oauth_token"])
-    repo = github.get_repo(payload["full_name"])
-    commit = repo.get_commit(payload["sha"])
+    # Builds submitted before callbacks were recorded in the database
+    return complete_build(decrypt_notify_payload(payload))
+
+def complete_build(payload):
     result = json.loads(request.data.decode('utf-8'))
     context = payload.get("context")
+    status_mode = payload.get("status_mode",
+            "summary" if payload.get("summary") else "jobs")
+    job = None
+    if payload.get("callback_id"):
+        job = GitHubJob.query.filter(
+                GitHubJob.callback_id == payload["callback_id"]).one_or_none()
+    if not job:
+        job = GitHubJob.query.filter(
+                GitHubJob.job_id == result["id"]).one_or_none()
+    if job:
+        _lock_jobs(job.task_id, job.sha)
+        if job.status == "superseded":
+            db.session.commit()
+            return "Job was superseded by a newer push"
+        job.job_id = result["id"]
+        job.status = result["status"]
+        summary = summarize_jobs(job.task_id, job.sha)
+    else:
+        # Submitted before jobs were tracked, we only know about this one,
+        # so it is never enough to merge on
+        if result["status"] == "success":
+            summary = ("success", "builds.sr.ht job completed successfully")
+        else:
+            summary = ("failure", "builds.sr.ht job failed")
+    # Queued before the commit releases the lock, so that the statuses of
+    # callbacks for the same commit are queued in the order they were decided
+    if status_mode != "jobs":
+        update_summary(payload["oauth_token"], payload["full_name"],
+                payload["sha"], payload["username"], summary)
+    if status_mode != "summary":
+        # Queued behind any earlier status for this job, so that it cannot be
+        # overwritten by one which was still waiting to be sent
+        status_reporter.report(status_url(payload["full_name"], payload["sha"]),
+                f"token {payload['oauth_token']}", {
+                    "state": "success" if result["status"] == "success"
+                        else "failure",
+                    "target_url": "{}/~{}/job/{}".format(_builds_sr_ht,
+                        payload["username"], result["id"]),
+                    "description": "builds.sr.ht job {}".format(
+                        "completed successfully"
+                            if result["status"] == "success" else "failed"),
+                    "context": context,
+                })
+    db.session.commit()
+    pr = payload.get("pr")
+    # Only merge once every manifest found for this commit has succeeded
+    if (not pr or not payload.get("automerge") or not job
+            or summary[0] != "success"):
+        return "Sent build status to GitHub"
+    github = github_client(payload["oauth_token"])
     try:
-        commit.create_status(
-            "success" if result["status"] == "success" else "failure",
-            "{}/~{}/job/{}".format(_builds_sr_ht, payload["username"], result["id"]),
-            "builds.sr.ht job {}".format(
-                "completed successfully" if result["status"] == "success"
-                    else "failed"),
-            context=context)
+        pr = github.get_repo(payload["full_name"], lazy=True).get_pull(pr)
     except GithubException:
-        return "Error updating GitHub status"
-    pr = payload.get("pr")
-    if pr:
-        pr = repo.get_pull(pr)
-    automerge = payload.get("automerge")
-    if pr and not pr.is_merged() and automerge and result["status"] == "success":
+        return "Unable to fetch pull request for automerge"
+    if not pr.merged:
         requested_reviews = pr.get_review_requests()
         # Don't merge if there are outstanding review requests
         if not any(requested_reviews[0]) and not any(requested_reviews[1]):
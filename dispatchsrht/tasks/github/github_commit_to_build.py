@@ -1,8 +1,16 @@
 import sqlalchemy as sa
 import sqlalchemy_utils as sau
+from dispatchsrht.bulk import json_only
+from dispatchsrht.idempotency import idempotent
+from dispatchsrht.queue import coalesce_pushes, queue_enabled, queueable
+from dispatchsrht.queue import validate_debounce
+from dispatchsrht.routing import routing_cache
 from dispatchsrht.tasks import TaskDef
 from dispatchsrht.tasks.github.common import GitHubAuthorization
-from dispatchsrht.tasks.github.common import githubloginrequired
+from dispatchsrht.tasks.github.common import githubloginrequired, org_hooked
+from dispatchsrht.tasks.github.common import select_repo, select_repos
+from dispatchsrht.tasks.github.common import configure_repos
+from dispatchsrht.tasks.github.common import push_superseded
 from dispatchsrht.tasks.github.common import submit_github_build
 from dispatchsrht.types import Task
 from flask import Blueprint, redirect, request, render_template, url_for, abort
@@ -47,11 +55,17 @@ class GitHubCommitToBuild(TaskDef):
         repo = sa.Column(sa.Unicode(1024), nullable=False)
         github_webhook_id = sa.Column(sa.Integer, nullable=False)
         secrets = sa.Column(sa.Boolean, nullable=False, server_default='t')
+        debounce = sa.Column(sa.Integer, nullable=False, server_default='0')
+        status_mode = sa.Column(sa.Unicode(16),
+                nullable=False, server_default='jobs')
+
+    routing_cache.register(_GitHubCommitToBuildRecord,
+            GitHubAuthorization, "user_id")
 
     blueprint = Blueprint("github_commit_to_build",
             __name__, template_folder="github_commit_to_build")
 
-    def edit_GET(task):
+    def edit_GET(task, valid=None):
         record = GitHubCommitToBuild._GitHubCommitToBuildRecord.query.filter(
             GitHubCommitToBuild._GitHubCommitToBuildRecord.task_id == task.id
         ).one_or_none()
@@ -59,7 +73,8 @@ class GitHubCommitToBuild(TaskDef):
             abort(404)
         saved = session.pop("saved", False)
         return render_template("github/edit.html", task=task, record=record,
-                               saved=saved)
+                               saved=saved, queue_enabled=queue_enabled,
+                               valid=valid)
 
     def edit_POST(task):
         record = GitHubCommitToBuild._GitHubCommitToBuildRecord.query.filter(
@@ -67,18 +82,28 @@ class GitHubCommitToBuild(TaskDef):
         ).one_or_none()
         valid = Validation(request)
         secrets = valid.optional("secrets", cls=bool, default=False)
+        status_mode = valid.optional("status_mode", default="jobs")
+        debounce = validate_debounce(valid, record.debounce)
+        if not valid.ok:
+            return render_template("task-settings.html", view="summary",
+                    task=task, taskdef=GitHubCommitToBuild, valid=valid)
         record.secrets = bool(secrets)
+        record.debounce = debounce
+        if status_mode in ["jobs", "summary", "both"]:
+            record.status_mode = status_mode
         db.session.commit()
         session["saved"] = True
         return redirect(url_for("html.edit_task", task_id=task.id))
 
     @csrf_bypass
     @blueprint.route("/webhook/<record_id>", methods=["POST"])
+    @idempotent
+    @queueable("github_commit_to_build._webhook", _GitHubCommitToBuildRecord,
+            coalesce=coalesce_pushes, superseded=push_superseded)
     def _webhook(record_id):
         record_id = UUID(record_id)
-        hook = GitHubCommitToBuild._GitHubCommitToBuildRecord.query.filter(
-                GitHubCommitToBuild._GitHubCommitToBuildRecord.id == record_id
-            ).one_or_none()
+        hook, auth = routing_cache.resolve(
+                GitHubCommitToBuild._GitHubCommitToBuildRecord, record_id)
         if not hook:
             return "Unknown hook " + str(record_id), 404
         valid = Validation(request)
@@ -87,7 +112,7 @@ class GitHubCommitToBuild(TaskDef):
         ref = valid.require("ref")
         if not valid.ok:
             return "Got request, but it has no commits"
-        return submit_github_build("commits", hook, repo, commit, env={
+        return submit_github_build("commits", auth, hook, repo, commit, env={
             "GITHUB_DELIVERY": request.headers.get("X-GitHub-Delivery"),
             "GITHUB_EVENT": request.headers.get("X-GitHub-Event"),
             "GITHUB_REF": ref,
@@ -97,14 +122,32 @@ class GitHubCommitToBuild(TaskDef):
     @blueprint.route("/configure")
     @githubloginrequired
     def configure(github):
-        repos = github.get_user().get_repos(sort="updated")
-        repos = filter(lambda r: r.permissions.admin and not r.fork, repos)
         existing = GitHubCommitToBuild._GitHubCommitToBuildRecord.query.filter(
                 GitHubCommitToBuild._GitHubCommitToBuildRecord.user_id ==
                 current_user.id).all()
-        existing = [e.repo for e in existing]
-        return render_template("github/select-repo.html",
-                repos=repos, existing=existing)
+        return select_repo([e.repo for e in existing])
+
+    @blueprint.route("/configure/bulk")
+    @githubloginrequired
+    def configure_bulk(github):
+        existing = GitHubCommitToBuild._GitHubCommitToBuildRecord.query.filter(
+                GitHubCommitToBuild._GitHubCommitToBuildRecord.user_id ==
+                current_user.id).all()
+        return select_repos([e.repo for e in existing])
+
+    @blueprint.route("/configure/bulk", methods=["POST"])
+    @githubloginrequired
+    def configure_bulk_POST(github):
+        return configure_repos(GitHubCommitToBuild.name,
+                GitHubCommitToBuild._GitHubCommitToBuildRecord, ["push"])
+
+    @csrf_bypass
+    @blueprint.route("/configure/bulk.json", methods=["POST"])
+    @githubloginrequired
+    @json_only
+    def configure_bulk_json(github):
+        return configure_repos(GitHubCommitToBuild.name,
+                GitHubCommitToBuild._GitHubCommitToBuildRecord, ["push"])
 
     @blueprint.route("/configure", methods=["POST"])
     @githubloginrequired
@@ -130,11 +173,12 @@ class GitHubCommitToBuild(TaskDef):
         record.repo = repo.full_name
         db.session.add(record)
         db.session.flush()
-        hook = repo.create_hook("web", {
-            "url": _root + url_for("github_commit_to_build._webhook",
-                record_id=record.id),
-            "content_type": "json",
-        }, ["push"], active=True)
-        record.github_webhook_id = hook.id
+        if repo.owner.login.lower() not in org_hooked(current_user.id):
+            hook = repo.create_hook("web", {
+                "url": _root + url_for("github_commit_to_build._webhook",
+                    record_id=record.id),
+                "content_type": "json",
+            }, ["push"], active=True)
+            record.github_webhook_id = hook.id
         db.session.commit()
         return redirect(url_for("html.edit_task", task_id=task.id))
@@ -1,6 +1,5 @@
 import sqlalchemy as sa
 import sqlalchemy_utils as sau
-from github import Github
 from flask import Blueprint, redirect, request, render_template, url_for, abort
 from flask import session
 from jinja2 import Markup
@@ -10,9 +9,17 @@ from srht.config import cfg
 from srht.flask import icon, csrf_bypass
 from srht.oauth import current_user
 from srht.validation import Validation
+from dispatchsrht.bulk import json_only
+from dispatchsrht.idempotency import idempotent
+from dispatchsrht.queue import queueable
+from dispatchsrht.routing import routing_cache
 from dispatchsrht.tasks import TaskDef
+from dispatchsrht.tasks.github.api import github_client
 from dispatchsrht.tasks.github.common import GitHubAuthorization
-from dispatchsrht.tasks.github.common import githubloginrequired
+from dispatchsrht.tasks.github.common import cancel_stale_jobs
+from dispatchsrht.tasks.github.common import githubloginrequired, org_hooked
+from dispatchsrht.tasks.github.common import select_repo, select_repos
+from dispatchsrht.tasks.github.common import configure_repos
 from dispatchsrht.tasks.github.common import submit_github_build
 from dispatchsrht.types import Task
 
@@ -49,6 +56,11 @@ class GitHubPRToBuild(TaskDef):
         automerge = sa.Column(sa.Boolean, nullable=False, server_default='f')
         private = sa.Column(sa.Boolean, nullable=False, server_default='f')
         secrets = sa.Column(sa.Boolean, nullable=False, server_default='f')
+        status_mode = sa.Column(sa.Unicode(16),
+                nullable=False, server_default='jobs')
+
+    routing_cache.register(_GitHubPRToBuildRecord,
+            GitHubAuthorization, "user_id")
 
     blueprint = Blueprint("github_pr_to_build",
             __name__, template_folder="github_pr_to_build")
@@ -62,7 +74,7 @@ class GitHubPRToBuild(TaskDef):
         auth = GitHubAuthorization.query.filter(
             GitHubAuthorization.user_id == current_user.id
         ).first()
-        github = Github(auth.oauth_token)
+        github = github_client(auth.oauth_token)
         try:
             repo = github.get_repo(record.repo)
         except github.GithubException.UnknownObjectException:
@@ -84,8 +96,11 @@ class GitHubPRToBuild(TaskDef):
         valid = Validation(request)
         automerge = valid.optional("automerge", cls=bool, default=False)
         secrets = valid.optional("secrets", cls=bool, default=False)
+        status_mode = valid.optional("status_mode", default="jobs")
         record.automerge = bool(automerge)
         record.secrets = bool(secrets)
+        if status_mode in ["jobs", "summary", "both"]:
+            record.status_mode = status_mode
         if not record.private:
             record.secrets = False
         db.session.commit()
@@ -94,11 +109,12 @@ class GitHubPRToBuild(TaskDef):
 
     @csrf_bypass
     @blueprint.route("/webhook/<record_id>", methods=["POST"])
+    @idempotent
+    @queueable("github_pr_to_build._webhook", _GitHubPRToBuildRecord)
     def _webhook(record_id):
         record_id = UUID(record_id)
-        hook = GitHubPRToBuild._GitHubPRToBuildRecord.query.filter(
-                GitHubPRToBuild._GitHubPRToBuildRecord.id == record_id
-            ).first()
+        hook, auth = routing_cache.resolve(
+                GitHubPRToBuild._GitHubPRToBuildRecord, record_id)
         if not hook:
             return "Unknown hook " + str(record_id), 404
         valid = Validation(request)
@@ -112,16 +128,17 @@ class GitHubPRToBuild(TaskDef):
         base = pr["base"]
         base_repo = base["repo"]
         head_repo = head["repo"]
-        auth = GitHubAuthorization.query.filter(
-            GitHubAuthorization.user_id == hook.user_id).first()
         if not auth:
             return (
                 "You have not authorized us to access your GitHub account", 401
             )
+        if action == "synchronize":
+            cancel_stale_jobs(hook, auth, base_repo["full_name"],
+                    pr["number"], head["sha"])
         secrets = hook.secrets
         if not base_repo["private"]:
             secrets = False
-        return submit_github_build("pulls", hook, head_repo, head, base_repo,
+        return submit_github_build("pulls", auth, hook, head_repo, head, base_repo,
                 secrets=secrets, extras={
                     "automerge": hook.automerge, 
                     "pr": pr["number"]
@@ -137,14 +154,36 @@ class GitHubPRToBuild(TaskDef):
     @blueprint.route("/configure")
     @githubloginrequired
     def configure(github):
-        repos = github.get_user().get_repos(sort="updated")
-        repos = filter(lambda r: r.permissions.admin and not r.fork, repos)
         existing = GitHubPRToBuild._GitHubPRToBuildRecord.query.filter(
                 GitHubPRToBuild._GitHubPRToBuildRecord.user_id ==
                 current_user.id).all()
-        existing = [e.repo for e in existing]
-        return render_template("github/select-repo.html",
-                repos=repos, existing=existing)
+        return select_repo([e.repo for e in existing])
+
+    @blueprint.route("/configure/bulk")
+    @githubloginrequired
+    def configure_bulk(github):
+        existing = GitHubPRToBuild._GitHubPRToBuildRecord.query.filter(
+                GitHubPRToBuild._GitHubPRToBuildRecord.user_id ==
+                current_user.id).all()
+        return select_repos([e.repo for e in existing])
+
+    @blueprint.route("/configure/bulk", methods=["POST"])
+    @githubloginrequired
+    def configure_bulk_POST(github):
+        return configure_repos(GitHubPRToBuild.name,
+                GitHubPRToBuild._GitHubPRToBuildRecord, ["pull_request"],
+                setup=lambda record, repo: setattr(
+                    record, "private", repo.get("private", False)))
+
+    @csrf_bypass
+    @blueprint.route("/configure/bulk.json", methods=["POST"])
+    @githubloginrequired
+    @json_only
+    def configure_bulk_json(github):
+        return configure_repos(GitHubPRToBuild.name,
+                GitHubPRToBuild._GitHubPRToBuildRecord, ["pull_request"],
+                setup=lambda record, repo: setattr(
+                    record, "private", repo.get("private", False)))
 
     @blueprint.route("/configure", methods=["POST"])
     @githubloginrequired
@@ -171,11 +210,12 @@ class GitHubPRToBuild(TaskDef):
         record.private = repo.private
         db.session.add(record)
         db.session.flush()
-        hook = repo.create_hook("web", {
-            "url": _root + url_for("github_pr_to_build._webhook",
-                record_id=record.id),
-            "content_type": "json",
-        }, ["pull_request"], active=True)
-        record.github_webhook_id = hook.id
+        if repo.owner.login.lower() not in org_hooked(current_user.id):
+            hook = repo.create_hook("web", {
+                "url": _root + url_for("github_pr_to_build._webhook",
+                    record_id=record.id),
+                "content_type": "json",
+            }, ["pull_request"], active=True)
+            record.github_webhook_id = hook.id
         db.session.commit()
         return redirect(url_for("html.edit_task", task_id=task.id))
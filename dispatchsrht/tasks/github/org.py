@@ -0,0 +1,299 @@
+import sqlalchemy as sa
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dispatchsrht.app import app
+from dispatchsrht.routing import routing_cache
+from dispatchsrht.tasks.github.api import github_client
+from dispatchsrht.tasks.github.common import GitHubAuthorization, GitHubOrgHook
+from dispatchsrht.tasks.github.common import github_redirect
+from dispatchsrht.tasks.github.common import githubloginrequired
+from dispatchsrht.tasks.github.github_commit_to_build import GitHubCommitToBuild
+from dispatchsrht.tasks.github.github_pr_to_build import GitHubPRToBuild
+from flask import abort, make_response, redirect, render_template, request
+from flask import url_for
+from github import BadCredentialsException, GithubException
+from srht.config import cfg, cfgi
+from srht.database import db
+from srht.flask import csrf_bypass
+from srht.oauth import current_user
+from srht.validation import Validation
+from uuid import UUID, uuid4
+
+_root = cfg("dispatch.sr.ht", "origin")
+_concurrency = cfgi("dispatch.sr.ht", "bulk-configure-concurrency", default=8)
+
+# The task which handles each event, by X-GitHub-Event
+_routes = {
+    "push": ("github_commit_to_build._webhook",
+        GitHubCommitToBuild._GitHubCommitToBuildRecord),
+    "pull_request": ("github_pr_to_build._webhook",
+        GitHubPRToBuild._GitHubPRToBuildRecord),
+}
+
+class RepoRoutes:
+    """
+    Indexes the records of GitHub tasks without a repository webhook by
+    repository full name, so organization webhook deliveries can be routed
+    to them. Records which change, on any node, are reloaded on the next
+    lookup. The index is only rebuilt when every routing entry is dropped.
+    """
+    def __init__(self):
+        self._index = None
+        # The index key of each record, by (record class, str(record ID))
+        self._keys = dict()
+        self._stale = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        routing_cache.subscribe(self._invalidate)
+
+    def _invalidate(self, key):
+        if key == "*":
+            with self._lock:
+                self._generation += 1
+                self._index = None
+                self._stale.clear()
+            return
+        table, _, record_id = key.partition(":")
+        for _, record_cls in _routes.values():
+            if record_cls.__tablename__ == table:
+                with self._lock:
+                    self._stale.add((record_cls, record_id))
+
+    def _rows(self, record_cls, *criteria):
+        return db.session.query(record_cls.id,
+                record_cls.user_id, record_cls.repo).filter(
+                record_cls.github_webhook_id == -1, *criteria)
+
+    def _add(self, index, keys, record_cls, record_id, user_id, repo):
+        key = (record_cls, user_id, repo.lower())
+        index.setdefault(key, []).append(record_id)
+        keys[(record_cls, str(record_id))] = key
+
+    def _remove(self, index, keys, record_cls, record_id):
+        key = keys.pop((record_cls, record_id), None)
+        if key is None:
+            return
+        ids = [i for i in index[key] if str(i) != record_id]
+        if ids:
+            index[key] = ids
+        else:
+            del index[key]
+
+    def _update(self):
+        """
+        Builds the index, or reloads the records which changed since it was
+        built, and returns it.
+        """
+        with self._update_lock:
+            with self._lock:
+                index, generation = self._index, self._generation
+                stale, self._stale = self._stale, set()
+            if index is None:
+                index, keys = dict(), dict()
+                for _, record_cls in _routes.values():
+                    for row in self._rows(record_cls):
+                        self._add(index, keys, record_cls, *row)
+                with self._lock:
+                    if generation == self._generation:
+                        self._index, self._keys = index, keys
+                return index
+            rows = list()
+            for record_cls in {record_cls for record_cls, _ in stale}:
+                ids = [i for cls, i in stale if cls is record_cls]
+                rows.extend((record_cls, *row) for row in self._rows(
+                    record_cls, record_cls.id.in_(ids)))
+            with self._lock:
+                if generation != self._generation:
+                    # Dropped meanwhile, and rebuilt on the next lookup
+                    return index
+                for record_cls, record_id in stale:
+                    self._remove(index, self._keys, record_cls, record_id)
+                for row in rows:
+                    self._add(index, self._keys, *row)
+            return index
+
+    def lookup(self, record_cls, user_id, full_name):
+        """Returns the IDs of the user's records for a repository."""
+        routing_cache.listen()
+        key = (record_cls, user_id, full_name.lower())
+        with self._lock:
+            if self._index is not None and not self._stale:
+                return list(self._index.get(key, []))
+        index = self._update()
+        with self._lock:
+            return list(index.get(key, []))
+
+repo_routes = RepoRoutes()
+
+@csrf_bypass
+@app.route("/github/org-webhook/<record_id>", methods=["POST"])
+def github_org_webhook(record_id):
+    try:
+        record_id = UUID(record_id)
+    except ValueError:
+        return "Invalid hook ID", 400
+    hook = GitHubOrgHook.query.filter(
+            GitHubOrgHook.id == record_id).one_or_none()
+    if not hook:
+        return "Unknown hook " + str(record_id), 404
+    event = request.headers.get("X-GitHub-Event")
+    if event not in _routes:
+        return f"Ignoring {event} event"
+    endpoint, record_cls = _routes[event]
+    payload = request.get_json(silent=True) or dict()
+    full_name = (payload.get("repository") or dict()).get("full_name")
+    if not full_name:
+        return "Expected a repository", 400
+    records = repo_routes.lookup(record_cls, hook.user_id, full_name)
+    if not records:
+        return f"No tasks for {full_name}"
+    # Each task's own webhook view handles the delivery, as if it had been
+    # delivered to its repository webhook
+    view = app.view_functions[endpoint]
+    results = list()
+    for task_record_id in records:
+        resp = make_response(view(record_id=str(task_record_id)))
+        results.append("{}: {}".format(task_record_id,
+            resp.get_data(as_text=True)))
+    return "\n\n".join(results)
+
+def _authorization():
+    return GitHubAuthorization.query.filter(
+            GitHubAuthorization.user_id == current_user.id).one()
+
+def _message(ex):
+    """Returns GitHub's explanation of a failed request."""
+    if isinstance(ex.data, dict) and ex.data.get("message"):
+        return ex.data["message"]
+    return f"HTTP {ex.status}"
+
+def _org_hooks(github, errors=None):
+    hooks = {hook.org.lower(): hook for hook in GitHubOrgHook.query.filter(
+        GitHubOrgHook.user_id == current_user.id)}
+    orgs = [org.login for org in github.get_user().get_orgs()]
+    return render_template("github/org-hooks.html",
+            orgs=orgs, hooks=hooks, errors=errors or [])
+
+def _recreate_repo_hooks(token, org):
+    """
+    Gives each of the user's tasks which relies on the webhook of org a
+    repository webhook of its own. Returns an error for each task which
+    could not be given one.
+    """
+    prefix = org.lower() + "/"
+    records, work = list(), list()
+    for event, (endpoint, record_cls) in _routes.items():
+        for record in record_cls.query.filter(
+                record_cls.user_id == current_user.id,
+                record_cls.github_webhook_id == -1):
+            if not record.repo.lower().startswith(prefix):
+                continue
+            records.append(record)
+            work.append((record.repo, event,
+                _root + url_for(endpoint, record_id=record.id)))
+    if not work:
+        return []
+
+    def create_hook(args):
+        full_name, event, url = args
+        try:
+            repo = github_client(token).get_repo(full_name, lazy=True)
+            return repo.create_hook("web", {
+                "url": url,
+                "content_type": "json",
+            }, [event], active=True).id, None
+        except GithubException as ex:
+            return None, f"{full_name}: {_message(ex)}"
+    with ThreadPoolExecutor(
+            max_workers=min(len(work), _concurrency)) as executor:
+        hooks = list(executor.map(create_hook, work))
+    errors = list()
+    for record, (hook_id, error) in zip(records, hooks):
+        if error:
+            errors.append(error)
+        else:
+            record.github_webhook_id = hook_id
+    db.session.commit()
+    return errors
+
+@app.route("/github/org-hooks")
+@githubloginrequired
+def github_org_hooks(github):
+    return _org_hooks(github)
+
+@app.route("/github/org-hooks", methods=["POST"])
+@githubloginrequired
+def github_org_hooks_POST(github):
+    valid = Validation(request)
+    org = valid.require("org")
+    if not valid.ok:
+        abort(400)
+    existing = GitHubOrgHook.query.filter(
+            GitHubOrgHook.user_id == current_user.id,
+            sa.func.lower(GitHubOrgHook.org) == org.lower()).one_or_none()
+    if existing:
+        return redirect(url_for("github_org_hooks"))
+    scopes = _authorization().scopes.replace(",", " ").split()
+    if "admin:org_hook" not in scopes:
+        # Authorized before org webhooks were supported
+        return github_redirect(url_for("github_org_hooks"))
+    # The webhook is created before the record, so that no record is ever
+    # left without one
+    record_id = uuid4()
+    name = org
+    try:
+        org = github.get_organization(name)
+        hook = org.create_hook("web", {
+            "url": _root + url_for("github_org_webhook", record_id=record_id),
+            "content_type": "json",
+        }, ["push", "pull_request"], active=True)
+    except BadCredentialsException:
+        raise
+    except GithubException as ex:
+        return _org_hooks(github, errors=[
+            f"Unable to add a webhook to {name}: {_message(ex)}"])
+    record = GitHubOrgHook()
+    record.id = record_id
+    record.user_id = current_user.id
+    record.org = org.login
+    record.github_webhook_id = hook.id
+    db.session.add(record)
+    try:
+        db.session.commit()
+    except:
+        db.session.rollback()
+        try:
+            hook.delete()
+        except GithubException:
+            pass
+        raise
+    return redirect(url_for("github_org_hooks"))
+
+@app.route("/github/org-hooks/<record_id>/delete", methods=["POST"])
+@githubloginrequired
+def github_org_hooks_delete_POST(github, record_id):
+    try:
+        record_id = UUID(record_id)
+    except ValueError:
+        abort(404)
+    record = GitHubOrgHook.query.filter(
+            GitHubOrgHook.id == record_id,
+            GitHubOrgHook.user_id == current_user.id).one_or_none()
+    if not record:
+        abort(404)
+    # Tasks which relied on this webhook get their own, and it is kept
+    # until all of them have one
+    errors = _recreate_repo_hooks(_authorization().oauth_token, record.org)
+    if errors:
+        return _org_hooks(github, errors=["Some repositories could not be "
+            f"given a webhook of their own, so the webhook on {record.org} "
+            "was kept:"] + errors)
+    try:
+        github.get_organization(record.org).get_hook(
+                record.github_webhook_id).delete()
+    except GithubException:
+        pass # Already removed on GitHub
+    db.session.delete(record)
+    db.session.commit()
+    return redirect(url_for("github_org_hooks"))
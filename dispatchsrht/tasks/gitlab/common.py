@@ -2,24 +2,39 @@ import html
 import json
 import requests
 import sqlalchemy as sa
-import yaml
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from dispatchsrht.app import app
-from dispatchsrht.builds import encrypt_notify_url, first_line, submit_build
-from dispatchsrht.builds import decrypt_notify_payload
+from dispatchsrht.bulk import bulk_response, configure_many, requested_repos
+from dispatchsrht.builds import decrypt_notify_payload, register_callback
+from dispatchsrht.builds import first_line, on_outbox_result, submit_build
+from dispatchsrht.cache import LRUCache
+from dispatchsrht.clients import client_pool
+from dispatchsrht.httpcache import ConditionalSession
+from dispatchsrht.manifests import manifest_cache, parse_manifest
+from dispatchsrht.repos import RepoIndex
+from dispatchsrht.routing import routing_cache
+from dispatchsrht.status import status_reporter
+from dispatchsrht.types import BuildCallback, User
 from flask import abort, redirect, render_template, request, url_for
 from functools import wraps
-from srht.config import cfg, cfgb
+from sqlalchemy.dialects.postgresql import insert
+from srht.config import cfg, cfgb, cfgi
 from srht.database import Base, db
 from srht.flask import csrf_bypass
 from srht.oauth import current_user, loginrequired
-from urllib.parse import urlencode, urlparse
+from urllib.parse import quote, urlencode, urlparse
 
 _root = cfg("dispatch.sr.ht", "origin")
 _builds_sr_ht = cfg("builds.sr.ht", "origin", default=None)
 _gitlab_enabled = cfgb("dispatch.sr.ht::gitlab", "enabled", default=False)
+_fetch_concurrency = cfgi("dispatch.sr.ht",
+        "gitlab-fetch-concurrency", default=8)
+# Manifest listings by (upstream, project, commit)
+_manifest_trees = LRUCache(1024)
 
 if _builds_sr_ht:
-    from buildsrht.manifest import Manifest, Trigger
+    from buildsrht.manifest import Trigger
 
 if _gitlab_enabled:
     from gitlab import Gitlab
@@ -27,6 +42,10 @@ if _gitlab_enabled:
 
 class GitLabAuthorization(Base):
     __tablename__ = "gitlab_authorization"
+    __table_args__ = (
+        sa.Index("ix_gitlab_authorization_user_id_upstream",
+            "user_id", "upstream", unique=True),
+    )
     id = sa.Column(sa.Integer, primary_key=True)
     created = sa.Column(sa.DateTime, nullable=False)
     updated = sa.Column(sa.DateTime, nullable=False)
@@ -35,6 +54,12 @@ class GitLabAuthorization(Base):
     upstream = sa.Column(sa.Unicode, nullable=False)
     oauth_token = sa.Column(sa.Unicode(512), nullable=False)
 
+def gitlab_client(upstream, oauth_token):
+    """Returns a pooled python-gitlab client for upstream and oauth_token."""
+    return client_pool.get(upstream, oauth_token,
+            lambda: Gitlab(f"https://{upstream}", oauth_token=oauth_token,
+                session=ConditionalSession()))
+
 def gitlab_redirect(upstream, return_to):
     gl_authorize_url = f"https://{upstream}/oauth/authorize"
     gl_client = cfg("dispatch.sr.ht::gitlab", upstream, default=None)
@@ -60,9 +85,10 @@ def gitlabloginrequired(f):
         if not auth:
             return gitlab_redirect(upstream, request.path)
         try:
-            gitlab = Gitlab(f"https://{upstream}", oauth_token=auth.oauth_token)
+            gitlab = gitlab_client(upstream, auth.oauth_token)
             return f(gitlab, upstream, *args, **kwargs)
         except GitlabError:
+            client_pool.evict(auth.oauth_token)
             db.session.delete(auth)
             db.session.commit()
             return gitlab_redirect(upstream, request.path)
@@ -98,14 +124,27 @@ def gitlab_callback(upstream):
         return "An error occured"
     json = resp.json()
     access_token = json.get("access_token")
-    auth = GitLabAuthorization()
-    auth.user_id = current_user.id
-    auth.oauth_token = access_token
-    auth.upstream = upstream
-    db.session.add(auth)
-    db.session.commit()
+    save_authorization(current_user.id, upstream, access_token)
     return redirect(state)
 
+def save_authorization(user_id, upstream, oauth_token):
+    """Stores a user's token, replacing the one they authorized before."""
+    old = GitLabAuthorization.query.filter(
+            GitLabAuthorization.user_id == user_id,
+            GitLabAuthorization.upstream == upstream).one_or_none()
+    if old and old.oauth_token != oauth_token:
+        client_pool.evict(old.oauth_token)
+    now = datetime.utcnow()
+    db.session.execute(insert(GitLabAuthorization.__table__)
+        .values(created=now, updated=now, user_id=user_id,
+            upstream=upstream, oauth_token=oauth_token)
+        .on_conflict_do_update(index_elements=["user_id", "upstream"], set_={
+            "updated": now,
+            "oauth_token": oauth_token,
+        }))
+    routing_cache.invalidate()
+    db.session.commit()
+
 def source_url(project, commit, url, source):
     if not url.endswith("/" + project.attributes["name"]):
         return url
@@ -120,49 +159,213 @@ def source_url(project, commit, url, source):
 context = lambda name: urlparse(_builds_sr_ht).netloc + (f": {name}" if name else "")
 
 
-def update_preparing(commit):
+def status_url(upstream, project_id, sha):
+    return f"https://{upstream}/api/v4/projects/{project_id}/statuses/{sha}"
+
+def update_preparing(upstream, token, project_id, sha):
     def go(name):
-        try:
-            status = commit.statuses.create({
-                "state": "pending",
-                "context": context(name),
-                "target_url": _builds_sr_ht,
-            })
-        except GitlabError:
-            pass
+        status_reporter.report(status_url(upstream, project_id, sha),
+                f"Bearer {token}", {
+                    "state": "pending",
+                    "context": context(name),
+                    "target_url": _builds_sr_ht,
+                })
     return go
 
-def update_submitted(commit, username):
+def update_submitted(upstream, token, project_id, sha, username):
     def go(name, build_id):
         build_url = "{}/~{}/job/{}".format(
                 _builds_sr_ht, username, build_id)
-        try:
-            status = commit.statuses.create({
-                "state": "running",
-                "context": context(name),
-                "target_url": build_url,
+        status_reporter.report(status_url(upstream, project_id, sha),
+                f"Bearer {token}", {
+                    "state": "running",
+                    "context": context(name),
+                    "target_url": build_url,
+                })
+        return build_url
+    return go
+
+def push_superseded(hook, auth, payload):
+    """Marks a push which was coalesced into a newer one as superseded."""
+    if not auth or not payload.get("after"):
+        return
+    status_reporter.report(
+            status_url(hook.upstream, hook.repo_id, payload["after"]),
+            f"Bearer {auth.oauth_token}", {
+                "state": "canceled",
+                "context": context(None),
+                "target_url": _builds_sr_ht,
+                "description": "superseded by a newer push",
             })
-            return build_url
+
+def list_projects(upstream, oauth_token):
+    """
+    Lists every project the user owns on upstream, sorted by name. Once the
+    first page says how many there are, the rest are fetched concurrently.
+    """
+    gitlab = gitlab_client(upstream, oauth_token)
+    def fetch_page(page):
+        return gitlab.http_request("get", "/projects", query_data={
+            "owned": "true",
+            "simple": "true",
+            "per_page": 100,
+            "page": page,
+        })
+    resp = fetch_page(1)
+    pages = [resp.json()]
+    total_pages = resp.headers.get("X-Total-Pages")
+    if total_pages:
+        total_pages = int(total_pages)
+        if total_pages > 1:
+            workers = min(total_pages - 1, _fetch_concurrency)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pages += [r.json() for r in executor.map(
+                    fetch_page, range(2, total_pages + 1))]
+    else:
+        # GitLab leaves the totals out for very large collections
+        while resp.headers.get("X-Next-Page"):
+            resp = fetch_page(int(resp.headers["X-Next-Page"]))
+            pages.append(resp.json())
+    projects = [{
+        "id": project["id"],
+        "name_with_namespace": project["name_with_namespace"],
+        "web_url": project["web_url"],
+    } for page in pages for project in page]
+    return sorted(projects, key=lambda p: p["name_with_namespace"])
+
+gitlab_projects = RepoIndex("gitlab", list_projects)
+
+def select_project(upstream, existing):
+    """
+    Renders the picker of the current user's projects on upstream, excluding
+    those in existing.
+    """
+    auth = GitLabAuthorization.query.filter(
+            GitLabAuthorization.user_id == current_user.id,
+            GitLabAuthorization.upstream == upstream).one()
+    repos = gitlab_projects.get(f"{current_user.id}.{upstream}",
+            upstream, auth.oauth_token, refresh="refresh" in request.args)
+    return render_template("gitlab/select-repo.html",
+            repos=repos, existing=set(existing))
+
+def select_projects(upstream, existing):
+    """
+    Renders the picker for configuring several of the current user's
+    projects on upstream at once, excluding those in existing.
+    """
+    auth = GitLabAuthorization.query.filter(
+            GitLabAuthorization.user_id == current_user.id,
+            GitLabAuthorization.upstream == upstream).one()
+    repos = gitlab_projects.get(f"{current_user.id}.{upstream}",
+            upstream, auth.oauth_token)
+    if repos is not None:
+        existing = set(existing)
+        repos = [(r["id"], r["name_with_namespace"]) for r in repos
+                if r["id"] not in existing]
+    return render_template("bulk-configure.html",
+            repos=repos, forge="gitlab")
+
+def configure_projects(taskdef, record_cls, upstream, events):
+    """
+    Configures a task for each project on upstream named by ID in the
+    request, with a webhook for events, and returns the results per project.
+    """
+    auth = GitLabAuthorization.query.filter(
+            GitLabAuthorization.user_id == current_user.id,
+            GitLabAuthorization.upstream == upstream).one()
+    token = auth.oauth_token
+    index = {str(r["id"]): r for r in gitlab_projects.get(
+        f"{current_user.id}.{upstream}", upstream, token) or []}
+    existing = {str(r.repo_id) for r in record_cls.query.filter(
+        record_cls.user_id == current_user.id,
+        record_cls.upstream == upstream)}
+    results, repos = list(), list()
+    for repo_id in dict.fromkeys(requested_repos()):
+        if repo_id in existing:
+            results.append((repo_id, None, "Already configured"))
+        elif repo_id not in index:
+            results.append((repo_id, None,
+                "Not a project you own, or not fetched yet"))
+        else:
+            repo = index[repo_id]
+            repos.append((repo["name_with_namespace"], repo))
+
+    def setup_record(record, repo):
+        record.repo_name = repo["name_with_namespace"]
+        record.repo_id = repo["id"]
+        record.web_url = repo["web_url"]
+        record.upstream = upstream
+
+    def create_hook(repo, url):
+        project = gitlab_client(upstream, token).projects.get(
+                repo["id"], lazy=True)
+        hook = dict(events)
+        hook["url"] = url
+        return project.hooks.create(hook).id
+
+    def delete_hook(repo, hook_id):
+        project = gitlab_client(upstream, token).projects.get(
+                repo["id"], lazy=True)
+        project.hooks.delete(hook_id)
+
+    results += configure_many(taskdef, record_cls, repos,
+            setup_record, create_hook, delete_hook, "gitlab_webhook_id")
+    return bulk_response(results)
+
+def _manifest_blobs(project, sha):
+    """
+    Lists the build manifests of a commit as (filename, blob ID) tuples. The
+    .build.yml lookup and the .builds listing are made concurrently.
+    """
+    key = (project.manager.gitlab.url, project.get_id(), sha)
+    blobs = _manifest_trees.get(key)
+    if blobs is not None:
+        return blobs
+
+    def single():
+        resp = project.manager.gitlab.http_request("head",
+                "/projects/{}/repository/files/{}".format(
+                    project.get_id(), quote(".build.yml", safe="")),
+                query_data={"ref": sha})
+        return [(".build.yml", resp.headers["X-Gitlab-Blob-Id"])]
+
+    def tree():
+        tree = project.repository_tree(path=".builds", ref=sha, all=True)
+        return [(e["name"], e["id"]) for e in tree
+                if e["type"] == "blob" and e["name"].endswith(".yml")]
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        single_blob, tree_blobs = executor.submit(single), executor.submit(tree)
+        try:
+            blobs = single_blob.result()
         except GitlabError:
-            return ""
-    return go
+            blobs = tree_blobs.result()
+    _manifest_trees.set(key, blobs)
+    return blobs
+
+def fetch_manifests(project, sha):
+    """
+    Returns the build manifests of a commit as a list of (filename, text)
+    tuples. Only blobs which are not in the manifest cache are downloaded,
+    concurrently and without the base64 wrapping of the files API.
+    """
+    def download(oids):
+        workers = min(len(oids), _fetch_concurrency)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            texts = executor.map(
+                    lambda oid: project.repository_raw_blob(oid).decode(),
+                    oids)
+            return dict(zip(oids, texts))
+    return manifest_cache.fetch(_manifest_blobs(project, sha), download)
 
 def submit_gitlab_build(tag, auth, hook, project, commit,
         source=None, env=dict(), is_mr=False):
     if source is None:
         source = project
     try:
-        files = [source.files.get(file_path=".build.yml",
-            ref=commit.get_id())]
+        files = fetch_manifests(source, commit.get_id())
     except GitlabError:
-        try:
-            tree = source.repository_tree(
-                    path=".builds", ref=commit.get_id())
-            files = [source.files.get(file_path=e['path'],
-                        ref=commit.get_id())
-                    for e in tree if e['path'].endswith(".yml")]
-        except GitlabError:
-            return "There are no build manifests in this repository."
+        return "There are no build manifests in this repository."
 
     env.update({
         "GITLAB_REPOSITORY": hook.repo_name,
@@ -170,11 +373,10 @@ def submit_gitlab_build(tag, auth, hook, project, commit,
     })
 
     manifests = list()
-    for f in files:
-        name = f.attributes["file_name"]
-        manifest = f.decode()
+    callbacks = dict()
+    for name, manifest in files:
         try:
-            manifest = Manifest(yaml.safe_load(manifest))
+            manifest = parse_manifest(manifest)
         except Exception as ex:
             return f"There are errors in {name}:\n{str(ex)}", 400
 
@@ -186,17 +388,14 @@ def submit_gitlab_build(tag, auth, hook, project, commit,
         else:
             manifest.environment.update(env)
 
-        notify_payload = {
-            "context": context(name),
-            "oauth_token": auth.oauth_token,
-            "project_id": project.get_id(),
-            "sha": commit.get_id(),
-            "upstream": hook.upstream,
-            "username": auth.user.username,
-        }
-
-        notify_url = encrypt_notify_url(
-                "gitlab_complete_build", notify_payload)
+        callbacks[name], notify_url = register_callback(
+                "gitlab_complete_callback",
+                task_id=hook.task_id,
+                user_id=hook.user_id,
+                upstream=hook.upstream,
+                repo=str(project.get_id()),
+                sha=commit.get_id(),
+                context=context(name))
 
         manifest.triggers.append(Trigger({
             "action": "webhook",
@@ -213,19 +412,77 @@ def submit_gitlab_build(tag, auth, hook, project, commit,
             commit.attributes["committer_name"],
             commit.attributes["committer_email"])
 
-    return submit_build([project.attributes['name'], tag], manifests,
+    urls, errors = submit_build([project.attributes['name'], tag], manifests,
             hook.user, note=note, secrets=hook.secrets,
-            preparing=update_preparing(commit),
-            submitted=update_submitted(commit, auth.user.username))
+            preparing=update_preparing(hook.upstream, auth.oauth_token,
+                project.get_id(), commit.get_id()),
+            submitted=update_submitted(hook.upstream, auth.oauth_token,
+                project.get_id(), commit.get_id(), auth.user.username),
+            callbacks=callbacks)
+    db.session.commit()
+    return urls, errors
+
+def _callback(callback_id):
+    """Returns a GitLab build callback with its user's token and username."""
+    return (db.session.query(BuildCallback,
+                GitLabAuthorization.oauth_token, User.username)
+            .join(GitLabAuthorization, sa.and_(
+                GitLabAuthorization.user_id == BuildCallback.user_id,
+                GitLabAuthorization.upstream == BuildCallback.upstream))
+            .join(User, User.id == BuildCallback.user_id)
+            .filter(BuildCallback.id == callback_id)
+            .first())
+
+@on_outbox_result
+def gitlab_outbox_result(callback_id, job_id, error):
+    """Reports a build which was held in the outbox once it is sent."""
+    row = _callback(callback_id) if callback_id else None
+    if not row:
+        return
+    callback, oauth_token, username = row
+    if job_id:
+        status = {
+            "state": "running",
+            "target_url": "{}/~{}/job/{}".format(
+                _builds_sr_ht, username, job_id),
+        }
+    else:
+        status = {
+            "state": "failed",
+            "target_url": _builds_sr_ht,
+            "description": "builds.sr.ht rejected the job",
+        }
+    status["context"] = callback.context
+    status_reporter.report(status_url(callback.upstream, callback.repo,
+            callback.sha), f"Bearer {oauth_token}", status)
+
+@csrf_bypass
+@app.route("/gitlab/complete/<callback_id>", methods=["POST"])
+def gitlab_complete_callback(callback_id):
+    row = _callback(callback_id)
+    if not row:
+        return "Unknown or revoked callback", 404
+    callback, oauth_token, username = row
+    return complete_build({
+        "context": callback.context,
+        "oauth_token": oauth_token,
+        "project_id": int(callback.repo),
+        "sha": callback.sha,
+        "upstream": callback.upstream,
+        "username": username,
+    })
 
 @csrf_bypass
 @app.route("/gitlab/complete_build/<payload>", methods=["POST"])
 def gitlab_complete_build(payload):
+    # Builds submitted before callbacks were recorded in the database
+    return complete_build(decrypt_notify_payload(payload))
+
+def complete_build(payload):
     result = json.loads(request.data.decode('utf-8'))
     build_id = result["id"]
     status = result["status"]
 
-    payload = decrypt_notify_payload(payload)
     context = payload["context"]
     oauth_token = payload["oauth_token"]
     project_id = payload["project_id"]
@@ -233,18 +490,18 @@ def gitlab_complete_build(payload):
     upstream = payload["upstream"]
     username = payload["username"]
 
-    gitlab = Gitlab(f"https://{upstream}", oauth_token=oauth_token)
-    project = gitlab.projects.get(project_id)
-    commit = project.commits.get(sha)
-
     build_url = "{}/~{}/job/{}".format(
             _builds_sr_ht, username, build_id)
 
-    status = commit.statuses.create({
-        "state": "success" if status == "success" else "failed",
-        "context": context,
-        "target_url": build_url,
-        "description": "completed successfully" if status == "success" else "failed",
-    })
+    # Queued behind any earlier status for this job, so that it cannot be
+    # overwritten by one which was still waiting to be sent
+    status_reporter.report(status_url(upstream, project_id, sha),
+            f"Bearer {oauth_token}", {
+                "state": "success" if status == "success" else "failed",
+                "context": context,
+                "target_url": build_url,
+                "description": "completed successfully"
+                    if status == "success" else "failed",
+            })
 
     return f"Sent build status to {upstream}"
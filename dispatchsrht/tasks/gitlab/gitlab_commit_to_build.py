@@ -1,8 +1,18 @@
 import sqlalchemy as sa
 import sqlalchemy_utils as sau
 from dispatchsrht.tasks.gitlab.common import GitLabAuthorization
+from dispatchsrht.tasks.gitlab.common import gitlab_client
 from dispatchsrht.tasks.gitlab.common import gitlabloginrequired
+from dispatchsrht.tasks.gitlab.common import configure_projects
+from dispatchsrht.tasks.gitlab.common import select_project, select_projects
+from dispatchsrht.tasks.gitlab.common import push_superseded
 from dispatchsrht.tasks.gitlab.common import submit_gitlab_build
+from dispatchsrht.builds import describe_builds
+from dispatchsrht.bulk import json_only
+from dispatchsrht.idempotency import idempotent
+from dispatchsrht.queue import coalesce_pushes, queue_enabled, queueable
+from dispatchsrht.queue import validate_debounce
+from dispatchsrht.routing import routing_cache
 from dispatchsrht.tasks import TaskDef
 from dispatchsrht.types import Task
 from flask import Blueprint, redirect, render_template, request, url_for
@@ -18,9 +28,6 @@ _root = cfg("dispatch.sr.ht", "origin")
 _builds_sr_ht = cfg("builds.sr.ht", "origin", default=None)
 _gitlab_enabled = cfgb("dispatch.sr.ht::gitlab", "enabled", default=False)
 
-if _gitlab_enabled:
-    from gitlab import Gitlab
-
 class GitLabCommitToBuild(TaskDef):
     name = "gitlab_commit_to_build"
     enabled = bool(_gitlab_enabled and _builds_sr_ht)
@@ -46,17 +53,22 @@ class GitLabCommitToBuild(TaskDef):
         gitlab_webhook_id = sa.Column(sa.Integer, nullable=False)
         secrets = sa.Column(sa.Boolean, nullable=False, server_default='t')
         upstream = sa.Column(sa.Unicode, nullable=False)
+        debounce = sa.Column(sa.Integer, nullable=False, server_default='0')
+
+    routing_cache.register(_GitLabCommitToBuildRecord,
+            GitLabAuthorization, "user_id", "upstream")
 
     blueprint = Blueprint("gitlab_commit_to_build",
             __name__, template_folder="gitlab_commit_to_build")
 
-    def edit_GET(task):
+    def edit_GET(task, valid=None):
         record = GitLabCommitToBuild._GitLabCommitToBuildRecord.query.filter(
             GitLabCommitToBuild._GitLabCommitToBuildRecord.task_id == task.id
         ).one_or_none()
         if not record:
             abort(404)
-        return render_template("gitlab/edit.html", task=task, record=record)
+        return render_template("gitlab/edit.html", task=task, record=record,
+                queue_enabled=queue_enabled, valid=valid)
 
     def edit_POST(task):
         record = GitLabCommitToBuild._GitLabCommitToBuildRecord.query.filter(
@@ -64,7 +76,12 @@ class GitLabCommitToBuild(TaskDef):
         ).one_or_none()
         valid = Validation(request)
         secrets = valid.optional("secrets", cls=bool, default=False)
+        debounce = validate_debounce(valid, record.debounce)
+        if not valid.ok:
+            return render_template("task-settings.html", view="summary",
+                    task=task, taskdef=GitLabCommitToBuild, valid=valid)
         record.secrets = bool(secrets)
+        record.debounce = debounce
         db.session.commit()
         return redirect(url_for("html.edit_task", task_id=task.id))
 
@@ -83,14 +100,32 @@ class GitLabCommitToBuild(TaskDef):
     @blueprint.route("/configure/<upstream>")
     @gitlabloginrequired
     def configure_repo_GET(gitlab, upstream):
-        repos = gitlab.projects.list(owned=True)
-        repos = sorted(repos, key=lambda r: r.attributes["name_with_namespace"])
         existing = GitLabCommitToBuild._GitLabCommitToBuildRecord.query.filter(
                 GitLabCommitToBuild._GitLabCommitToBuildRecord.user_id == current_user.id,
                 GitLabCommitToBuild._GitLabCommitToBuildRecord.upstream == upstream).all()
-        existing = [e.repo_id for e in existing]
-        return render_template("gitlab/select-repo.html",
-                repos=repos, existing=existing)
+        return select_project(upstream, [e.repo_id for e in existing])
+
+    @blueprint.route("/configure/<upstream>/bulk")
+    @gitlabloginrequired
+    def configure_bulk(gitlab, upstream):
+        existing = GitLabCommitToBuild._GitLabCommitToBuildRecord.query.filter(
+                GitLabCommitToBuild._GitLabCommitToBuildRecord.user_id == current_user.id,
+                GitLabCommitToBuild._GitLabCommitToBuildRecord.upstream == upstream).all()
+        return select_projects(upstream, [e.repo_id for e in existing])
+
+    @blueprint.route("/configure/<upstream>/bulk", methods=["POST"])
+    @gitlabloginrequired
+    def configure_bulk_POST(gitlab, upstream):
+        return configure_projects(GitLabCommitToBuild.name,
+                GitLabCommitToBuild._GitLabCommitToBuildRecord, upstream, {"push_events": 1})
+
+    @csrf_bypass
+    @blueprint.route("/configure/<upstream>/bulk.json", methods=["POST"])
+    @gitlabloginrequired
+    @json_only
+    def configure_bulk_json(gitlab, upstream):
+        return configure_projects(GitLabCommitToBuild.name,
+                GitLabCommitToBuild._GitLabCommitToBuildRecord, upstream, {"push_events": 1})
 
     @blueprint.route("/configure/<upstream>", methods=["POST"])
     @gitlabloginrequired
@@ -135,21 +170,18 @@ class GitLabCommitToBuild(TaskDef):
 
     @csrf_bypass
     @blueprint.route("/webhook/<record_id>", methods=["POST"])
+    @idempotent
+    @queueable("gitlab_commit_to_build._webhook", _GitLabCommitToBuildRecord,
+            coalesce=coalesce_pushes, superseded=push_superseded)
     def _webhook(record_id):
         record_id = UUID(record_id)
-        hook = GitLabCommitToBuild._GitLabCommitToBuildRecord.query.filter(
-                GitLabCommitToBuild._GitLabCommitToBuildRecord.id == record_id
-            ).one_or_none()
+        hook, auth = routing_cache.resolve(
+                GitLabCommitToBuild._GitLabCommitToBuildRecord, record_id)
         if not hook:
             return "Unknown hook " + str(record_id), 404
-        auth = GitLabAuthorization.query.filter(
-                GitLabAuthorization.user_id == hook.user_id,
-                GitLabAuthorization.upstream == hook.upstream,
-            ).first()
         if not auth:
             return "Invalid authorization for this hook"
-        gitlab = Gitlab(f"https://{hook.upstream}",
-                oauth_token=auth.oauth_token)
+        gitlab = gitlab_client(hook.upstream, auth.oauth_token)
 
         valid = Validation(request)
         commit = valid.require("after")
@@ -163,9 +195,6 @@ class GitLabCommitToBuild(TaskDef):
         except:
             return "Unable to fetch commit information"
 
-        urls = submit_gitlab_build("commits", auth, hook, project, commit, env={
-            "GITLAB_REF": ref,
-        })
-        if isinstance(urls, str):
-            return urls
-        return "Submitted:\n\n" + "\n".join([f"{n}: {u}" for n, u in urls])
+        urls, errors = submit_gitlab_build("commits", auth, hook, project,
+                commit, env={"GITLAB_REF": ref})
+        return describe_builds(urls, errors)
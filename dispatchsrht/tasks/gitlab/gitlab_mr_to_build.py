@@ -1,8 +1,16 @@
 import sqlalchemy as sa
 import sqlalchemy_utils as sau
 from dispatchsrht.tasks.gitlab.common import GitLabAuthorization
+from dispatchsrht.tasks.gitlab.common import gitlab_client
 from dispatchsrht.tasks.gitlab.common import gitlabloginrequired
+from dispatchsrht.tasks.gitlab.common import configure_projects
+from dispatchsrht.tasks.gitlab.common import select_project, select_projects
 from dispatchsrht.tasks.gitlab.common import submit_gitlab_build
+from dispatchsrht.builds import describe_builds
+from dispatchsrht.bulk import json_only
+from dispatchsrht.idempotency import idempotent
+from dispatchsrht.queue import queueable
+from dispatchsrht.routing import routing_cache
 from dispatchsrht.tasks import TaskDef
 from dispatchsrht.types import Task
 from flask import Blueprint, redirect, render_template, request, url_for
@@ -18,9 +26,6 @@ _root = cfg("dispatch.sr.ht", "origin")
 _builds_sr_ht = cfg("builds.sr.ht", "origin", default=None)
 _gitlab_enabled = cfgb("dispatch.sr.ht::gitlab", "enabled", default=False)
 
-if _gitlab_enabled:
-    from gitlab import Gitlab
-
 class GitLabMRToBuild(TaskDef):
     name = "gitlab_mr_to_build"
     enabled = bool(_gitlab_enabled and _builds_sr_ht)
@@ -48,6 +53,9 @@ class GitLabMRToBuild(TaskDef):
         private = sa.Column(sa.Boolean, nullable=False, server_default='f')
         secrets = sa.Column(sa.Boolean, nullable=False, server_default='f')
 
+    routing_cache.register(_GitLabMRToBuildRecord,
+            GitLabAuthorization, "user_id", "upstream")
+
     blueprint = Blueprint("gitlab_mr_to_build",
             __name__, template_folder="gitlab_mr_to_build")
 
@@ -85,14 +93,32 @@ class GitLabMRToBuild(TaskDef):
     @blueprint.route("/configure/<upstream>")
     @gitlabloginrequired
     def configure_repo_GET(gitlab, upstream):
-        repos = gitlab.projects.list(owned=True)
-        repos = sorted(repos, key=lambda r: r.attributes["name_with_namespace"])
         existing = GitLabMRToBuild._GitLabMRToBuildRecord.query.filter(
                 GitLabMRToBuild._GitLabMRToBuildRecord.user_id == current_user.id,
                 GitLabMRToBuild._GitLabMRToBuildRecord.upstream == upstream).all()
-        existing = [e.repo for e in existing]
-        return render_template("gitlab/select-repo.html",
-                repos=repos, existing=existing)
+        return select_project(upstream, [e.repo_id for e in existing])
+
+    @blueprint.route("/configure/<upstream>/bulk")
+    @gitlabloginrequired
+    def configure_bulk(gitlab, upstream):
+        existing = GitLabMRToBuild._GitLabMRToBuildRecord.query.filter(
+                GitLabMRToBuild._GitLabMRToBuildRecord.user_id == current_user.id,
+                GitLabMRToBuild._GitLabMRToBuildRecord.upstream == upstream).all()
+        return select_projects(upstream, [e.repo_id for e in existing])
+
+    @blueprint.route("/configure/<upstream>/bulk", methods=["POST"])
+    @gitlabloginrequired
+    def configure_bulk_POST(gitlab, upstream):
+        return configure_projects(GitLabMRToBuild.name,
+                GitLabMRToBuild._GitLabMRToBuildRecord, upstream, {"merge_requests_events": 1})
+
+    @csrf_bypass
+    @blueprint.route("/configure/<upstream>/bulk.json", methods=["POST"])
+    @gitlabloginrequired
+    @json_only
+    def configure_bulk_json(gitlab, upstream):
+        return configure_projects(GitLabMRToBuild.name,
+                GitLabMRToBuild._GitLabMRToBuildRecord, upstream, {"merge_requests_events": 1})
 
     @blueprint.route("/configure/<upstream>", methods=["POST"])
     @gitlabloginrequired
@@ -137,21 +163,17 @@ class GitLabMRToBuild(TaskDef):
 
     @csrf_bypass
     @blueprint.route("/webhook/<record_id>", methods=["POST"])
+    @idempotent
+    @queueable("gitlab_mr_to_build._webhook", _GitLabMRToBuildRecord)
     def _webhook(record_id):
         record_id = UUID(record_id)
-        hook = GitLabMRToBuild._GitLabMRToBuildRecord.query.filter(
-                GitLabMRToBuild._GitLabMRToBuildRecord.id == record_id
-            ).one_or_none()
+        hook, auth = routing_cache.resolve(
+                GitLabMRToBuild._GitLabMRToBuildRecord, record_id)
         if not hook:
             return "Unknown hook " + str(record_id), 404
-        auth = GitLabAuthorization.query.filter(
-                GitLabAuthorization.user_id == hook.user_id,
-                GitLabAuthorization.upstream == hook.upstream,
-            ).first()
         if not auth:
             return "Invalid authorization for this hook"
-        gitlab = Gitlab(f"https://{hook.upstream}",
-                oauth_token=auth.oauth_token)
+        gitlab = gitlab_client(hook.upstream, auth.oauth_token)
 
         valid = Validation(request)
         object_attrs = valid.require("object_attributes")
@@ -165,17 +187,18 @@ class GitLabMRToBuild(TaskDef):
         commit = project.commits.get(last_commit["id"])
         merge_req = project.mergerequests.get(object_attrs["iid"])
 
-        urls = submit_gitlab_build("mrs", auth, hook, project, commit, source, {
+        urls, errors = submit_gitlab_build("mrs", auth, hook, project, commit,
+                source, {
             "GITLAB_MR_NUMBER": object_attrs["iid"],
             "GITLAB_MR_TITLE": object_attrs["title"],
             "GITLAB_BASE_REPO": project.attributes["name_with_namespace"],
             "GITLAB_HEAD_REPO": source.attributes["name_with_namespace"],
         })
-        if isinstance(urls, str):
-            return urls
+        if not urls:
+            return describe_builds(urls, errors)
 
         summary = "\n\nbuilds.sr.ht jobs:\n\n" + (
-                "\n".join([f"[{n}]({url}): :clock1: running" for n, u in urls]))
+                "\n".join([f"[{n}]({u}): :clock1: running" for n, u in urls]))
         merge_req.description += summary
         merge_req.save()
-        return 
+        return describe_builds(urls, errors)
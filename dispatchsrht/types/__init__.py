@@ -5,3 +5,6 @@ class User(Base, ExternalUserMixin):
     pass
 
 from dispatchsrht.types.task import Task
+from dispatchsrht.types.delivery import Delivery, DeliveryStatus
+from dispatchsrht.types.outbox import OutboxBuild
+from dispatchsrht.types.callback import BuildCallback
@@ -0,0 +1,27 @@
+import sqlalchemy as sa
+from srht.database import Base
+
+class BuildCallback(Base):
+    """
+    The completion webhook of a submitted build. Its URL only carries the
+    ID, and the forge token is looked up when builds.sr.ht calls it, so
+    deleting the row revokes the callback.
+    """
+    __tablename__ = 'build_callback'
+    id = sa.Column(sa.Unicode(32), primary_key=True)
+    created = sa.Column(sa.DateTime, nullable=False, index=True)
+    updated = sa.Column(sa.DateTime, nullable=False)
+    task_id = sa.Column(sa.Integer,
+            sa.ForeignKey("task.id", ondelete="CASCADE"), nullable=False)
+    user_id = sa.Column(sa.Integer,
+            sa.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    user = sa.orm.relationship("User")
+    # The GitLab instance, or None for GitHub
+    upstream = sa.Column(sa.Unicode)
+    # The repository's full name on GitHub, or project ID on GitLab
+    repo = sa.Column(sa.Unicode, nullable=False)
+    sha = sa.Column(sa.Unicode(40), nullable=False)
+    context = sa.Column(sa.Unicode, nullable=False)
+    pr = sa.Column(sa.Integer)
+    automerge = sa.Column(sa.Boolean, nullable=False, default=False)
+    status_mode = sa.Column(sa.Unicode(16))
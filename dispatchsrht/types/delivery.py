@@ -0,0 +1,38 @@
+import sqlalchemy as sa
+import sqlalchemy_utils as sau
+from enum import Enum
+from srht.database import Base
+
+class DeliveryStatus(Enum):
+    pending = "pending"
+    running = "running"
+    complete = "complete"
+    failed = "failed"
+    superseded = "superseded"
+
+class Delivery(Base):
+    """A webhook delivery waiting to be (or already) handled by a worker."""
+    __tablename__ = 'webhook_delivery'
+    __table_args__ = (
+        # Claiming the next delivery which is due
+        sa.Index("ix_webhook_delivery_status_run_after",
+            "status", "run_after"),
+    )
+    id = sa.Column(sa.Integer, primary_key=True)
+    created = sa.Column(sa.DateTime, nullable=False)
+    updated = sa.Column(sa.DateTime, nullable=False)
+    endpoint = sa.Column(sa.Unicode(256), nullable=False)
+    path = sa.Column(sa.Unicode(1024), nullable=False)
+    view_args = sa.Column(sa.Unicode, nullable=False)
+    headers = sa.Column(sa.Unicode, nullable=False)
+    body = sa.Column(sa.Unicode, nullable=False)
+    status = sa.Column(
+            sau.ChoiceType(DeliveryStatus, impl=sa.String()),
+            nullable=False,
+            default=DeliveryStatus.pending)
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    run_after = sa.Column(sa.DateTime, nullable=False)
+    claimed = sa.Column(sa.DateTime)
+    coalesce_key = sa.Column(sa.Unicode(1024), index=True)
+    response_code = sa.Column(sa.Integer)
+    response = sa.Column(sa.Unicode)
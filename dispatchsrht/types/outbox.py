@@ -0,0 +1,19 @@
+import sqlalchemy as sa
+from srht.database import Base
+
+class OutboxBuild(Base):
+    """A build which could not be submitted while builds.sr.ht was down."""
+    __tablename__ = 'build_outbox'
+    id = sa.Column(sa.Integer, primary_key=True)
+    created = sa.Column(sa.DateTime, nullable=False)
+    updated = sa.Column(sa.DateTime, nullable=False)
+    user_id = sa.Column(sa.Integer,
+            sa.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    user = sa.orm.relationship("User")
+    manifest = sa.Column(sa.Unicode, nullable=False)
+    tags = sa.Column(sa.Unicode, nullable=False)
+    note = sa.Column(sa.Unicode)
+    secrets = sa.Column(sa.Boolean, nullable=False)
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    # The completion callback of the build, if one was registered
+    callback_id = sa.Column(sa.Unicode(32), index=True)
@@ -11,7 +11,22 @@ class Task(Base):
     user = sa.orm.relationship("User", backref=sa.orm.backref("tasks"))
     _taskdef = sa.Column("taskdef", sa.Unicode(1024), nullable=False)
 
+    __table_args__ = (
+        # Dashboard search, which matches anywhere in the name
+        sa.Index("ix_task_name_trgm", name, postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"}),
+        # Dashboard pages, newest first
+        sa.Index("ix_task_user_id_updated",
+            user_id, updated.desc(), id.desc()),
+    )
+
     @property
     def taskdef(self):
         from dispatchsrht.tasks.taskdef import taskdef_by_name
         return taskdef_by_name(self._taskdef)
+
+# ix_task_name_trgm needs pg_trgm, which dispatchsrht-initdb would otherwise
+# only get from the migrations it stamps rather than runs
+sa.event.listen(Task.__table__, "before_create",
+        sa.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+            dialect="postgresql"))
@@ -66,5 +66,7 @@ setup(
   scripts = [
       'dispatchsrht-initdb',
       'dispatchsrht-migrate',
+      'dispatchsrht-periodic',
+      'dispatchsrht-worker',
   ],
 )
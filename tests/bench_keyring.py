@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Times the notify URL key ring: deriving it, which happens once per process
+on first use, and encrypting and decrypting with it afterwards.
+
+    python tests/bench_keyring.py [rounds]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "shim"))
+
+start = time.perf_counter()
+from dispatchsrht import keyring
+import_time = time.perf_counter() - start
+
+def main(rounds):
+    start = time.perf_counter()
+    keyring.key_ring()
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(rounds):
+        keyring.decrypt(keyring.encrypt(b'{"task_id": 1}'))
+    after = (time.perf_counter() - start) / rounds
+    print(f"import:                     {import_time * 1000:.1f} ms")
+    print(f"keys derived on first use:  {first * 1000:.1f} ms")
+    print(f"encrypt and decrypt after:  {after * 1e6:.1f} us")
+    print(f"keys derived: {keyring.derive_key.cache_info().misses}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,166 @@
+import fnmatch
+import os
+import pytest
+import sys
+import threading
+import time
+
+# core.sr.ht and builds.sr.ht are not on PyPI. Where they are not installed,
+# the tests use the stand-ins in tests/shim, which come after site-packages.
+sys.path.append(os.path.join(os.path.dirname(__file__), "shim"))
+
+class FakeRedis:
+    """
+    An in-memory stand-in for the redis commands used by dispatch.sr.ht, so
+    that the tests don't need a redis server.
+    """
+    def __init__(self):
+        self.data = dict()
+        self.expires = dict()
+        self._lock = threading.RLock()
+
+    def _live(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    @staticmethod
+    def _bytes(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    def get(self, key):
+        with self._lock:
+            return self.data.get(key) if self._live(key) else None
+
+    def set(self, key, value, nx=False, ex=None):
+        with self._lock:
+            if nx and self._live(key):
+                return None
+            self.data[key] = self._bytes(value)
+            self.expires.pop(key, None)
+            if ex is not None:
+                self.expires[key] = time.monotonic() + ex
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            count = 0
+            for key in keys:
+                if self._live(key):
+                    count += 1
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return count
+
+    def keys(self, pattern="*"):
+        with self._lock:
+            return [key.encode() for key in list(self.data)
+                    if self._live(key) and fnmatch.fnmatch(key, pattern)]
+
+    def ttl(self, key):
+        with self._lock:
+            if not self._live(key):
+                return -2
+            if key not in self.expires:
+                return -1
+            return int(self.expires[key] - time.monotonic())
+
+    def hset(self, name, key, value):
+        with self._lock:
+            fields = self.data.setdefault(name, dict())
+            new = key not in fields
+            fields[key] = self._bytes(value)
+            return int(new)
+
+    def hsetnx(self, name, key, value):
+        with self._lock:
+            fields = self.data.setdefault(name, dict())
+            if key in fields:
+                return 0
+            fields[key] = self._bytes(value)
+            return 1
+
+    def hget(self, name, key):
+        with self._lock:
+            return self.data.get(name, dict()).get(key)
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            fields = self.data.get(name, dict())
+            return sum(1 for key in keys if fields.pop(key, None) is not None)
+
+    def hgetall(self, name):
+        with self._lock:
+            return {key.encode(): value
+                    for key, value in self.data.get(name, dict()).items()}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, redis):
+        self._redis = redis
+        self._calls = list()
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        return call
+
+    def execute(self):
+        with self._redis._lock:
+            return [getattr(self._redis, name)(*args, **kwargs)
+                    for name, args, kwargs in self._calls]
+
+class FakeSession:
+    """Records what a view does with the database session."""
+    def __init__(self):
+        self.added = list()
+        self.deleted = list()
+        self.commits = 0
+        self.rollbacks = 0
+
+    def add(self, obj):
+        self.added.append(obj)
+
+    def add_all(self, objs):
+        self.added.extend(objs)
+
+    def delete(self, obj):
+        self.deleted.append(obj)
+
+    def flush(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def remove(self):
+        pass
+
+class FakeDB:
+    def __init__(self):
+        self.session = FakeSession()
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
+
+@pytest.fixture
+def fake_db():
+    return FakeDB()
+
+@pytest.fixture
+def app():
+    flask = pytest.importorskip("flask")
+    app = flask.Flask(__name__)
+    app.config["SERVER_NAME"] = "dispatch.example.org"
+    return app
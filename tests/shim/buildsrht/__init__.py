@@ -0,0 +1,4 @@
+"""
+A stand-in for the build manifest classes of builds.sr.ht, so that the tests
+can run where builds.sr.ht is not installed.
+"""
@@ -0,0 +1,63 @@
+class Trigger:
+    def __init__(self, yaml):
+        if not isinstance(yaml, dict):
+            raise Exception("Expected trigger to be a dict")
+        self.action = yaml["action"]
+        self.condition = yaml["condition"]
+        self.attrs = {k: v for k, v in yaml.items()
+                if k not in ["action", "condition"]}
+
+    def to_dict(self):
+        return {"action": self.action, "condition": self.condition,
+                **self.attrs}
+
+class Task:
+    def __init__(self, yaml):
+        if not isinstance(yaml, dict) or len(yaml) != 1:
+            raise Exception("Expected task to be a string: string")
+        [(self.name, self.script)] = yaml.items()
+        if not isinstance(self.script, str):
+            raise Exception("Expected task script to be a string")
+
+    def to_dict(self):
+        return {self.name: self.script}
+
+class Manifest:
+    def __init__(self, yaml):
+        if not isinstance(yaml, dict):
+            raise Exception("Expected manifest to be a dict")
+        self.yaml = yaml
+        self.image = yaml.get("image")
+        if not isinstance(self.image, str):
+            raise Exception("Expected image to be a string")
+        self.arch = yaml.get("arch")
+        self.packages = yaml.get("packages")
+        self.repos = yaml.get("repositories")
+        self.sources = yaml.get("sources")
+        self.environment = yaml.get("environment")
+        self.secrets = yaml.get("secrets")
+        self.shell = yaml.get("shell")
+        self.oauth = yaml.get("oauth")
+        tasks = yaml.get("tasks") or []
+        if not isinstance(tasks, list):
+            raise Exception("Expected tasks to be a list")
+        self.tasks = [Task(t) for t in tasks]
+        triggers = yaml.get("triggers") or []
+        if not isinstance(triggers, list):
+            raise Exception("Expected triggers to be a list")
+        self.triggers = [Trigger(t) for t in triggers]
+
+    def to_dict(self):
+        return {key: value for key, value in {
+            "image": self.image,
+            "arch": self.arch,
+            "packages": self.packages,
+            "repositories": self.repos,
+            "sources": self.sources,
+            "environment": self.environment,
+            "secrets": self.secrets,
+            "shell": self.shell,
+            "oauth": self.oauth,
+            "tasks": [t.to_dict() for t in self.tasks],
+            "triggers": [t.to_dict() for t in self.triggers],
+        }.items() if value}
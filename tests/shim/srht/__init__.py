@@ -0,0 +1,5 @@
+"""
+A stand-in for the parts of core.sr.ht which dispatch.sr.ht uses, so that
+the tests can run where core.sr.ht is not installed. The tests only put this
+on the path after site-packages, so the real module is used when present.
+"""
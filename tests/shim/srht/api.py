@@ -0,0 +1,2 @@
+def get_authorization(user):
+    return {"Authorization": f"Internal {user.username}"}
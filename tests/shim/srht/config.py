@@ -0,0 +1,42 @@
+from configparser import ConfigParser
+
+config = ConfigParser()
+config.read_dict({
+    "sr.ht": {
+        "site-name": "sr.ht",
+        "redis-host": "redis://",
+        "service-key": "tests-service-key",
+    },
+    "dispatch.sr.ht": {
+        "origin": "https://dispatch.example.org",
+        "connection-string": "sqlite://",
+        "oauth-client-id": "dispatch",
+        "oauth-client-secret": "secret",
+    },
+    "builds.sr.ht": {
+        "origin": "https://builds.example.org",
+        "oauth-client-id": "builds",
+    },
+})
+
+_throw = object()
+
+def cfg(section, key, default=_throw):
+    if config.has_option(section, key):
+        return config.get(section, key)
+    if default is _throw:
+        raise Exception(f"Config option [{section}] {key} not found")
+    return default
+
+def cfgi(section, key, default=_throw):
+    v = cfg(section, key, default)
+    return int(v) if v is not None else v
+
+def cfgb(section, key, default=_throw):
+    v = cfg(section, key, default)
+    if isinstance(v, str):
+        return v.lower() in ["true", "yes", "on", "1"]
+    return v
+
+def cfgkeys(section):
+    yield from config[section] if config.has_section(section) else []
@@ -0,0 +1,21 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+
+Base = declarative_base()
+
+class DbSession():
+    def __init__(self, connstr):
+        self.engine = create_engine(connstr)
+        self.session = scoped_session(sessionmaker(
+            autocommit=False, autoflush=False, bind=self.engine))
+        Base.query = self.session.query_property()
+        global db
+        db = self
+
+    def init(self):
+        pass
+
+    def create(self):
+        Base.metadata.create_all(bind=self.engine)
+
+db = DbSession("sqlite://")
@@ -0,0 +1,14 @@
+from flask import Flask
+
+def csrf_bypass(f):
+    return f
+
+def icon(name, cls=""):
+    return ""
+
+class SrhtFlask(Flask):
+    def __init__(self, site, name, oauth_service=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.site = site
+        self.oauth_service = oauth_service
+        self.jinja_env.globals["icon"] = icon
@@ -0,0 +1,31 @@
+import sqlalchemy as sa
+from flask import g
+from functools import wraps
+from werkzeug.local import LocalProxy
+
+current_user = LocalProxy(lambda: g.get("current_user"))
+
+def loginrequired(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return f(*args, **kwargs)
+    return wrapper
+
+class ExternalUserMixin:
+    __tablename__ = "user"
+    id = sa.Column(sa.Integer, primary_key=True)
+    created = sa.Column(sa.DateTime, nullable=False)
+    updated = sa.Column(sa.DateTime, nullable=False)
+    username = sa.Column(sa.Unicode(256), index=True, unique=True)
+    email = sa.Column(sa.String(256), nullable=False)
+    oauth_token = sa.Column(sa.String(256))
+    oauth_token_expires = sa.Column(sa.DateTime)
+    oauth_token_scopes = sa.Column(sa.String)
+
+class AbstractOAuthService:
+    def __init__(self, client_id, client_secret, required_scopes=[],
+            user_class=None, **kwargs):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.required_scopes = required_scopes
+        self.User = user_class
@@ -0,0 +1,32 @@
+class Validation:
+    def __init__(self, request):
+        if request.is_json:
+            self.source = request.get_json(silent=True) or dict()
+        else:
+            self.source = request.form
+        self.errors = list()
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def error(self, message, field=None):
+        self.errors.append((field, message))
+
+    def expect(self, condition, message, field=None):
+        if not condition:
+            self.error(message, field)
+        return condition
+
+    def require(self, name, cls=None, friendly_name=None):
+        value = self.source.get(name)
+        if value is None or value == "":
+            self.error(f"{friendly_name or name} is required", field=name)
+            return None
+        return cls(value) if cls else value
+
+    def optional(self, name, default=None, cls=None):
+        value = self.source.get(name)
+        if value is None:
+            return default
+        return cls(value) if cls else value
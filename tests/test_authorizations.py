@@ -0,0 +1,63 @@
+import pytest
+from types import SimpleNamespace
+
+pytest.importorskip("github")
+pytest.importorskip("gitlab")
+
+from dispatchsrht.tasks.github import common as github
+from dispatchsrht.tasks.gitlab import common as gitlab
+from sqlalchemy.dialects import postgresql
+
+class FakeQuery:
+    def __init__(self, row):
+        self.row = row
+
+    def filter(self, *args):
+        return self
+
+    def one_or_none(self):
+        return self.row
+
+@pytest.fixture
+def saved(monkeypatch, fake_db):
+    """Records the statements, evictions and invalidations of a save."""
+    saved = SimpleNamespace(statements=list(), evicted=list(),
+            invalidated=0)
+    def execute(statement):
+        saved.statements.append(str(statement.compile(
+            dialect=postgresql.dialect())))
+    def invalidate():
+        saved.invalidated += 1
+    fake_db.session.execute = execute
+    for module in [github, gitlab]:
+        monkeypatch.setattr(module, "db", fake_db)
+        monkeypatch.setattr(module, "client_pool",
+                SimpleNamespace(evict=saved.evicted.append))
+        monkeypatch.setattr(module, "routing_cache",
+                SimpleNamespace(invalidate=invalidate))
+    saved.session = fake_db.session
+    return saved
+
+def test_github_authorization_is_upserted(saved, monkeypatch):
+    monkeypatch.setattr(github.GitHubAuthorization, "query",
+            FakeQuery(SimpleNamespace(oauth_token="old")))
+    github.save_authorization(1, "repo", "new")
+    [statement] = saved.statements
+    assert "ON CONFLICT (user_id) DO UPDATE" in statement
+    assert saved.evicted == ["old"]
+    assert saved.invalidated == 1
+    assert saved.session.commits == 1
+
+def test_same_token_is_not_evicted(saved, monkeypatch):
+    monkeypatch.setattr(github.GitHubAuthorization, "query",
+            FakeQuery(SimpleNamespace(oauth_token="same")))
+    github.save_authorization(1, "repo", "same")
+    assert saved.evicted == []
+
+def test_gitlab_authorization_is_upserted_per_upstream(saved, monkeypatch):
+    monkeypatch.setattr(gitlab.GitLabAuthorization, "query", FakeQuery(None))
+    gitlab.save_authorization(1, "gitlab.example.org", "new")
+    [statement] = saved.statements
+    assert "ON CONFLICT (user_id, upstream) DO UPDATE" in statement
+    assert saved.evicted == []
+    assert saved.invalidated == 1
@@ -0,0 +1,273 @@
+import pytest
+import threading
+import time
+from types import SimpleNamespace
+
+from dispatchsrht import builds
+
+class Response:
+    def __init__(self, status_code=200, job_id=None, text=""):
+        self.status_code = status_code
+        self.text = text
+        self._job_id = job_id
+
+    def json(self):
+        return {"id": self._job_id}
+
+class Outcomes(dict):
+    pass
+
+user = SimpleNamespace(id=1, username="alice")
+
+@pytest.fixture
+def jobs(monkeypatch, fake_db):
+    """
+    Answers job submissions with the outcome registered for their manifest,
+    which is a plain string standing in for a parsed manifest.
+    """
+    outcomes = Outcomes()
+    submitted = list()
+    def request(method, path, **kwargs):
+        manifest = kwargs["json"]["manifest"]
+        submitted.append(kwargs["json"])
+        delay, outcome = outcomes[manifest]
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    monkeypatch.setattr(builds, "_request", request)
+    monkeypatch.setattr(builds, "dump_manifest", lambda manifest: manifest)
+    monkeypatch.setattr(builds, "get_authorization", lambda user: {})
+    monkeypatch.setattr(builds, "db", fake_db)
+    monkeypatch.setattr(builds, "_builds_sr_ht", "https://builds.example.org")
+    outcomes.submitted = submitted
+    return outcomes
+
+def test_results_keep_manifest_order(jobs):
+    jobs["a"] = (0.2, Response(job_id=1))
+    jobs["b"] = (0, Response(job_id=2))
+    jobs["c"] = (0.1, Response(job_id=3))
+    calls = list()
+    def submitted(name, job_id):
+        assert threading.current_thread() is threading.main_thread()
+        calls.append((name, job_id))
+    urls, errors = builds.submit_build(["repo"],
+            [("A.yml", "a"), ("B.yml", "b"), ("C.yml", "c")], user,
+            submitted=submitted)
+    assert urls == [
+        ("a.yml", "https://builds.example.org/~alice/job/1"),
+        ("b.yml", "https://builds.example.org/~alice/job/2"),
+        ("c.yml", "https://builds.example.org/~alice/job/3"),
+    ]
+    assert errors == []
+    assert calls == [("A.yml", 1), ("B.yml", 2), ("C.yml", 3)]
+
+def test_submissions_are_concurrent(jobs, monkeypatch):
+    monkeypatch.setattr(builds, "_submit_concurrency", 4)
+    for name in "abcd":
+        jobs[name] = (0.2, Response(job_id=1))
+    start = time.monotonic()
+    builds.submit_build(["repo"], [(n, n) for n in "abcd"], user)
+    assert time.monotonic() - start < 0.6
+
+def test_tags_and_note(jobs):
+    jobs["a"] = (0, Response(job_id=1))
+    builds.submit_build(["My Repo", "commit"], [(".build.yml", "a")], user,
+            note="Hello", secrets=True)
+    assert jobs.submitted == [{
+        "manifest": "a",
+        "tags": ["myrepo", "commit", ".build.yml"],
+        "note": "Hello",
+        "secrets": True,
+    }]
+
+def test_errors_are_returned_with_the_submitted_jobs(jobs):
+    jobs["a"] = (0, Response(job_id=1))
+    jobs["b"] = (0, Response(400, text="Invalid manifest"))
+    jobs["c"] = (0, Response(job_id=3))
+    calls = list()
+    urls, errors = builds.submit_build(["repo"],
+            [("a", "a"), ("b", "b"), ("c", "c")], user,
+            submitted=lambda name, job_id: calls.append(name))
+    assert urls == [
+        ("a", "https://builds.example.org/~alice/job/1"),
+        ("c", "https://builds.example.org/~alice/job/3"),
+    ]
+    assert errors == ["b: Invalid manifest"]
+    assert calls == ["a", "c"]
+
+def test_submit_build_leaves_the_commit_to_the_caller(jobs, fake_db):
+    jobs["a"] = (0, builds.BuildsUnavailable())
+    builds.submit_build(["repo"], [("a", "a")], user)
+    assert fake_db.session.commits == 0
+
+def test_describe_builds():
+    assert builds.describe_builds([("a", "url")], []) == "Submitted:\n\na: url"
+    assert builds.describe_builds([("a", "url")], ["b: Bad"]) == (
+            "Submitted:\n\na: url\n\nNot submitted:\n\nb: Bad")
+    assert builds.describe_builds([], ["b: Bad"]) == "Not submitted:\n\nb: Bad"
+
+def test_unavailable_builds_are_held(jobs, fake_db):
+    jobs["a"] = (0, Response(job_id=1))
+    jobs["b"] = (0, builds.BuildsUnavailable())
+    held = list()
+    urls, _ = builds.submit_build(["repo"], [("a", "a"), ("b", "b")], user,
+            held=held.append, callbacks={"a": "cb-a", "b": "cb-b"})
+    assert urls[1] == ("b", "queued until builds.sr.ht is available")
+    assert held == ["b"]
+    [build] = [obj for obj in fake_db.session.added
+            if isinstance(obj, builds.OutboxBuild)]
+    assert build.manifest == "b"
+    assert build.callback_id == "cb-b"
+
+class FakeSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, timeout=None, **kwargs):
+        assert timeout
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+@pytest.fixture
+def client(monkeypatch):
+    """Installs a builds.sr.ht session which answers with the outcomes."""
+    requests = pytest.importorskip("requests")
+    monkeypatch.setattr(builds, "_builds_sr_ht", "https://builds.example.org")
+    monkeypatch.setattr(builds, "_retries", 2)
+    monkeypatch.setattr(builds, "time", SimpleNamespace(sleep=lambda s: None))
+    monkeypatch.setattr(builds, "_breaker",
+            builds.CircuitBreaker(threshold=100, reset_after=30))
+    def install(*outcomes):
+        session = FakeSession(*outcomes)
+        monkeypatch.setattr(builds, "_session", session)
+        return session
+    install.requests = requests
+    return install
+
+def test_request_retries_unavailable(client):
+    session = client(Response(503), Response(job_id=1))
+    assert builds._request("POST", "/api/jobs").status_code == 200
+    assert session.calls == 2
+
+def test_request_does_not_retry_gateway_errors_unless_idempotent(client):
+    session = client(Response(502), Response(job_id=1))
+    assert builds._request("POST", "/api/jobs").status_code == 502
+    assert session.calls == 1
+    session = client(Response(502), Response(job_id=1))
+    assert builds._request("POST", "/api/jobs/1/cancel",
+            idempotent=True).status_code == 200
+
+def test_request_gives_up(client):
+    session = client(*[Response(503)] * 3)
+    assert builds._request("POST", "/api/jobs").status_code == 503
+    assert session.calls == 3
+
+def test_request_never_resends_a_received_request(client):
+    session = client(client.requests.ReadTimeout(), Response(job_id=1))
+    with pytest.raises(client.requests.ReadTimeout):
+        builds._request("POST", "/api/jobs")
+    assert session.calls == 1
+
+def test_request_unreachable(client):
+    session = client(*[client.requests.ConnectTimeout()] * 3)
+    with pytest.raises(builds.BuildsUnavailable):
+        builds._request("POST", "/api/jobs")
+    assert session.calls == 3
+
+def test_open_circuit_fails_fast(client, monkeypatch):
+    breaker = builds.CircuitBreaker(threshold=1, reset_after=30)
+    breaker.failure()
+    monkeypatch.setattr(builds, "_breaker", breaker)
+    session = client()
+    with pytest.raises(builds.BuildsUnavailable):
+        builds._request("POST", "/api/jobs")
+    assert session.calls == 0
+
+class OutboxQuery:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def order_by(self, *args):
+        return self
+
+    def with_for_update(self, **kwargs):
+        return self
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+def held_build(id, callback_id):
+    return SimpleNamespace(id=id, user_id=1, user=user, manifest="m",
+            tags='["repo"]', note=None, secrets=False, attempts=0,
+            callback_id=callback_id)
+
+@pytest.fixture
+def outbox(monkeypatch, fake_db):
+    """Flushes the held builds against a list of responses."""
+    rows, results = list(), list()
+    fake_db.session.delete = rows.remove
+    monkeypatch.setattr(builds, "db", fake_db)
+    monkeypatch.setattr(builds.OutboxBuild, "query", OutboxQuery(rows))
+    monkeypatch.setattr(builds, "get_authorization", lambda user: {})
+    monkeypatch.setattr(builds, "_outbox_handlers", [
+        lambda *args: results.append(args)])
+    def flush(*outcomes):
+        outcomes = list(outcomes)
+        def request(method, path, **kwargs):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        monkeypatch.setattr(builds, "_request", request)
+        builds.flush_outbox()
+    flush.rows = rows
+    flush.results = results
+    return flush
+
+def test_flush_outbox_reports_results(outbox):
+    outbox.rows.extend([held_build(1, "a"), held_build(2, "b")])
+    outbox(Response(job_id=10), Response(400, text="Invalid manifest"))
+    assert outbox.rows == []
+    assert outbox.results == [("a", 10, None), ("b", None, "Invalid manifest")]
+
+def test_flush_outbox_stops_on_failure(outbox, fake_db):
+    outbox.rows.extend([held_build(1, "a"), held_build(2, "b")])
+    outbox(Response(500))
+    assert len(outbox.rows) == 2
+    assert outbox.rows[0].attempts == 1
+    outbox(builds.BuildsUnavailable())
+    assert len(outbox.rows) == 2
+    assert fake_db.session.rollbacks == 1
+    assert outbox.results == []
+
+def test_flush_outbox_survives_handler_errors(outbox, monkeypatch):
+    def handler(*args):
+        raise RuntimeError("boom")
+    builds._outbox_handlers.insert(0, handler)
+    outbox.rows.extend([held_build(1, "a"), held_build(2, "b")])
+    outbox(Response(job_id=10), Response(job_id=11))
+    assert outbox.rows == []
+    assert outbox.results == [("a", 10, None), ("b", 11, None)]
+
+def test_register_callback(app, monkeypatch, fake_db):
+    monkeypatch.setattr(builds, "db", fake_db)
+    monkeypatch.setattr(builds, "_root", "https://dispatch.example.org")
+    app.add_url_rule("/github/complete/<callback_id>",
+            "github_complete_callback", lambda callback_id: "")
+    with app.test_request_context("/"):
+        callback_id, url = builds.register_callback(
+                "github_complete_callback", task_id=1, user_id=2,
+                repo="alice/repo", sha="abc", context="ci")
+        other_id, _ = builds.register_callback(
+                "github_complete_callback", task_id=1, user_id=2,
+                repo="alice/repo", sha="abc", context="ci")
+    assert url == f"https://dispatch.example.org/github/complete/{callback_id}"
+    assert other_id != callback_id
+    [callback, _] = fake_db.session.added
+    assert callback.id == callback_id
+    assert callback.repo == "alice/repo"
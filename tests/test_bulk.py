@@ -0,0 +1,141 @@
+import pytest
+from types import SimpleNamespace
+
+import sqlalchemy as sa
+from dispatchsrht import bulk
+from werkzeug.exceptions import UnsupportedMediaType
+
+class FakeQuery:
+    """Records the bulk statements run against a model."""
+    def __init__(self, statements, table):
+        self.statements = statements
+        self.table = table
+
+    def filter(self, *args):
+        self.where = " AND ".join(str(arg) for arg in args)
+        return self
+
+    def delete(self, synchronize_session=None):
+        self.statements.append(("delete", self.table, self.where))
+
+    def update(self, values, synchronize_session=None):
+        self.statements.append(("update", self.table, self.where, values))
+
+def model(name, statements):
+    return type(name, (), {
+        "id": sa.column("id"),
+        "task_id": sa.column("task_id"),
+        "query": FakeQuery(statements, name),
+    })
+
+@pytest.fixture
+def configure(monkeypatch, fake_db):
+    """Runs configure_many against fake tasks, records and hooks."""
+    state = SimpleNamespace(statements=list(), created=list(),
+            deleted=list(), invalidated=0, session=fake_db.session)
+    Task = model("Task", state.statements)
+    Record = model("Record", state.statements)
+    def flush():
+        for n, obj in enumerate(fake_db.session.added):
+            obj.id = n + 1
+    def invalidate():
+        state.invalidated += 1
+    fake_db.session.flush = flush
+    monkeypatch.setattr(bulk, "db", fake_db)
+    monkeypatch.setattr(bulk, "Task", Task)
+    monkeypatch.setattr(bulk, "current_user", SimpleNamespace(id=1))
+    monkeypatch.setattr(bulk, "_root", "https://dispatch.example.org")
+    monkeypatch.setattr(bulk, "url_for",
+            lambda endpoint, record_id: f"/{endpoint}/{record_id}")
+    monkeypatch.setattr(bulk, "routing_cache",
+            SimpleNamespace(invalidate=invalidate))
+    def create_hook(repo, url):
+        if repo.startswith("broken"):
+            raise RuntimeError(f"{repo} refused the hook")
+        state.created.append((repo, url))
+        return len(state.created) + 100
+    def delete_hook(repo, hook_id):
+        state.deleted.append((repo, hook_id))
+    def setup(record, repo):
+        record.repo = repo
+    def run(names):
+        return bulk.configure_many("test", Record, [(n, n) for n in names],
+                setup, create_hook, delete_hook, "hook_id")
+    state.run = run
+    return state
+
+def test_nothing_to_configure(configure):
+    assert configure.run([]) == []
+    assert configure.session.commits == 0
+
+def test_hooks_are_saved_in_a_second_commit(configure):
+    results = configure.run(["alpha", "beta"])
+    assert results == [("alpha", 1, None), ("beta", 2, None)]
+    assert configure.session.commits == 2
+    tasks = configure.session.added[:2]
+    records = configure.session.added[2:]
+    assert [t.name for t in tasks] == ["alpha::test", "beta::test"]
+    assert [r.task_id for r in records] == [1, 2]
+    assert [r.hook_id for r in records] == [-1, -1]
+    assert sorted(url for _, url in configure.created) == sorted(
+            f"https://dispatch.example.org/test._webhook/{r.id}"
+            for r in records)
+    updates = [s for s in configure.statements if s[0] == "update"]
+    assert len(updates) == 2
+    assert sorted(s[3]["hook_id"] for s in updates) == [101, 102]
+    assert configure.invalidated == 1
+
+def test_failed_hooks_drop_their_task(configure):
+    results = configure.run(["alpha", "broken"])
+    assert results == [
+        ("alpha", 1, None),
+        ("broken", None, "broken refused the hook"),
+    ]
+    deletes = [s[1] for s in configure.statements if s[0] == "delete"]
+    assert deletes == ["Record", "Task"]
+    assert configure.deleted == []
+
+def test_failed_commit_deletes_the_hooks(configure):
+    commit = configure.session.commit
+    def fail():
+        commit()
+        if configure.session.commits == 2:
+            raise RuntimeError("database went away")
+    configure.session.commit = fail
+    with pytest.raises(RuntimeError):
+        configure.run(["alpha", "broken", "gamma"])
+    assert sorted(repo for repo, _ in configure.deleted) == ["alpha", "gamma"]
+    assert sorted(hook for _, hook in configure.deleted) == [101, 102]
+    assert configure.session.rollbacks == 1
+    assert configure.session.commits == 3
+    cleanup = [s for s in configure.statements if "IN" in s[2]]
+    assert [s[1] for s in cleanup] == ["Record", "Task"]
+
+def test_json_only(app):
+    view = bulk.json_only(lambda: "ok")
+    with app.test_request_context("/", method="POST", data={"repo": "a"}):
+        with pytest.raises(UnsupportedMediaType):
+            view()
+    with app.test_request_context("/", method="POST", json={"repos": []}):
+        assert view() == "ok"
+
+def test_requested_repos(app):
+    with app.test_request_context("/", method="POST",
+            json={"repos": ["alice/a", 2]}):
+        assert bulk.requested_repos() == ["alice/a", "2"]
+    with app.test_request_context("/", method="POST", json={}):
+        assert bulk.requested_repos() == []
+    with app.test_request_context("/", method="POST",
+            data={"repo": ["alice/a", "alice/b"]}):
+        assert bulk.requested_repos() == ["alice/a", "alice/b"]
+
+def test_bulk_response(app):
+    with app.test_request_context("/", method="POST", json={"repos": []}):
+        response = bulk.bulk_response([
+            ("alice/a", 1, None),
+            ("alice/b", None, "Not Found"),
+        ])
+    assert response.get_json() == {"results": [
+        {"repo": "alice/a", "task_id": 1, "error": None},
+        {"repo": "alice/b", "task_id": None, "error": "Not Found"},
+    ]}
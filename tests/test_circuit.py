@@ -0,0 +1,66 @@
+from dispatchsrht import circuit
+from dispatchsrht.circuit import CircuitBreaker
+from types import SimpleNamespace
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+def breaker(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(circuit, "time", SimpleNamespace(
+        monotonic=clock.monotonic))
+    return CircuitBreaker(**kwargs), clock
+
+def test_opens_after_threshold(monkeypatch):
+    cb, _ = breaker(monkeypatch, threshold=3, reset_after=30)
+    for _ in range(2):
+        cb.failure()
+        assert cb.allow()
+    cb.failure()
+    assert cb.is_open
+    assert not cb.allow()
+
+def test_success_resets_failures(monkeypatch):
+    cb, _ = breaker(monkeypatch, threshold=2, reset_after=30)
+    cb.failure()
+    cb.success()
+    cb.failure()
+    assert not cb.is_open
+
+def test_single_trial_after_reset(monkeypatch):
+    cb, clock = breaker(monkeypatch, threshold=1, reset_after=30)
+    cb.failure()
+    clock.now += 29
+    assert not cb.allow()
+    clock.now += 1
+    assert cb.allow()
+    # Only one trial call at a time
+    assert not cb.allow()
+
+def test_failed_trial_reopens(monkeypatch):
+    cb, clock = breaker(monkeypatch, threshold=5, reset_after=30)
+    for _ in range(5):
+        cb.failure()
+    clock.now += 30
+    assert cb.allow()
+    cb.failure()
+    assert not cb.allow()
+    clock.now += 30
+    assert cb.allow()
+
+def test_on_close(monkeypatch):
+    closed = list()
+    cb, clock = breaker(monkeypatch, threshold=1, reset_after=30,
+            on_close=lambda: closed.append(True))
+    cb.success()
+    assert closed == []
+    cb.failure()
+    clock.now += 30
+    assert cb.allow()
+    cb.success()
+    assert closed == [True]
+    assert not cb.is_open
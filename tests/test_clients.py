@@ -0,0 +1,57 @@
+import threading
+from types import SimpleNamespace
+
+from dispatchsrht import clients
+from dispatchsrht.clients import ClientPool
+
+class Factory:
+    def __init__(self):
+        self.created = 0
+
+    def __call__(self):
+        self.created += 1
+        return object()
+
+def test_clients_are_reused():
+    pool, factory = ClientPool(), Factory()
+    first = pool.get("github.com", "a", factory)
+    assert pool.get("github.com", "a", factory) is first
+    assert pool.get("github.com", "b", factory) is not first
+    assert pool.get("gitlab.com", "a", factory) is not first
+    assert factory.created == 3
+
+def test_clients_are_per_thread():
+    pool, factory = ClientPool(), Factory()
+    mine = pool.get("github.com", "a", factory)
+    theirs = list()
+    thread = threading.Thread(target=lambda:
+            theirs.append(pool.get("github.com", "a", factory)))
+    thread.start()
+    thread.join()
+    assert theirs[0] is not mine
+
+def test_pool_is_bounded():
+    pool, factory = ClientPool(size=2), Factory()
+    first = pool.get("github.com", "a", factory)
+    pool.get("github.com", "b", factory)
+    pool.get("github.com", "c", factory)
+    assert pool.get("github.com", "a", factory) is not first
+
+def test_idle_clients_expire(monkeypatch):
+    clock = SimpleNamespace(now=0)
+    monkeypatch.setattr(clients, "time",
+            SimpleNamespace(monotonic=lambda: clock.now))
+    pool, factory = ClientPool(idle=60), Factory()
+    first = pool.get("github.com", "a", factory)
+    clock.now = 59
+    assert pool.get("github.com", "a", factory) is first
+    clock.now = 120
+    assert pool.get("github.com", "a", factory) is not first
+
+def test_evict():
+    pool, factory = ClientPool(), Factory()
+    revoked = pool.get("github.com", "a", factory)
+    kept = pool.get("github.com", "b", factory)
+    pool.evict("a")
+    assert pool.get("github.com", "a", factory) is not revoked
+    assert pool.get("github.com", "b", factory) is kept
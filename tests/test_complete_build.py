@@ -0,0 +1,170 @@
+import json
+import pytest
+from types import SimpleNamespace
+
+pytest.importorskip("github")
+pytest.importorskip("gitlab")
+
+from dispatchsrht.tasks.github import common as github
+from dispatchsrht.tasks.gitlab import common as gitlab
+
+class FakeQuery:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *args):
+        return self
+
+    def populate_existing(self):
+        return self
+
+    def with_for_update(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+    def one_or_none(self):
+        return self.rows[0] if self.rows else None
+
+    def delete(self, **kwargs):
+        return 0
+
+@pytest.fixture
+def reports(monkeypatch, fake_db):
+    reports = list()
+    reporter = SimpleNamespace(report=lambda url, token, status, **kwargs:
+            reports.append((url, token, status)))
+    for module in [github, gitlab]:
+        monkeypatch.setattr(module, "db", fake_db)
+        monkeypatch.setattr(module, "status_reporter", reporter)
+    def no_client(*args, **kwargs):
+        raise AssertionError("The forge should not be queried")
+    monkeypatch.setattr(github, "github_client", no_client)
+    monkeypatch.setattr(gitlab, "gitlab_client", no_client, raising=False)
+    return reports
+
+def complete(app, module, payload, result):
+    with app.test_request_context("/", method="POST",
+            data=json.dumps(result)):
+        return module.complete_build(payload)
+
+def test_gitlab_completion(app, reports):
+    complete(app, gitlab, {
+        "context": "builds.example.org: .build.yml",
+        "oauth_token": "t",
+        "project_id": 42,
+        "sha": "abc",
+        "upstream": "gitlab.example.org",
+        "username": "alice",
+    }, {"id": 10, "status": "failed"})
+    [(url, token, status)] = reports
+    assert url == gitlab.status_url("gitlab.example.org", 42, "abc")
+    assert token == "Bearer t"
+    assert status["state"] == "failed"
+    assert status["context"] == "builds.example.org: .build.yml"
+    assert status["target_url"].endswith("/~alice/job/10")
+
+def test_github_completion(app, reports, monkeypatch):
+    monkeypatch.setattr(github.GitHubJob, "query", FakeQuery([]))
+    complete(app, github, {
+        "full_name": "alice/repo",
+        "oauth_token": "t",
+        "username": "alice",
+        "sha": "abc",
+        "context": "builds.example.org: .build.yml",
+        "status_mode": "jobs",
+    }, {"id": 10, "status": "success"})
+    [(url, token, status)] = reports
+    assert url == github.status_url("alice/repo", "abc")
+    assert token == "token t"
+    assert status["state"] == "success"
+    assert status["target_url"].endswith("/~alice/job/10")
+
+def test_unknown_callbacks(app, monkeypatch):
+    monkeypatch.setattr(github, "_callback", lambda callback_id: None)
+    monkeypatch.setattr(gitlab, "_callback", lambda callback_id: None)
+    with app.test_request_context("/", method="POST", data="{}"):
+        assert github.github_complete_callback("nope")[1] == 404
+        assert gitlab.gitlab_complete_callback("nope")[1] == 404
+
+class FakePull:
+    merged = False
+
+    def __init__(self):
+        self.merges = 0
+
+    def get_review_requests(self):
+        return [], []
+
+    def merge(self):
+        self.merges += 1
+
+@pytest.fixture
+def pull(monkeypatch):
+    pull = FakePull()
+    repo = SimpleNamespace(get_pull=lambda number: pull)
+    monkeypatch.setattr(github, "github_client", lambda token:
+            SimpleNamespace(get_repo=lambda name, lazy=False: repo))
+    return pull
+
+def automerge(app, **kwargs):
+    payload = {
+        "full_name": "alice/repo",
+        "oauth_token": "t",
+        "username": "alice",
+        "sha": "abc",
+        "context": "builds.example.org: .build.yml",
+        "status_mode": "summary",
+        "pr": 5,
+        "automerge": True,
+        "callback_id": "cb",
+    }
+    payload.update(kwargs)
+    complete(app, github, payload, {"id": 10, "status": "success"})
+
+def tracked(monkeypatch, summary):
+    job = SimpleNamespace(status="running", task_id=1, sha="abc", job_id=None)
+    monkeypatch.setattr(github.GitHubJob, "query", FakeQuery([job]))
+    monkeypatch.setattr(github, "summarize_jobs",
+            lambda task_id, sha: summary)
+    return job
+
+def test_automerge_when_every_job_succeeded(app, reports, pull, monkeypatch):
+    job = tracked(monkeypatch, ("success", "2 jobs completed successfully"))
+    automerge(app)
+    assert job.status == "success"
+    assert job.job_id == 10
+    assert pull.merges == 1
+
+def test_no_automerge_while_jobs_are_pending(app, reports, pull, monkeypatch):
+    tracked(monkeypatch, ("pending", "1 of 2 builds.sr.ht jobs complete"))
+    automerge(app)
+    assert pull.merges == 0
+    [(_, _, status)] = reports
+    assert status["state"] == "pending"
+
+def test_statuses_are_queued_before_the_commit(app, reports, pull,
+        monkeypatch, fake_db):
+    tracked(monkeypatch, ("success", "2 jobs completed successfully"))
+    queued = list()
+    fake_db.session.commit = lambda: queued.append(len(reports))
+    automerge(app, status_mode="both")
+    assert queued == [2]
+
+def test_no_automerge_without_automerge(app, reports, pull, monkeypatch):
+    tracked(monkeypatch, ("success", "2 jobs completed successfully"))
+    automerge(app, automerge=False)
+    assert pull.merges == 0
+
+def test_no_automerge_for_untracked_jobs(app, reports, pull, monkeypatch):
+    monkeypatch.setattr(github.GitHubJob, "query", FakeQuery([]))
+    automerge(app)
+    assert pull.merges == 0
+
+def test_superseded_jobs_report_nothing(app, reports, pull, monkeypatch):
+    job = tracked(monkeypatch, ("success", "2 jobs completed successfully"))
+    job.status = "superseded"
+    automerge(app)
+    assert reports == []
+    assert pull.merges == 0
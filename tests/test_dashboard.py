@@ -0,0 +1,96 @@
+import pytest
+import sqlalchemy as sa
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from dispatchsrht.blueprints import html
+from dispatchsrht.types import Task
+from werkzeug.exceptions import BadRequest
+
+def task(n):
+    return SimpleNamespace(id=n,
+            updated=datetime(2026, 1, 1) + timedelta(minutes=n))
+
+class FakeQuery:
+    """Returns the given tasks from whichever query the view builds."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.limited = None
+
+    def filter(self, *args):
+        return self
+
+    def order_by(self, *args):
+        return self
+
+    def limit(self, limit):
+        self.limited = limit
+        return self
+
+    def all(self):
+        return list(self.rows[:self.limited])
+
+@pytest.fixture
+def dashboard(app, monkeypatch):
+    monkeypatch.setattr(html, "current_user", SimpleNamespace(id=1))
+    monkeypatch.setattr(html, "_tasks_per_page", 2)
+    monkeypatch.setattr(html, "render_template",
+            lambda template, **context: context)
+    def page(rows, **args):
+        monkeypatch.setattr(Task, "query", FakeQuery(rows))
+        with app.test_request_context("/", query_string=args):
+            return html.index()
+    return page
+
+def test_cursor_round_trip():
+    t = task(5)
+    assert html.parse_cursor(html.task_cursor(t)) == (t.updated, 5)
+
+@pytest.mark.parametrize("cursor", ["", "nope", "2026-01-01_x", "x_1"])
+def test_malformed_cursors(cursor):
+    with pytest.raises(ValueError):
+        html.parse_cursor(cursor)
+
+def test_first_page(dashboard):
+    page = dashboard([task(9), task(8), task(7)])
+    assert [t.id for t in page["tasks"]] == [9, 8]
+    assert page["next_page"] == html.task_cursor(task(8))
+    assert page["prev_page"] is None
+
+def test_only_page(dashboard):
+    page = dashboard([task(9)])
+    assert page["next_page"] is None
+    assert page["prev_page"] is None
+
+def test_last_page(dashboard):
+    page = dashboard([task(2), task(1)], after=html.task_cursor(task(3)))
+    assert [t.id for t in page["tasks"]] == [2, 1]
+    assert page["next_page"] is None
+    assert page["prev_page"] == html.task_cursor(task(2))
+
+def test_previous_page(dashboard):
+    # Fetched oldest first, beyond the "before" cursor
+    page = dashboard([task(3), task(4), task(5)],
+            before=html.task_cursor(task(2)))
+    assert [t.id for t in page["tasks"]] == [4, 3]
+    assert page["next_page"] == html.task_cursor(task(3))
+    assert page["prev_page"] == html.task_cursor(task(4))
+
+def test_previous_page_is_first(dashboard):
+    page = dashboard([task(3), task(4)], before=html.task_cursor(task(2)))
+    assert [t.id for t in page["tasks"]] == [4, 3]
+    assert page["next_page"] == html.task_cursor(task(3))
+    assert page["prev_page"] is None
+
+def test_bad_cursor(dashboard):
+    with pytest.raises(BadRequest):
+        dashboard([], after="garbage")
+
+def test_create_all_installs_pg_trgm():
+    statements = list()
+    engine = sa.create_mock_engine("postgresql://",
+            lambda sql, *args, **kwargs: statements.append(
+                str(sql.compile(dialect=engine.dialect))))
+    Task.__table__.create(engine, checkfirst=False)
+    assert statements[0] == "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+    assert any("gin_trgm_ops" in s for s in statements)
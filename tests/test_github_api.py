@@ -0,0 +1,107 @@
+import json
+import pytest
+
+pytest.importorskip("github")
+
+from dispatchsrht.manifests import ManifestCache
+from dispatchsrht.tasks.github import api
+
+class Response:
+    def __init__(self, status_code=200, data=None, content=b""):
+        self.status_code = status_code
+        self._data = data
+        self.content = content
+        self.text = json.dumps(data) if data is not None else content.decode()
+
+    def json(self):
+        return self._data
+
+class FakeSession:
+    """Answers GraphQL queries with canned data and records the requests."""
+    def __init__(self, *responses, blobs=None):
+        self.responses = list(responses)
+        self.blobs = blobs or dict()
+        self.posts = list()
+        self.gets = list()
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        assert timeout
+        self.posts.append(json)
+        return self.responses.pop(0)
+
+    def get(self, url, headers=None, timeout=None):
+        assert timeout
+        self.gets.append(url)
+        oid = url.rsplit("/", 1)[-1]
+        if oid not in self.blobs:
+            return Response(404)
+        return Response(content=self.blobs[oid])
+
+@pytest.fixture
+def session(monkeypatch):
+    def install(*responses, **kwargs):
+        session = FakeSession(*responses, **kwargs)
+        monkeypatch.setattr(api, "_session", session)
+        return session
+    monkeypatch.setattr(api, "manifest_cache", ManifestCache(16))
+    return install
+
+def test_graphql_errors(session):
+    session(Response(502, content=b"Bad gateway"))
+    with pytest.raises(api.GraphQLError) as ex:
+        api.graphql("token", "query", {})
+    assert ex.value.status == 502
+    session(Response(data={"errors": [{"message": "Not found"}]}))
+    with pytest.raises(api.GraphQLError, match="Not found"):
+        api.graphql("token", "query", {})
+
+def test_fetch_single_manifest(session):
+    commit = {"oid": "abc", "message": "Hi", "url": "u", "author": None}
+    s = session(
+        Response(data={"data": {"repository": {
+            "commit": commit,
+            "single": {"oid": "b1"},
+            "dir": None,
+        }}}),
+        Response(data={"data": {"repository": {
+            "b0": {"text": "image: alpine/edge", "isTruncated": False},
+        }}}))
+    assert api.fetch_manifests("token", "alice/repo", "abc") == (
+            commit, [(".build.yml", "image: alpine/edge")])
+    assert len(s.posts) == 2
+
+def test_fetch_manifest_directory_uses_cache(session):
+    listing = Response(data={"data": {"repository": {
+        "commit": {"oid": "abc"},
+        "single": None,
+        "dir": {"entries": [
+            {"name": "a.yml", "object": {"oid": "b1"}},
+            {"name": "b.yml", "object": {"oid": "b2"}},
+            {"name": "subdir", "object": {}},
+        ]},
+    }}})
+    s = session(listing, Response(data={"data": {"repository": {
+        "b0": {"text": "a", "isTruncated": False},
+        "b1": {"text": "b", "isTruncated": False},
+    }}}))
+    assert api.fetch_manifests("token", "alice/repo", "abc")[1] == [
+            ("a.yml", "a"), ("b.yml", "b")]
+    # The blobs are cached, so only the listing is fetched again
+    s.responses.append(listing)
+    assert api.fetch_manifests("token", "alice/repo", "abc")[1] == [
+            ("a.yml", "a"), ("b.yml", "b")]
+    assert len(s.posts) == 3
+
+def test_fetch_blobs_falls_back_for_large_blobs(session):
+    s = session(Response(data={"data": {"repository": {
+        "b0": {"text": "small", "isTruncated": False},
+        "b1": {"text": "trunc", "isTruncated": True},
+        "b2": {"text": None, "isBinary": True},
+        "b3": None,
+    }}}), blobs={"o1": b"large manifest"})
+    assert api.fetch_blobs("token", "alice", "repo",
+            ["o0", "o1", "o2", "o3"]) == {
+        "o0": "small",
+        "o1": "large manifest",
+    }
+    assert s.gets == [f"{api._api_url}/repos/alice/repo/git/blobs/o1"]
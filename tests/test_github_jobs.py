@@ -0,0 +1,114 @@
+import pytest
+from types import SimpleNamespace
+
+pytest.importorskip("github")
+
+from dispatchsrht.tasks.github import common
+
+class FakeQuery:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *args):
+        return self
+
+    def with_for_update(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+    def one_or_none(self):
+        return self.rows[0] if self.rows else None
+
+def job(**kwargs):
+    fields = {
+        "task_id": 1,
+        "pr": 2,
+        "sha": "old",
+        "status": "running",
+        "job_id": None,
+        "callback_id": None,
+        "name": ".build.yml",
+    }
+    fields.update(kwargs)
+    return SimpleNamespace(**fields)
+
+@pytest.fixture
+def reports(monkeypatch, fake_db):
+    reports = list()
+    monkeypatch.setattr(common, "db", fake_db)
+    monkeypatch.setattr(common, "status_reporter", SimpleNamespace(
+        report=lambda url, token, status: reports.append((url, status))))
+    return reports
+
+def test_cancel_stale_jobs(monkeypatch, reports, fake_db):
+    cancelled = job(job_id=10, callback_id="a", name="a.yml")
+    running = job(job_id=11, callback_id="b", name="b.yml")
+    unqueued = job(status="queued", callback_id="c", name="c.yml")
+    sent = job(status="queued", callback_id="d", name="d.yml")
+    monkeypatch.setattr(common.GitHubJob, "query",
+            FakeQuery([cancelled, running, unqueued, sent]))
+    monkeypatch.setattr(common, "cancel_build",
+            lambda user, job_id: job_id == 10)
+    monkeypatch.setattr(common, "unqueue_build",
+            lambda callback_id: callback_id == "c")
+    revoked = list()
+    monkeypatch.setattr(common, "revoke_callback", revoked.append)
+
+    hook = SimpleNamespace(task_id=1, user=object())
+    auth = SimpleNamespace(oauth_token="token",
+            user=SimpleNamespace(username="alice"))
+    common.cancel_stale_jobs(hook, auth, "alice/repo", 2, "new")
+
+    assert cancelled.status == "superseded"
+    assert unqueued.status == "superseded"
+    # builds.sr.ht did not cancel it, so it still reports its own result
+    assert running.status == "running"
+    # Already submitted from the outbox by the time we got to it
+    assert sent.status == "queued"
+    assert revoked == ["a", "c"]
+    assert fake_db.session.commits == 1
+    assert [(url, status["state"], status["context"])
+            for url, status in reports] == [
+        (common.status_url("alice/repo", "old"), "error", common.context("a.yml")),
+        (common.status_url("alice/repo", "old"), "error", common.context("c.yml")),
+    ]
+
+@pytest.mark.parametrize("statuses,state", [
+    ([], "error"),
+    (["superseded"], "error"),
+    (["success", "success"], "success"),
+    (["success", "running"], "pending"),
+    (["success", "queued"], "pending"),
+    (["failed", "running"], "pending"),
+    (["success", "failed"], "failure"),
+    (["success", "error"], "failure"),
+    (["success", "superseded"], "success"),
+])
+def test_summarize(statuses, state):
+    assert common.summarize(statuses)[0] == state
+
+def test_summarize_descriptions():
+    assert common.summarize(["success", "failed", "running"])[1] == (
+            "2 of 3 builds.sr.ht jobs complete, 1 failed")
+    assert common.summarize([])[1] == "No builds.sr.ht jobs were submitted"
+
+def test_job_tracker(monkeypatch, fake_db):
+    monkeypatch.setattr(common, "db", fake_db)
+    submitted = list()
+    tracker = common.JobTracker(1, 2, "abc",
+            {"a.yml": "cb-a", "b.yml": "cb-b", "c.yml": "cb-c"},
+            lambda name, job_id: submitted.append((name, job_id)))
+    tracker.submitted("a.yml", 10)
+    tracker.held("b.yml")
+    assert tracker.failed() == ["c.yml"]
+    assert submitted == [("a.yml", 10)]
+    assert [(job.name, job.callback_id, job.job_id, job.status)
+            for job in fake_db.session.added] == [
+        ("a.yml", "cb-a", 10, "running"),
+        ("b.yml", "cb-b", None, "queued"),
+        ("c.yml", "cb-c", None, "error"),
+    ]
+    assert all(job.task_id == 1 and job.pr == 2 and job.sha == "abc"
+            for job in fake_db.session.added)
@@ -0,0 +1,71 @@
+import pytest
+import threading
+from types import SimpleNamespace
+
+pytest.importorskip("gitlab")
+
+from dispatchsrht.cache import LRUCache
+from dispatchsrht.manifests import ManifestCache
+from dispatchsrht.tasks.gitlab import common
+from gitlab.exceptions import GitlabError, GitlabHttpError
+
+class FakeProject:
+    def __init__(self, single=None, tree=(), blobs=None):
+        self.single = single
+        self.tree = list(tree)
+        self.blobs = blobs or dict()
+        self.downloaded = list()
+        self._lock = threading.Lock()
+        self.manager = SimpleNamespace(gitlab=SimpleNamespace(
+            url="https://gitlab.example.org",
+            http_request=self.http_request))
+
+    def get_id(self):
+        return 42
+
+    def http_request(self, verb, path, query_data=None):
+        assert verb == "head"
+        if self.single is None:
+            raise GitlabHttpError("404 File Not Found", 404)
+        return SimpleNamespace(headers={"X-Gitlab-Blob-Id": self.single})
+
+    def repository_tree(self, path, ref, all):
+        assert path == ".builds" and all
+        return self.tree
+
+    def repository_raw_blob(self, oid):
+        with self._lock:
+            self.downloaded.append(oid)
+        return self.blobs[oid]
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch):
+    monkeypatch.setattr(common, "GitlabError", GitlabError, raising=False)
+    monkeypatch.setattr(common, "_manifest_trees", LRUCache(16))
+    monkeypatch.setattr(common, "manifest_cache", ManifestCache(16))
+
+def test_single_manifest():
+    project = FakeProject(single="b1", blobs={"b1": b"image: alpine/edge"})
+    assert common.fetch_manifests(project, "abc") == [
+            (".build.yml", "image: alpine/edge")]
+
+def test_manifest_directory():
+    project = FakeProject(tree=[
+        {"type": "blob", "name": "a.yml", "id": "b1"},
+        {"type": "blob", "name": "README", "id": "b2"},
+        {"type": "tree", "name": "sub.yml", "id": "t1"},
+        {"type": "blob", "name": "c.yml", "id": "b3"},
+    ], blobs={"b1": b"a", "b3": b"c"})
+    assert common.fetch_manifests(project, "abc") == [
+            ("a.yml", "a"), ("c.yml", "c")]
+    assert sorted(project.downloaded) == ["b1", "b3"]
+
+def test_no_manifests():
+    assert common.fetch_manifests(FakeProject(), "abc") == []
+
+def test_listing_and_blobs_are_cached():
+    project = FakeProject(single="b1", blobs={"b1": b"a"})
+    common.fetch_manifests(project, "abc")
+    project.single = None # Would be looked up again if it were not cached
+    assert common.fetch_manifests(project, "abc") == [(".build.yml", "a")]
+    assert project.downloaded == ["b1"]
@@ -0,0 +1,77 @@
+import pytest
+import threading
+from types import SimpleNamespace
+
+pytest.importorskip("gitlab")
+
+from dispatchsrht.tasks.gitlab import common
+
+def project(n):
+    return {
+        "id": n,
+        "name_with_namespace": f"Alice / Project {n:03}",
+        "web_url": f"https://gitlab.example.org/alice/project{n}",
+        "description": "Left out of the list",
+    }
+
+class FakeGitLab:
+    """Serves project listing pages, with or without the totals."""
+    def __init__(self, count, per_page=100, totals=True):
+        self.projects = [project(n) for n in range(count)]
+        self.per_page = per_page
+        self.totals = totals
+        self.pages = list()
+        self._lock = threading.Lock()
+
+    def http_request(self, verb, path, query_data):
+        assert (verb, path) == ("get", "/projects")
+        assert query_data["owned"] == "true"
+        page = query_data["page"]
+        with self._lock:
+            self.pages.append(page)
+        start = (page - 1) * self.per_page
+        headers = dict()
+        total_pages = max(1, -(-len(self.projects) // self.per_page))
+        if self.totals:
+            headers["X-Total-Pages"] = str(total_pages)
+        if page < total_pages:
+            headers["X-Next-Page"] = str(page + 1)
+        body = self.projects[start:start + self.per_page]
+        return SimpleNamespace(headers=headers, json=lambda: body)
+
+@pytest.fixture
+def forge(monkeypatch):
+    def install(*args, **kwargs):
+        gitlab = FakeGitLab(*args, **kwargs)
+        monkeypatch.setattr(common, "gitlab_client",
+                lambda upstream, token: gitlab)
+        return gitlab
+    return install
+
+def test_every_page_is_listed(forge):
+    gitlab = forge(250)
+    projects = common.list_projects("gitlab.example.org", "token")
+    assert [p["id"] for p in projects] == list(range(250))
+    assert sorted(gitlab.pages) == [1, 2, 3]
+    assert projects[0] == {
+        "id": 0,
+        "name_with_namespace": "Alice / Project 000",
+        "web_url": "https://gitlab.example.org/alice/project0",
+    }
+
+def test_single_page(forge):
+    gitlab = forge(3)
+    assert len(common.list_projects("gitlab.example.org", "token")) == 3
+    assert gitlab.pages == [1]
+
+def test_pages_without_totals(forge):
+    gitlab = forge(250, totals=False)
+    projects = common.list_projects("gitlab.example.org", "token")
+    assert len(projects) == 250
+    assert gitlab.pages == [1, 2, 3]
+
+def test_projects_are_sorted(forge):
+    gitlab = forge(3)
+    gitlab.projects.reverse()
+    projects = common.list_projects("gitlab.example.org", "token")
+    assert [p["id"] for p in projects] == [0, 1, 2]
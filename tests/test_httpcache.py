@@ -0,0 +1,116 @@
+import pytest
+from datetime import timedelta
+
+import requests
+from dispatchsrht import httpcache
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+class FakeAdapter(BaseAdapter):
+    """Answers each request with the next of a list of responses."""
+    def __init__(self, *responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.requests = list()
+
+    def send(self, request, **kwargs):
+        self.requests.append(dict(request.headers))
+        status, headers, content = self.responses.pop(0)
+        resp = requests.Response()
+        resp.status_code = status
+        resp.reason = "OK"
+        resp.headers = CaseInsensitiveDict(headers)
+        resp._content = content
+        resp.url = request.url
+        resp.request = request
+        resp.elapsed = timedelta(0)
+        resp.connection = self
+        return resp
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(httpcache, "response_store",
+            httpcache.ResponseStore(16))
+    def mount(*responses):
+        session = httpcache.ConditionalSession()
+        adapter = FakeAdapter(*responses)
+        session.mount("https://", adapter)
+        return session, adapter
+    return mount
+
+def test_not_modified_is_served_from_cache(session):
+    s, adapter = session(
+        (200, {"ETag": '"v1"', "Content-Type": "application/json"}, b"[1]"),
+        (304, {"ETag": '"v1"', "X-RateLimit-Remaining": "4999"}, b""))
+    headers = {"Authorization": "token a"}
+    assert s.get("https://api.example.org/repos", headers=headers).json() == [1]
+    resp = s.get("https://api.example.org/repos", headers=headers)
+    assert resp.status_code == 200
+    assert resp.json() == [1]
+    assert resp.headers["X-RateLimit-Remaining"] == "4999"
+    assert adapter.requests[1]["If-None-Match"] == '"v1"'
+
+def test_changed_response_replaces_cache(session):
+    s, adapter = session(
+        (200, {"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, b"old"),
+        (200, {"ETag": '"v2"'}, b"new"),
+        (304, {}, b""))
+    for _ in range(3):
+        resp = s.get("https://api.example.org/repo")
+    assert resp.content == b"new"
+    assert adapter.requests[1]["If-Modified-Since"] == (
+            "Mon, 01 Jan 2024 00:00:00 GMT")
+    assert adapter.requests[2]["If-None-Match"] == '"v2"'
+
+def test_cache_is_per_token(session):
+    s, adapter = session(
+        (200, {"ETag": '"v1"'}, b"alice"),
+        (200, {"ETag": '"v1"'}, b"bob"))
+    s.get("https://api.example.org/user", headers={"Authorization": "token a"})
+    resp = s.get("https://api.example.org/user",
+            headers={"Authorization": "token b"})
+    assert resp.content == b"bob"
+    assert "If-None-Match" not in adapter.requests[1]
+
+def test_uncacheable_responses(session):
+    s, adapter = session(
+        (200, {}, b"no validator"),
+        (404, {"ETag": '"v1"'}, b"not found"),
+        (200, {}, b"again"))
+    for _ in range(3):
+        s.get("https://api.example.org/thing")
+    assert all("If-None-Match" not in r for r in adapter.requests)
+
+def test_only_get_is_cached(session):
+    s, adapter = session(
+        (200, {"ETag": '"v1"'}, b"created"),
+        (200, {"ETag": '"v1"'}, b"created"))
+    s.post("https://api.example.org/thing")
+    s.post("https://api.example.org/thing")
+    assert "If-None-Match" not in adapter.requests[1]
+
+def test_shared_store(monkeypatch, fake_redis):
+    monkeypatch.setattr(httpcache, "redis", fake_redis)
+    httpcache.ResponseStore(16, shared=True).set("key", {"status": 200})
+    assert httpcache.ResponseStore(16, shared=True).get("key") == {
+            "status": 200}
+
+def test_store_byte_budget():
+    def entry(size):
+        return {"status": 200, "headers": {"ETag": "x"}, "content": "a" * size}
+    store = httpcache.ResponseStore(16, max_bytes=250)
+    store.set("a", entry(100))
+    store.set("b", entry(100))
+    store.get("a")
+    store.set("c", entry(100))
+    # The least recently used response makes way for the new one
+    assert store.get("b") is None
+    assert store.get("a") and store.get("c")
+    assert store.local.bytes == 210
+    # Responses larger than the whole budget are not kept at all
+    store.set("d", entry(300))
+    assert store.get("d") is None
+    assert len(store.local) == 2
@@ -0,0 +1,80 @@
+import json
+import pytest
+
+from dispatchsrht import idempotency
+
+@pytest.fixture
+def webhook(app, fake_redis, monkeypatch):
+    """An idempotent webhook view which counts how often it runs."""
+    monkeypatch.setattr(idempotency, "redis", fake_redis)
+    calls = list()
+    outcome = {"text": "Submitted", "code": 200}
+
+    @app.route("/webhook/<record_id>", methods=["POST"])
+    @idempotency.idempotent
+    def webhook(record_id):
+        calls.append(record_id)
+        if "raise" in outcome:
+            raise outcome["raise"]
+        return outcome["text"], outcome["code"]
+
+    def deliver(delivery="1234", record_id="abc", **kwargs):
+        headers = {"X-GitHub-Delivery": delivery} if delivery else {}
+        with app.test_request_context(f"/webhook/{record_id}",
+                method="POST", headers=headers, **kwargs):
+            return app.make_response(webhook(record_id))
+    deliver.calls = calls
+    deliver.outcome = outcome
+    return deliver
+
+def test_redelivery_replays_outcome(webhook):
+    first = webhook()
+    second = webhook()
+    assert webhook.calls == ["abc"]
+    assert second.status_code == first.status_code == 200
+    assert second.get_data(as_text=True) == "Submitted"
+
+def test_deliveries_are_distinct_per_hook_and_id(webhook):
+    webhook(delivery="1")
+    webhook(delivery="2")
+    webhook(delivery="1", record_id="def")
+    assert webhook.calls == ["abc", "abc", "def"]
+
+def test_gitlab_event_uuid(webhook, app):
+    with app.test_request_context("/webhook/abc", method="POST",
+            headers={"X-Gitlab-Event-UUID": "5678"}):
+        assert idempotency.delivery_id() == "5678"
+
+def test_deliveries_without_id_always_run(webhook):
+    webhook(delivery=None)
+    webhook(delivery=None)
+    assert webhook.calls == ["abc", "abc"]
+
+def test_pending_delivery_is_not_run_again(webhook, fake_redis):
+    fake_redis.set(idempotency._key("abc", "1234"),
+            json.dumps({"pending": True}))
+    resp = webhook()
+    assert resp.status_code == 202
+    assert webhook.calls == []
+
+def test_server_errors_are_retried(webhook):
+    webhook.outcome["code"] = 500
+    webhook()
+    webhook.outcome["code"] = 200
+    resp = webhook()
+    assert resp.status_code == 200
+    assert webhook.calls == ["abc", "abc"]
+
+def test_exceptions_are_retried(webhook):
+    webhook.outcome["raise"] = RuntimeError("boom")
+    with pytest.raises(RuntimeError):
+        webhook()
+    del webhook.outcome["raise"]
+    assert webhook().status_code == 200
+    assert webhook.calls == ["abc", "abc"]
+
+def test_dequeued_delivery_records_outcome(webhook):
+    webhook(environ_overrides={"dispatchsrht.dequeued": True})
+    resp = webhook()
+    assert webhook.calls == ["abc"]
+    assert resp.get_data(as_text=True) == "Submitted"
@@ -0,0 +1,48 @@
+import importlib
+import pytest
+
+pytest.importorskip("cryptography")
+
+from cryptography.fernet import InvalidToken
+from dispatchsrht import keyring
+
+@pytest.fixture
+def keys(monkeypatch):
+    """Replaces the service keys, and forgets the key ring derived so far."""
+    def install(current, *old):
+        monkeypatch.setattr(keyring, "_secret_key", current)
+        monkeypatch.setattr(keyring, "_old_keys", list(old))
+        keyring.key_ring.cache_clear()
+    yield install
+    keyring.key_ring.cache_clear()
+
+def test_round_trip(keys):
+    keys("current")
+    assert keyring.decrypt(keyring.encrypt(b"payload")) == b"payload"
+
+def test_old_keys_still_decrypt(keys):
+    keys("old")
+    token = keyring.encrypt(b"payload")
+    keys("new", "old")
+    assert keyring.decrypt(token) == b"payload"
+    keys("new")
+    with pytest.raises(InvalidToken):
+        keyring.decrypt(token)
+
+def test_keys_are_derived_once(keys, monkeypatch):
+    keys("current")
+    derived = list()
+    derive_key = keyring.derive_key
+    monkeypatch.setattr(keyring, "derive_key",
+            lambda secret: derived.append(secret) or derive_key(secret))
+    for _ in range(3):
+        keyring.encrypt(b"payload")
+    assert derived == ["current"]
+
+def test_keys_are_derived_once_per_process():
+    # As when a process starts: importing derives nothing
+    importlib.reload(keyring)
+    assert keyring.derive_key.cache_info().currsize == 0
+    for _ in range(3):
+        keyring.decrypt(keyring.encrypt(b"payload"))
+    assert keyring.derive_key.cache_info().misses == 1
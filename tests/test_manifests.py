@@ -0,0 +1,63 @@
+import pytest
+
+from dispatchsrht import manifests
+from dispatchsrht.manifests import ManifestCache
+
+def test_fetch_downloads_only_missing_blobs():
+    cache = ManifestCache(16)
+    downloads = list()
+    def download(oids):
+        downloads.append(oids)
+        return {oid: f"text of {oid}" for oid in oids}
+
+    assert cache.fetch([("a.yml", "1"), ("b.yml", "2")], download) == [
+            ("a.yml", "text of 1"), ("b.yml", "text of 2")]
+    # Renamed files with the same content are still cached
+    assert cache.fetch([("c.yml", "1"), ("d.yml", "3")], download) == [
+            ("c.yml", "text of 1"), ("d.yml", "text of 3")]
+    assert downloads == [["1", "2"], ["3"]]
+
+def test_fetch_skips_blobs_which_could_not_be_downloaded():
+    cache = ManifestCache(16)
+    assert cache.fetch([("a.yml", "1"), ("b.yml", "2")],
+            lambda oids: {"2": "b"}) == [("b.yml", "b")]
+
+def test_shared_cache(monkeypatch, fake_redis):
+    monkeypatch.setattr(manifests, "redis", fake_redis)
+    ManifestCache(16, shared=True).set("1", "image: alpine/edge")
+    other = ManifestCache(16, shared=True)
+    assert other.get("1") == "image: alpine/edge"
+    assert fake_redis.ttl(other._key("1")) > 0
+
+def test_local_cache_is_bounded():
+    cache = ManifestCache(2)
+    for oid in "123":
+        cache.set(oid, oid)
+    assert cache.get("1") is None
+    assert cache.get("3") == "3"
+
+_manifest = """
+image: alpine/edge
+packages:
+  - git
+tasks:
+  - build: |
+      make
+"""
+
+def test_parse_manifest_returns_copies():
+    first = manifests.parse_manifest(_manifest)
+    first.environment = {"FOO": "bar"}
+    second = manifests.parse_manifest(_manifest)
+    assert second is not first
+    assert not second.environment
+    assert second.image == "alpine/edge"
+
+def test_parse_manifest_validates():
+    with pytest.raises(Exception):
+        manifests.parse_manifest("tasks: nope")
+
+def test_dump_manifest_round_trips():
+    manifest = manifests.parse_manifest(_manifest)
+    again = manifests.parse_manifest(manifests.dump_manifest(manifest))
+    assert again.to_dict() == manifest.to_dict()
@@ -0,0 +1,152 @@
+import pytest
+from types import SimpleNamespace
+
+pytest.importorskip("github")
+
+import sqlalchemy as sa
+from dispatchsrht.tasks.github import org
+from github import GithubException
+
+def model(name, records=()):
+    return type(name, (), {
+        "__tablename__": name.lower(),
+        "id": sa.column("id"),
+        "user_id": sa.column("user_id"),
+        "repo": sa.column("repo"),
+        "github_webhook_id": sa.column("github_webhook_id"),
+        "query": SimpleNamespace(filter=lambda *args: records),
+    })
+
+class FakeSession:
+    """
+    Answers index queries with the rows of the queried model, or those of
+    the requested IDs.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def query(self, id, *columns):
+        self.queries += 1
+        [rows] = [rows for cls, rows in self.rows.items() if cls.id is id]
+        def filter(*args):
+            ids = [arg.right.value for arg in args[1:]]
+            return [row for row in rows if not ids or row[0] in ids[0]]
+        return SimpleNamespace(filter=filter)
+
+@pytest.fixture
+def routes(monkeypatch):
+    subscribers = list()
+    monkeypatch.setattr(org, "routing_cache", SimpleNamespace(
+        subscribe=subscribers.append, listen=lambda: None))
+    push, pull_request = model("Push"), model("PullRequest")
+    session = FakeSession({
+        push: [
+            ("a", 1, "Example/Widget"),
+            ("b", 1, "example/widget"),
+            ("c", 2, "example/widget"),
+        ],
+        pull_request: [("d", 1, "example/gadget")],
+    })
+    monkeypatch.setattr(org, "db", SimpleNamespace(session=session))
+    monkeypatch.setattr(org, "_routes", {
+        "push": ("push._webhook", push),
+        "pull_request": ("pull_request._webhook", pull_request),
+    })
+    routes = org.RepoRoutes()
+    routes.session = session
+    routes.subscribers = subscribers
+    return routes, push, pull_request
+
+def test_lookup(routes):
+    routes, push, pull_request = routes
+    assert routes.lookup(push, 1, "EXAMPLE/widget") == ["a", "b"]
+    assert routes.lookup(push, 2, "example/widget") == ["c"]
+    assert routes.lookup(pull_request, 1, "example/gadget") == ["d"]
+    assert routes.lookup(pull_request, 1, "example/widget") == []
+    # One query per task type to build the index, then none
+    assert routes.session.queries == 2
+
+def test_index_is_rebuilt_after_changes(routes):
+    routes, push, _ = routes
+    routes.lookup(push, 1, "example/widget")
+    [invalidate] = routes.subscribers
+    invalidate("*")
+    routes.session.rows[push].append(("e", 1, "example/widget"))
+    assert routes.lookup(push, 1, "example/widget") == ["a", "b", "e"]
+    assert routes.session.queries == 4
+
+def test_changed_records_are_reloaded(routes):
+    routes, push, pull_request = routes
+    routes.lookup(push, 1, "example/widget")
+    [invalidate] = routes.subscribers
+    rows = routes.session.rows[push]
+    # b moved to another repository, and e was added
+    rows[1] = ("b", 1, "example/gizmo")
+    rows.append(("e", 2, "example/widget"))
+    invalidate("push:b")
+    invalidate("push:e")
+    # Neither task type's records, nor changed ones of other tasks, matter
+    invalidate("pullrequest:d")
+    invalidate("gitlab_commit_to_build:f")
+    assert routes.lookup(push, 1, "example/widget") == ["a"]
+    assert routes.lookup(push, 1, "example/gizmo") == ["b"]
+    assert routes.lookup(push, 2, "example/widget") == ["c", "e"]
+    assert routes.lookup(pull_request, 1, "example/gadget") == ["d"]
+    # Only the changed records of each task type are queried
+    assert routes.session.queries == 4
+    # Records which were deleted, or given a webhook of their own, are gone
+    del rows[0]
+    invalidate("push:a")
+    assert routes.lookup(push, 1, "example/widget") == []
+    assert routes.session.queries == 5
+
+def test_message():
+    assert org._message(GithubException(422,
+        {"message": "Validation Failed"}, None)) == "Validation Failed"
+    assert org._message(GithubException(404, "Not Found", None)) == "HTTP 404"
+
+class FakeRepo:
+    def __init__(self, name, hooks):
+        self.name = name
+        self.hooks = hooks
+
+    def create_hook(self, name, config, events, active):
+        if self.name.endswith("/private"):
+            raise GithubException(404, {"message": "Not Found"}, None)
+        self.hooks.append((self.name, config["url"], events))
+        return SimpleNamespace(id=len(self.hooks) + 100)
+
+def test_recreate_repo_hooks(monkeypatch, fake_db):
+    hooks = list()
+    records = [
+        SimpleNamespace(id="a", repo="Example/widget", github_webhook_id=-1),
+        SimpleNamespace(id="b", repo="example/private", github_webhook_id=-1),
+        SimpleNamespace(id="c", repo="other/widget", github_webhook_id=-1),
+    ]
+    monkeypatch.setattr(org, "_routes", {
+        "push": ("push._webhook", model("Push", records)),
+    })
+    monkeypatch.setattr(org, "db", fake_db)
+    monkeypatch.setattr(org, "current_user", SimpleNamespace(id=1))
+    monkeypatch.setattr(org, "_root", "https://dispatch.example.org")
+    monkeypatch.setattr(org, "url_for",
+            lambda endpoint, record_id: f"/{endpoint}/{record_id}")
+    monkeypatch.setattr(org, "github_client", lambda token:
+            SimpleNamespace(get_repo=lambda name, lazy:
+                FakeRepo(name, hooks)))
+    errors = org._recreate_repo_hooks("token", "example")
+    assert errors == ["example/private: Not Found"]
+    assert hooks == [("Example/widget",
+        "https://dispatch.example.org/push._webhook/a", ["push"])]
+    assert [r.github_webhook_id for r in records] == [101, -1, -1]
+    assert fake_db.session.commits == 1
+
+def test_nothing_to_recreate(monkeypatch, fake_db):
+    monkeypatch.setattr(org, "_routes", {
+        "push": ("push._webhook", model("Push")),
+    })
+    monkeypatch.setattr(org, "db", fake_db)
+    monkeypatch.setattr(org, "current_user", SimpleNamespace(id=1))
+    assert org._recreate_repo_hooks("token", "example") == []
+    assert fake_db.session.commits == 0
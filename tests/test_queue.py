@@ -0,0 +1,194 @@
+import json
+import pytest
+from types import SimpleNamespace
+from uuid import uuid4
+
+from dispatchsrht import queue
+from dispatchsrht.types import DeliveryStatus
+
+@pytest.fixture
+def webhook(app, monkeypatch, fake_db):
+    """A queueable webhook view, and the deliveries it queues."""
+    handled, queued = list(), list()
+    monkeypatch.setattr(queue, "queue_enabled", True)
+    monkeypatch.setattr(queue, "db", fake_db)
+    monkeypatch.setattr(queue, "enqueue",
+            lambda endpoint, view_args, **kwargs:
+                queued.append((endpoint, view_args, kwargs)))
+    hook = SimpleNamespace(task_id=1, debounce=0)
+    monkeypatch.setattr(queue.routing_cache, "resolve",
+            lambda record_cls, record_id: (hook, None))
+
+    @app.route("/webhook/<record_id>", methods=["POST"])
+    @queue.queueable("webhook", object)
+    def webhook(record_id):
+        handled.append(record_id)
+        return "Handled"
+    return SimpleNamespace(app=app, hook=hook, handled=handled, queued=queued)
+
+def post(app, view, path, **kwargs):
+    kwargs.setdefault("json", {"ref": "refs/heads/master"})
+    with app.test_request_context(path, method="POST", **kwargs):
+        return app.make_response(view(record_id=path.split("/")[-1]))
+
+def test_disabled_queue_handles_in_request(webhook, monkeypatch):
+    monkeypatch.setattr(queue, "queue_enabled", False)
+    record_id = str(uuid4())
+    resp = post(webhook.app, webhook.app.view_functions["webhook"],
+            f"/webhook/{record_id}")
+    assert resp.status_code == 200
+    assert webhook.handled == [record_id]
+    assert webhook.queued == []
+
+def test_delivery_is_queued(webhook):
+    record_id = str(uuid4())
+    resp = post(webhook.app, webhook.app.view_functions["webhook"],
+            f"/webhook/{record_id}")
+    assert resp.status_code == 202
+    assert webhook.handled == []
+    assert webhook.queued == [("webhook", {"record_id": record_id}, {})]
+
+def test_dequeued_delivery_is_handled(webhook):
+    record_id = str(uuid4())
+    resp = post(webhook.app, webhook.app.view_functions["webhook"],
+            f"/webhook/{record_id}",
+            environ_overrides={"dispatchsrht.dequeued": True})
+    assert resp.status_code == 200
+    assert webhook.handled == [record_id]
+
+def test_invalid_deliveries_are_not_queued(webhook, monkeypatch):
+    view = webhook.app.view_functions["webhook"]
+    assert post(webhook.app, view, "/webhook/nope").status_code == 400
+    assert post(webhook.app, view, f"/webhook/{uuid4()}",
+            json=None, data="not json").status_code == 400
+    monkeypatch.setattr(queue.routing_cache, "resolve",
+            lambda record_cls, record_id: (None, None))
+    assert post(webhook.app, view, f"/webhook/{uuid4()}").status_code == 404
+    assert webhook.queued == []
+
+@pytest.fixture
+def replay(app, fake_db, monkeypatch):
+    """Replays a delivery against a view which returns a given outcome."""
+    monkeypatch.setattr(queue, "db", fake_db)
+    outcome = dict()
+
+    @app.route("/replay/<record_id>", methods=["POST"])
+    def replay(record_id):
+        assert queue.is_dequeued()
+        if "raise" in outcome:
+            raise outcome["raise"]
+        return outcome.get("text", "Submitted"), outcome.get("code", 200)
+
+    def go(attempts=1, **kwargs):
+        outcome.clear()
+        outcome.update(kwargs)
+        delivery = SimpleNamespace(
+                endpoint="replay",
+                path="/replay/abc",
+                view_args=json.dumps({"record_id": "abc"}),
+                headers=json.dumps({"Content-Type": "application/json"}),
+                body="{}",
+                attempts=attempts,
+                status=DeliveryStatus.running,
+                run_after=None)
+        queue.process(app, delivery)
+        return delivery
+    return go
+
+def test_process_completes_delivery(replay):
+    delivery = replay()
+    assert delivery.status == DeliveryStatus.complete
+    assert delivery.response_code == 200
+    assert delivery.response == "Submitted"
+
+def test_process_completes_client_errors(replay):
+    delivery = replay(code=404, text="Unknown hook")
+    assert delivery.status == DeliveryStatus.complete
+    assert delivery.response_code == 404
+
+def test_process_retries_server_errors(replay):
+    delivery = replay(attempts=2, code=502)
+    assert delivery.status == DeliveryStatus.pending
+    assert delivery.run_after is not None
+
+def test_process_retries_exceptions(replay, fake_db):
+    delivery = replay(**{"raise": RuntimeError("boom")})
+    assert delivery.status == DeliveryStatus.pending
+    assert delivery.response_code == 500
+    assert "boom" in delivery.response
+    assert fake_db.session.rollbacks == 1
+
+def test_process_gives_up(replay):
+    delivery = replay(attempts=queue._max_attempts, code=500)
+    assert delivery.status == DeliveryStatus.failed
+
+def test_coalesce_pushes():
+    hook = SimpleNamespace(task_id=7, debounce=30)
+    assert queue.coalesce_pushes(hook, {"ref": "refs/heads/dev"}) == (
+            "7:refs/heads/dev", 30)
+    assert queue.coalesce_pushes(hook, {}) is None
+    hook.debounce = 0
+    assert queue.coalesce_pushes(hook, {"ref": "refs/heads/dev"}) is None
+
+@pytest.mark.parametrize("form,expected", [
+    ({}, 45),
+    ({"debounce": "20"}, 20),
+    ({"debounce": "-5"}, 0),
+    ({"debounce": "100000"}, 600),
+])
+def test_validate_debounce(app, form, expected):
+    from srht.validation import Validation
+    from flask import request
+    with app.test_request_context("/", method="POST", data=form):
+        valid = Validation(request)
+        assert queue.validate_debounce(valid, 45) == expected
+        assert valid.ok
+
+def test_validate_debounce_rejects_text(app):
+    from srht.validation import Validation
+    from flask import request
+    with app.test_request_context("/", method="POST",
+            data={"debounce": "soon"}):
+        valid = Validation(request)
+        assert queue.validate_debounce(valid, 45) is None
+        assert not valid.ok
+
+def test_pushes_are_coalesced(webhook, app, monkeypatch):
+    superseded, held = list(), list()
+    old = SimpleNamespace(body=json.dumps({"after": "abc"}))
+    monkeypatch.setattr(queue, "supersede",
+            lambda key: held.append(key) or [old])
+
+    @app.route("/push/<record_id>", methods=["POST"])
+    @queue.queueable("push", object, coalesce=queue.coalesce_pushes,
+            superseded=lambda hook, auth, payload: superseded.append(payload))
+    def push(record_id):
+        return "Handled"
+
+    webhook.hook.debounce = 30
+    record_id = str(uuid4())
+    resp = post(app, app.view_functions["push"], f"/push/{record_id}")
+    assert resp.status_code == 202
+    assert held == ["1:refs/heads/master"]
+    assert webhook.queued == [("push", {"record_id": record_id},
+        {"delay": 30, "coalesce_key": "1:refs/heads/master"})]
+    assert superseded == [{"after": "abc"}]
+
+def test_maintain(monkeypatch, fake_db):
+    ran = list()
+    monkeypatch.setattr(queue, "db", fake_db)
+    monkeypatch.setattr(queue, "_maintenance", list())
+    for name in ["flush_outbox", "prune", "prune_callbacks"]:
+        monkeypatch.setattr(queue, name, lambda name=name: ran.append(name))
+    queue.on_maintain(lambda: ran.append("prune_jobs"))
+    queue.maintain()
+    assert ran == ["flush_outbox", "prune", "prune_callbacks", "prune_jobs"]
+
+def test_maintain_rolls_back(monkeypatch, fake_db):
+    def fail():
+        raise RuntimeError("database went away")
+    monkeypatch.setattr(queue, "db", fake_db)
+    monkeypatch.setattr(queue, "flush_outbox", fail)
+    with pytest.raises(RuntimeError):
+        queue.maintain()
+    assert fake_db.session.rollbacks == 1
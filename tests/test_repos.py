@@ -0,0 +1,79 @@
+import pytest
+from types import SimpleNamespace
+
+from dispatchsrht import repos
+from dispatchsrht.repos import RepoIndex, search_repos
+
+class InlineThread:
+    """Runs the target when started, so that tests need not wait on it."""
+    def __init__(self, target, daemon=False):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+@pytest.fixture
+def index(monkeypatch, fake_redis):
+    clock = SimpleNamespace(now=1000)
+    monkeypatch.setattr(repos, "redis", fake_redis)
+    monkeypatch.setattr(repos, "time", SimpleNamespace(time=lambda: clock.now))
+    monkeypatch.setattr(repos, "threading",
+            SimpleNamespace(Thread=InlineThread))
+    fetches = list()
+    def fetch(token):
+        fetches.append(token)
+        return [{"full_name": f"alice/repo{len(fetches)}"}]
+    index = RepoIndex("github", fetch, ttl=300)
+    index.fetches = fetches
+    index.clock = clock
+    return index
+
+def test_first_get_fetches_in_background(index):
+    assert index.get(1, "token") is None
+    assert index.fetches == ["token"]
+    assert index.get(1, "token") == [{"full_name": "alice/repo1"}]
+    assert index.fetches == ["token"]
+
+def test_stale_lists_are_served_while_refreshed(index):
+    index.get(1, "token")
+    index.clock.now += 301
+    assert index.get(1, "token") == [{"full_name": "alice/repo1"}]
+    assert index.get(1, "token") == [{"full_name": "alice/repo2"}]
+
+def test_refresh(index):
+    index.get(1, "token")
+    index.get(1, "token", refresh=True)
+    assert len(index.fetches) == 2
+
+def test_one_fetch_at_a_time(index, fake_redis):
+    fake_redis.set(index._key(1) + ".lock", 1)
+    assert index.get(1, "token") is None
+    assert index.fetches == []
+
+def test_failed_fetch_releases_lock(index, fake_redis):
+    def fail(token):
+        raise RuntimeError("GitHub is down")
+    index.fetch = fail
+    assert index.get(1, "token") is None
+    assert fake_redis.get(index._key(1) + ".lock") is None
+
+def test_lists_are_per_key(index):
+    index.get(1, "a")
+    index.get(2, "b")
+    assert index.get(2, "b") == [{"full_name": "alice/repo2"}]
+
+def test_search_repos():
+    all_repos = [{"full_name": f"alice/Repo{n}"} for n in range(30)]
+    page, number, total = search_repos(all_repos, None, 1, per_page=25)
+    assert len(page) == 25 and number == 1 and total == 2
+    page, number, total = search_repos(all_repos, None, 9, per_page=25)
+    assert len(page) == 5 and number == 2
+    page, number, total = search_repos(all_repos, "repo1", 1)
+    assert [r["full_name"] for r in page] == ["alice/Repo1"] + [
+            f"alice/Repo{n}" for n in range(10, 20)]
+    assert search_repos(all_repos, "nothing", 0) == ([], 1, 1)
+
+def test_search_repos_key():
+    projects = [{"name_with_namespace": "Alice / Project"}]
+    assert search_repos(projects, "alice / p", 1,
+            key="name_with_namespace")[0] == projects
@@ -0,0 +1,132 @@
+import pytest
+from types import SimpleNamespace
+
+import sqlalchemy as sa
+from dispatchsrht import routing
+
+Base = sa.orm.declarative_base()
+
+class Record(Base):
+    __tablename__ = "record"
+    id = sa.Column(sa.Unicode, primary_key=True)
+    user_id = sa.Column(sa.Integer)
+
+class Authorization(Base):
+    __tablename__ = "authorization"
+    user_id = sa.Column(sa.Integer, primary_key=True)
+    token = sa.Column(sa.Unicode)
+
+class FakeSession:
+    """Answers every routing query with the same row."""
+    def __init__(self, row):
+        self.row = row
+        self.queries = 0
+        self.identity_map = dict()
+
+    def query(self, *entities):
+        self.queries += 1
+        return self
+
+    def outerjoin(self, *args):
+        return self
+
+    def filter(self, *args):
+        return self
+
+    def first(self):
+        return self.row
+
+    def merge(self, obj, load=True):
+        assert not load
+        return obj
+
+@pytest.fixture
+def cache(monkeypatch):
+    clock = SimpleNamespace(now=0)
+    monkeypatch.setattr(routing, "time",
+            SimpleNamespace(monotonic=lambda: clock.now))
+    def make(row):
+        session = FakeSession(row)
+        monkeypatch.setattr(routing, "db", SimpleNamespace(session=session))
+        cache = routing.RoutingCache(ttl=60)
+        cache._routes[Record] = (Authorization, ["user_id"])
+        cache.listen = lambda: None
+        return cache, session, clock
+    return make
+
+def test_resolve_is_cached(cache):
+    hook, auth = Record(id="a", user_id=1), Authorization(user_id=1)
+    routes, session, clock = cache((hook, auth))
+    assert [o.user_id for o in routes.resolve(Record, "a")] == [1, 1]
+    assert [o.user_id for o in routes.resolve(Record, "a")] == [1, 1]
+    assert session.queries == 1
+    clock.now = 61
+    routes.resolve(Record, "a")
+    assert session.queries == 2
+
+def test_missing_records_are_cached_briefly(cache):
+    routes, session, clock = cache(None)
+    assert routes.resolve(Record, "a") == (None, None)
+    routes.resolve(Record, "a")
+    assert session.queries == 1
+    clock.now = routing._negative_ttl + 1
+    routes.resolve(Record, "a")
+    assert session.queries == 2
+
+def test_records_without_authorization(cache):
+    routes, _, _ = cache((Record(id="a", user_id=1), None))
+    hook, auth = routes.resolve(Record, "a")
+    assert hook.id == "a" and auth is None
+
+def test_session_objects_stay_attached(monkeypatch):
+    engine = sa.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sa.orm.Session(engine)
+    session.add_all([Record(id="a", user_id=1),
+        Authorization(user_id=1, token="secret")])
+    session.commit()
+    monkeypatch.setattr(routing, "db", SimpleNamespace(session=session))
+    routes = routing.RoutingCache(ttl=60)
+    routes._routes[Record] = (Authorization, ["user_id"])
+    routes.listen = lambda: None
+    # The caller already holds the record, which the query hands back
+    record = session.query(Record).one()
+    hook, auth = routes.resolve(Record, "a")
+    assert hook is record and record in session
+    assert auth in session and auth.token == "secret"
+    record.user_id = 2
+    hook, _ = routes.resolve(Record, "a")
+    assert hook is record and hook.user_id == 2
+    # Copies are made for a new session, without querying again
+    session.close()
+    hook, auth = routes.resolve(Record, "a")
+    assert hook is not record and hook in session
+    assert (hook.user_id, auth.token) == (1, "secret")
+
+def test_drop(cache):
+    routes, session, _ = cache((Record(id="a"), Authorization()))
+    dropped = list()
+    routes.subscribe(dropped.append)
+    routes.resolve(Record, "a")
+    routes.resolve(Record, "b")
+    routes._drop("record:a")
+    routes.resolve(Record, "a")
+    routes.resolve(Record, "b")
+    assert session.queries == 3
+    routes._drop("*")
+    routes.resolve(Record, "b")
+    assert session.queries == 4
+    assert dropped == ["record:a", "*"]
+
+def test_changes_notify_other_nodes(cache):
+    routes, _, _ = cache(None)
+    statements = list()
+    connection = SimpleNamespace(execute=lambda statement, params:
+            statements.append(params))
+    routes._record_changed(None, connection, SimpleNamespace(
+        __tablename__="record", id="a"))
+    routes._changed(None, connection, object())
+    assert statements == [
+        {"channel": routing._channel, "key": "record:a"},
+        {"channel": routing._channel},
+    ]
@@ -0,0 +1,29 @@
+import glob
+import os
+import re
+import pytest
+
+pytest.importorskip("github")
+pytest.importorskip("gitlab")
+
+import dispatchsrht.app
+from srht.database import Base
+
+_versions = os.path.join(os.path.dirname(dispatchsrht.app.__file__),
+        "alembic", "versions")
+
+def migrated_indexes():
+    """Returns the names of the indexes the migrations leave in place."""
+    created, dropped = set(), set()
+    for path in glob.glob(os.path.join(_versions, "*.py")):
+        upgrade = open(path).read().split("def downgrade")[0]
+        created |= set(re.findall(
+            r"(?:create_index\(\s*'|CREATE INDEX )(\w+)", upgrade))
+        dropped |= set(re.findall(r"drop_index\(\s*'(\w+)'", upgrade))
+    return created - dropped
+
+def test_models_declare_the_migrated_indexes():
+    # initdb creates the schema from the models, and stamps it as migrated
+    declared = {index.name for table in Base.metadata.sorted_tables
+            if table.name != "user" for index in table.indexes}
+    assert declared == migrated_indexes()
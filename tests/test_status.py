@@ -0,0 +1,148 @@
+import json
+import os
+import pytest
+
+pytest.importorskip("cryptography")
+
+import requests
+from types import SimpleNamespace
+from dispatchsrht import status
+
+class FakeSession:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.posts = list()
+        self.responses = list()
+
+    def post(self, url, json=None, timeout=None, headers=None):
+        assert timeout
+        if self.fail:
+            raise requests.ConnectionError("unreachable")
+        self.posts.append((url, json, headers["Authorization"]))
+        if self.responses:
+            return self.responses.pop(0)
+        return SimpleNamespace(status_code=201, headers={}, text="")
+
+@pytest.fixture
+def reporter(monkeypatch, fake_redis):
+    monkeypatch.setattr(status, "redis", fake_redis)
+    reporter = status.StatusReporter()
+    reporter._session = FakeSession()
+    # Statuses are posted by flush, not by a background thread
+    reporter._pid = os.getpid()
+    return reporter
+
+def test_newer_status_replaces_queued_one(reporter):
+    reporter.report("https://forge/statuses/abc", "token t1",
+            {"state": "pending", "context": "ci"})
+    reporter.report("https://forge/statuses/abc", "token t1",
+            {"state": "success", "context": "ci"})
+    reporter.report("https://forge/statuses/abc", "token t1",
+            {"state": "pending", "context": "other"})
+    reporter.flush()
+    assert sorted(reporter._session.posts, key=lambda p: p[1]["context"]) == [
+        ("https://forge/statuses/abc",
+            {"state": "success", "context": "ci"}, "token t1"),
+        ("https://forge/statuses/abc",
+            {"state": "pending", "context": "other"}, "token t1"),
+    ]
+    assert reporter._take() == {}
+
+def test_context_field(reporter):
+    reporter.report("https://forge/statuses/abc", "Bearer t",
+            {"state": "running", "name": "ci"}, context_field="name")
+    reporter.report("https://forge/statuses/abc", "Bearer t",
+            {"state": "success", "name": "ci"}, context_field="name")
+    reporter.flush()
+    assert [p[1]["state"] for p in reporter._session.posts] == ["success"]
+
+def test_tokens_are_not_stored_in_the_clear(reporter, fake_redis):
+    reporter.report("https://forge/statuses/abc", "token secret",
+            {"state": "pending", "context": "ci"})
+    for value in fake_redis.hgetall(status._queue).values():
+        assert b"secret" not in value
+
+def test_failed_statuses_are_retried_then_dropped(reporter):
+    reporter._session.fail = True
+    reporter.report("https://forge/statuses/abc", "token t",
+            {"state": "pending", "context": "ci"})
+    for attempt in range(1, status._max_attempts):
+        reporter.flush()
+        [entry] = [json.loads(e) for e in
+                status.redis.hgetall(status._queue).values()]
+        assert entry["attempts"] == attempt
+    reporter.flush()
+    assert reporter._take() == {}
+
+def test_statuses_being_posted_elsewhere_are_left(reporter, fake_redis):
+    reporter.report("https://forge/statuses/abc", "token t",
+            {"state": "pending", "context": "ci"})
+    key = json.dumps(["https://forge/statuses/abc", "ci"])
+    fake_redis.set(reporter._lock_key(key), 1)
+    reporter.flush()
+    assert reporter._session.posts == []
+    fake_redis.delete(reporter._lock_key(key))
+    reporter.flush()
+    assert len(reporter._session.posts) == 1
+
+def queued(reporter):
+    return [json.loads(e) for e in
+            status.redis.hgetall(status._queue).values()]
+
+def test_server_errors_are_retried(reporter):
+    reporter._session.responses.append(
+            SimpleNamespace(status_code=502, headers={}, text="Bad Gateway"))
+    reporter.report("https://forge/statuses/abc", "token t",
+            {"state": "pending", "context": "ci"})
+    reporter.flush()
+    [entry] = queued(reporter)
+    assert entry["attempts"] == 1
+    reporter.flush()
+    assert len(reporter._session.posts) == 2
+    assert queued(reporter) == []
+
+@pytest.mark.parametrize("code,headers", [
+    (429, {"Retry-After": "60"}),
+    (403, {"Retry-After": "60"}),
+    (403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "{reset}"}),
+])
+def test_rate_limited_statuses_wait(reporter, code, headers):
+    reset = str(int(status.time.time()) + 60)
+    headers = {k: v.format(reset=reset) for k, v in headers.items()}
+    reporter._session.responses.append(
+            SimpleNamespace(status_code=code, headers=headers, text=""))
+    reporter.report("https://forge/statuses/abc", "token t",
+            {"state": "pending", "context": "ci"})
+    reporter.flush()
+    [entry] = queued(reporter)
+    assert entry["not_before"] > status.time.time() + 50
+    # Not due yet
+    reporter.flush()
+    assert len(reporter._session.posts) == 1
+
+def test_rejected_statuses_are_dropped(reporter, capsys):
+    reporter._session.responses.append(
+            SimpleNamespace(status_code=422, headers={}, text="Invalid"))
+    reporter.report("https://forge/statuses/abc", "token t",
+            {"state": "pending", "context": "ci"})
+    reporter.flush()
+    assert queued(reporter) == []
+    assert "422 Invalid" in capsys.readouterr().out
+
+def test_retry_after_date(reporter):
+    resp = SimpleNamespace(status_code=429, text="", headers={
+        "Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+    assert status._retry_after(resp) == 0
+
+def test_unreachable_redis_at_exit(reporter, monkeypatch, capsys):
+    def unreachable(*args):
+        raise status.RedisError("Connection refused")
+    monkeypatch.setattr(status.redis, "hgetall", unreachable)
+    reporter._flush_at_exit()
+    assert "Connection refused" in capsys.readouterr().out
+
+def test_nothing_is_flushed_at_exit_without_reports(monkeypatch):
+    def unexpected(*args):
+        raise AssertionError("redis should not be used")
+    monkeypatch.setattr(status, "redis", SimpleNamespace(hgetall=unexpected))
+    status.StatusReporter()._flush_at_exit()